@@ -1,59 +1,69 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_babel import Babel
-from flask import session, request
+from flask import session, request, current_app
 from dotenv import load_dotenv
+import logging
 import os
+import time
+
+from config import config
+from app.utils.i18n import parse_locale, preload_translations, resolve_language
 
 # Carica le variabili dal file .env
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Inizializzazione delle estensioni
 db = SQLAlchemy()
 babel = Babel()
 
 def get_locale():
-    """Funzione per determinare la lingua corrente"""
-    # Se c'è una lingua nella sessione, usala
-    if 'language' in session:
-        return session['language']
-    # Altrimenti usa quella di default
-    return 'it'
-
-def create_app():
-    app = Flask(__name__)
+    """Codice della lingua corrente: quella scelta in sessione, se supportata"""
+    return resolve_language(
+        session.get('language'),
+        current_app.config.get('LANGUAGES', {}),
+        current_app.config.get('BABEL_DEFAULT_LOCALE', 'it')
+    )
+
+def select_locale():
+    """Selettore di Flask-Babel: Locale già pronto, senza parsing ad ogni richiesta"""
+    return parse_locale(get_locale())
+
+def create_app(config_name=None):
+    """
+    Crea l'applicazione Flask applicando la configurazione di config.py.
 
-    token = os.environ.get('TELEGRAM_BOT_TOKEN')
-    print(f"DEBUG: Token da .env = {bool(token)} (lunghezza: {len(token) if token else 0})")
-    if token:
-        print(f"DEBUG: Token preview = {token[:10]}...{token[-4:]}")
-    # La tua configurazione originale - MySQL con le tue variabili .env
-    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
-
-    # Costruisci URL database dalle tue variabili .env
-    db_user = os.environ.get('DB_USER')
-    db_password = os.environ.get('DB_PASSWORD')
-    db_host = os.environ.get('DB_HOST')
-    db_port = os.environ.get('DB_PORT')
-    db_name = os.environ.get('DB_NAME')
-
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'mysql+pymysql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}'
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-    # Configurazione Babel originale
-    app.config['LANGUAGES'] = {
-        'it': 'Italiano',
-        'en': 'English',
-        'fr': 'Français',
-        'de': 'Deutsch',
-        'es': 'Español'
-    }
-    app.config['BABEL_DEFAULT_LOCALE'] = 'it'
-    app.config['BABEL_DEFAULT_TIMEZONE'] = 'UTC'
+    config_name: 'development', 'production' o 'default'. Se non indicato
+    viene letto da FLASK_ENV (default: development).
+
+    L'avvio non tocca il database: lo schema si crea/aggiorna con
+    `flask --app wsgi migrate`. I tempi delle fasi di avvio sono salvati in
+    app.extensions['boot_profile'] (vedi `flask --app wsgi boot-profile`).
+    """
+    boot_started = time.perf_counter()
+    boot_profile = {}
+
+    def mark(phase, since):
+        now = time.perf_counter()
+        boot_profile[phase] = round((now - since) * 1000, 2)
+        return now
+
+    config_name = config_name or os.environ.get('FLASK_ENV') or 'default'
+    if config_name not in config:
+        config_name = 'default'
+
+    app = Flask(__name__)
+    app.config.from_object(config[config_name])
+    phase_started = mark('config', boot_started)
 
     # Inizializzazione estensioni
+    from app.utils.cache import cache
+
     db.init_app(app)
-    babel.init_app(app, locale_selector=get_locale)
+    babel.init_app(app, locale_selector=select_locale)
+    cache.init_app(app)
 
     # Rendi get_locale disponibile nei template
     @app.context_processor
@@ -62,20 +72,48 @@ def create_app():
             'get_locale': get_locale,
             'LANGUAGES': app.config.get('LANGUAGES', {})
         }
+    phase_started = mark('extensions', phase_started)
 
-    # I tuoi blueprint originali
+    # Import dei blueprint: qui vengono caricati una sola volta anche modelli
+    # e helper Telegram usati dalle route
     from app.routes.main import main_bp
     from app.routes.telegram_bot import telegram_bp
     from app.routes.i18n import i18n_bp
-    from app.routes.groups import groups_bp  # Questo era quello mancante!
+    from app.routes.groups import groups_bp
+    phase_started = mark('blueprint_imports', phase_started)
 
     app.register_blueprint(main_bp)
     app.register_blueprint(telegram_bp, url_prefix='/telegram')
     app.register_blueprint(i18n_bp, url_prefix='/i18n')
     app.register_blueprint(groups_bp, url_prefix='/groups')
+    phase_started = mark('blueprint_registration', phase_started)
+
+    # Cataloghi delle lingue (e template compilati) caricati prima del fork dei worker
+    preload_translations(app)
+    phase_started = mark('translations', phase_started)
+
+    register_commands(app)
+
+    mark('total', boot_started)
+    app.extensions['boot_profile'] = boot_profile
+    logger.info(f"App '{config_name}' avviata in {boot_profile['total']} ms: {boot_profile}")
+
+    return app
+
+def register_commands(app):
+    """Comandi CLI: flask --app wsgi <comando>"""
+
+    @app.cli.command('migrate')
+    def migrate_command():
+        """Crea le tabelle mancanti e aggiorna lo schema del database"""
+        from app.migrations import run_migrations
 
-    # Creazione tabelle database
-    with app.app_context():
-        db.create_all()
+        applied = run_migrations()
+        print(f"Schema aggiornato ({len(applied)} passi applicati: {', '.join(applied) or 'nessuno'})")
 
-    return app
\ No newline at end of file
+    @app.cli.command('boot-profile')
+    def boot_profile_command():
+        """Mostra i tempi delle fasi di avvio dell'app (in ms)"""
+        for phase, elapsed in app.extensions['boot_profile'].items():
+            print(f"{phase:<24}{elapsed:>10.2f} ms")
+        print("\nPer il dettaglio degli import: python -X importtime wsgi.py 2> importtime.log")
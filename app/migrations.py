@@ -0,0 +1,306 @@
+"""
+Creazione e aggiornamento dello schema del database
+
+Lo schema non viene più toccato all'avvio dell'app: ogni worker che parte
+farebbe query DDL e di introspezione su MySQL. Si aggiorna esplicitamente con:
+
+    flask --app wsgi migrate        (oppure python setup_database.py)
+"""
+
+import logging
+from datetime import datetime
+
+from sqlalchemy import inspect, insert, select, text
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+
+def run_migrations():
+    """
+    Crea le tabelle mancanti e applica i passi di aggiornamento dello schema.
+
+    Va eseguita dentro un app context. Ogni passo è idempotente: controlla
+    lo schema corrente e non fa nulla se è già aggiornato.
+
+    Returns:
+        list: nomi dei passi applicati
+    """
+    # Importa i modelli per registrarli nei metadata prima di create_all
+    from app import models  # noqa: F401
+
+    db.create_all()
+
+    applied = []
+    for step in MIGRATION_STEPS:
+        if step(db.engine):
+            applied.append(step.__name__)
+            logger.info(f"Migrazione applicata: {step.__name__}")
+
+    return applied
+
+
+def _has_index(engine, table, column):
+    """True se esiste un indice che inizia con la colonna indicata"""
+    return any(
+        index['column_names'] and index['column_names'][0] == column
+        for index in inspect(engine).get_indexes(table)
+    )
+
+
+def add_users_updated_at_index(engine):
+    """Indice su users.updated_at per ETag e delta ?since= di /telegram/users"""
+    if _has_index(engine, 'users', 'updated_at'):
+        return False
+    with engine.begin() as conn:
+        conn.execute(text('CREATE INDEX ix_users_updated_at ON users (updated_at)'))
+    return True
+
+
+def convert_telegram_id_to_bigint(engine):
+    """users.telegram_id da VARCHAR(20) a BIGINT (indice unico più piccolo, confronti interi)"""
+    if engine.dialect.name != 'mysql':
+        return False
+
+    column = next(c for c in inspect(engine).get_columns('users') if c['name'] == 'telegram_id')
+    if 'INT' in str(column['type']).upper():
+        return False
+
+    with engine.begin() as conn:
+        invalid = conn.execute(text(
+            "SELECT telegram_id FROM users WHERE telegram_id NOT REGEXP '^-?[0-9]+$' LIMIT 10"
+        )).scalars().all()
+        if invalid:
+            raise RuntimeError(
+                f"Impossibile convertire users.telegram_id in BIGINT, valori non numerici: {', '.join(invalid)}"
+            )
+        conn.execute(text('ALTER TABLE users MODIFY telegram_id BIGINT NOT NULL'))
+    return True
+
+
+def move_message_text_to_bodies(engine, batch_size=1000):
+    """
+    message_logs.message_text -> message_bodies (un testo per hash) + body_id.
+
+    I testi vengono copiati a blocchi, poi la colonna TEXT viene eliminata.
+    """
+    from app.models import MessageBody
+
+    columns = {c['name'] for c in inspect(engine).get_columns('message_logs')}
+    if 'message_text' not in columns:
+        return False
+
+    if 'body_id' not in columns:
+        with engine.begin() as conn:
+            conn.execute(text('ALTER TABLE message_logs ADD COLUMN body_id INTEGER NULL'))
+
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                'SELECT id, message_text FROM message_logs '
+                'WHERE id > :last_id AND body_id IS NULL ORDER BY id LIMIT :limit'
+            ), {'last_id': last_id, 'limit': batch_size}).all()
+            if not rows:
+                break
+
+            by_hash = {MessageBody.hash_text(row.message_text): row.message_text for row in rows}
+            known = {
+                h: body_id for h, body_id in conn.execute(
+                    select(MessageBody.hash, MessageBody.id).where(MessageBody.hash.in_(list(by_hash)))
+                )
+            }
+            missing = [
+                {'hash': h, 'content': message_text, 'created_at': datetime.utcnow()}
+                for h, message_text in by_hash.items() if h not in known
+            ]
+            if missing:
+                conn.execute(insert(MessageBody), missing)
+                known.update(conn.execute(
+                    select(MessageBody.hash, MessageBody.id)
+                    .where(MessageBody.hash.in_([m['hash'] for m in missing]))
+                ).all())
+
+            conn.execute(
+                text('UPDATE message_logs SET body_id = :body_id WHERE id = :id'),
+                [{'body_id': known[MessageBody.hash_text(row.message_text)], 'id': row.id} for row in rows]
+            )
+            last_id = rows[-1].id
+
+    with engine.begin() as conn:
+        if not _has_index(engine, 'message_logs', 'body_id'):
+            conn.execute(text('CREATE INDEX ix_message_logs_body_id ON message_logs (body_id)'))
+        if engine.dialect.name == 'mysql':
+            conn.execute(text('ALTER TABLE message_logs MODIFY body_id INTEGER NOT NULL'))
+            conn.execute(text(
+                'ALTER TABLE message_logs ADD CONSTRAINT fk_message_logs_body_id '
+                'FOREIGN KEY (body_id) REFERENCES message_bodies (id)'
+            ))
+        conn.execute(text('ALTER TABLE message_logs DROP COLUMN message_text'))
+    return True
+
+
+def add_message_logs_dispatch_columns(engine):
+    """message_logs.dispatch_id ed error_code per riprendere gli invii falliti"""
+    columns = {c['name'] for c in inspect(engine).get_columns('message_logs')}
+    if {'dispatch_id', 'error_code'} <= columns:
+        return False
+
+    with engine.begin() as conn:
+        if 'dispatch_id' not in columns:
+            conn.execute(text('ALTER TABLE message_logs ADD COLUMN dispatch_id INTEGER NULL'))
+            conn.execute(text('CREATE INDEX ix_message_logs_dispatch_id ON message_logs (dispatch_id)'))
+            if engine.dialect.name == 'mysql':
+                conn.execute(text(
+                    'ALTER TABLE message_logs ADD CONSTRAINT fk_message_logs_dispatch_id '
+                    'FOREIGN KEY (dispatch_id) REFERENCES dispatches (id)'
+                ))
+        if 'error_code' not in columns:
+            conn.execute(text('ALTER TABLE message_logs ADD COLUMN error_code INTEGER NULL'))
+    return True
+
+
+def add_users_bot_id(engine):
+    """users.bot_id: bot del pool a cui è assegnato l'utente"""
+    columns = {c['name'] for c in inspect(engine).get_columns('users')}
+    if 'bot_id' in columns:
+        return False
+    with engine.begin() as conn:
+        conn.execute(text('ALTER TABLE users ADD COLUMN bot_id BIGINT NULL'))
+        conn.execute(text('CREATE INDEX ix_users_bot_id ON users (bot_id)'))
+    return True
+
+
+def add_template_versioning(engine):
+    """Versioni dei template: righe di template_messages immutabili e versione inviata nei log"""
+    inspector = inspect(engine)
+    new_columns = {
+        'message_templates': [('version', 'INTEGER NOT NULL DEFAULT 1')],
+        'template_messages': [('valid_from', 'INTEGER NOT NULL DEFAULT 1'), ('valid_to', 'INTEGER NULL')],
+        'dispatches': [('template_version', 'INTEGER NULL')],
+        'message_logs': [('template_id', 'INTEGER NULL'), ('template_version', 'INTEGER NULL')],
+    }
+
+    statements = []
+    for table, columns in new_columns.items():
+        existing = {c['name'] for c in inspector.get_columns(table)}
+        statements.extend(
+            f'ALTER TABLE {table} ADD COLUMN {name} {definition}'
+            for name, definition in columns if name not in existing
+        )
+    if not any(index['name'] == 'ix_template_messages_template_valid_to'
+               for index in inspector.get_indexes('template_messages')):
+        statements.append(
+            'CREATE INDEX ix_template_messages_template_valid_to ON template_messages (template_id, valid_to)'
+        )
+
+    if not statements:
+        return False
+    with engine.begin() as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+    return True
+
+
+def add_dispatches_media(engine):
+    """Colonna dispatches.media per gli invii di foto e documenti"""
+    if 'media' in {c['name'] for c in inspect(engine).get_columns('dispatches')}:
+        return False
+    with engine.begin() as conn:
+        conn.execute(text('ALTER TABLE dispatches ADD COLUMN media TEXT NULL'))
+    return True
+
+
+def add_dispatch_revisions(engine):
+    """Correzioni e ritiri degli invii: dispatches.source_dispatch_id e indice dei messaggi consegnati"""
+    inspector = inspect(engine)
+    statements = []
+    if 'source_dispatch_id' not in {c['name'] for c in inspector.get_columns('dispatches')}:
+        statements.append('ALTER TABLE dispatches ADD COLUMN source_dispatch_id INTEGER NULL')
+    if not any(index['name'] == 'ix_message_logs_group_dispatch_message'
+               for index in inspector.get_indexes('message_logs')):
+        statements.append(
+            'CREATE INDEX ix_message_logs_group_dispatch_message '
+            'ON message_logs (group_id, dispatch_id, telegram_message_id)'
+        )
+
+    if not statements:
+        return False
+    with engine.begin() as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+    return True
+
+
+def add_dispatches_updated_at(engine):
+    """Colonna dispatches.updated_at: distingue un invio in corso da uno interrotto"""
+    if 'updated_at' in {c['name'] for c in inspect(engine).get_columns('dispatches')}:
+        return False
+    with engine.begin() as conn:
+        conn.execute(text('ALTER TABLE dispatches ADD COLUMN updated_at DATETIME NULL'))
+    return True
+
+
+def add_users_search_index(engine):
+    """
+    Indice FULLTEXT con parser ngram per la ricerca utenti (vedi
+    app/utils/user_search.py). Solo MySQL: MariaDB non ha il parser ngram,
+    lì la ricerca resta con LIKE.
+    """
+    if engine.dialect.name != 'mysql' or getattr(engine.dialect, 'is_mariadb', False):
+        return False
+    if any(index['name'] == 'ft_users_search' for index in inspect(engine).get_indexes('users')):
+        return False
+    with engine.begin() as conn:
+        # Le stopword vengono associate all'indice alla creazione: con ngram
+        # ogni token che ne contiene una ("a", "i", "in", ...) verrebbe scartato
+        conn.execute(text('SET SESSION innodb_ft_enable_stopword = OFF'))
+        conn.execute(text(
+            'CREATE FULLTEXT INDEX ft_users_search '
+            'ON users (username, first_name, last_name, display_name) WITH PARSER ngram'
+        ))
+        conn.execute(text('SET SESSION innodb_ft_enable_stopword = ON'))
+    return True
+
+
+def widen_message_logs_telegram_message_id(engine):
+    """message_logs.telegram_message_id da VARCHAR(50) a VARCHAR(255): gli album salvano tutti gli id"""
+    if engine.dialect.name != 'mysql':
+        return False
+
+    column = next(c for c in inspect(engine).get_columns('message_logs') if c['name'] == 'telegram_message_id')
+    if getattr(column['type'], 'length', None) == 255:
+        return False
+    with engine.begin() as conn:
+        conn.execute(text('ALTER TABLE message_logs MODIFY telegram_message_id VARCHAR(255) NULL'))
+    return True
+
+
+def add_message_logs_bot_id(engine):
+    """message_logs.bot_id: bot che ha consegnato il messaggio (correzioni e ritiri passano da lui)"""
+    columns = {c['name'] for c in inspect(engine).get_columns('message_logs')}
+    if 'bot_id' in columns:
+        return False
+    with engine.begin() as conn:
+        conn.execute(text('ALTER TABLE message_logs ADD COLUMN bot_id BIGINT NULL'))
+    return True
+
+
+# Passi di aggiornamento per database creati con versioni precedenti,
+# in ordine di applicazione. Ogni passo riceve l'engine e ritorna True se
+# ha modificato lo schema.
+MIGRATION_STEPS = [
+    add_users_updated_at_index,
+    convert_telegram_id_to_bigint,
+    move_message_text_to_bodies,
+    add_message_logs_dispatch_columns,
+    add_users_bot_id,
+    add_template_versioning,
+    add_dispatches_media,
+    add_dispatch_revisions,
+    add_dispatches_updated_at,
+    add_users_search_index,
+    widen_message_logs_telegram_message_id,
+    add_message_logs_bot_id,
+]
@@ -1,3 +1,8 @@
+import hashlib
+import json
+
+from sqlalchemy.exc import IntegrityError
+
 from app import db
 from datetime import datetime
 
@@ -37,15 +42,16 @@ class User(db.Model):
     __tablename__ = 'users'
 
     id = db.Column(db.Integer, primary_key=True)
-    telegram_id = db.Column(db.String(20), unique=True, nullable=False, index=True)
-    username = db.Column(db.String(100), index=True)
+    telegram_id = db.Column(db.BigInteger, unique=True, nullable=False, index=True)  # chat_id Telegram (fino a 52 bit)
+    username = db.Column(db.String(100), index=True)  # Ricerca: indice FULLTEXT ft_users_search su MySQL (app/utils/user_search.py)
     first_name = db.Column(db.String(100))
     last_name = db.Column(db.String(100))
     display_name = db.Column(db.String(200))
     language_code = db.Column(db.String(5), default='it')  # Temporaneamente commentato
+    bot_id = db.Column(db.BigInteger, index=True)  # Bot del pool con cui ha interagito (NULL = bot principale)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # Per ETag e ?since= di /telegram/users
     last_interaction = db.Column(db.DateTime)
 
     def __repr__(self):
@@ -54,11 +60,12 @@ class User(db.Model):
     def to_dict(self):
         return {
             'id': self.id,
-            'telegram_id': self.telegram_id,
+            'telegram_id': str(self.telegram_id),  # Stringa nelle API per compatibilità con i client
             'username': self.username,
             'first_name': self.first_name,
             'last_name': self.last_name,
             'display_name': self.display_name,
+            'bot_id': self.bot_id,
             'is_active': self.is_active,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
@@ -67,30 +74,203 @@ class User(db.Model):
 
     @property
     def full_name(self):
-        if self.display_name:
-            return self.display_name
-        if self.first_name and self.last_name:
-            return f"{self.first_name} {self.last_name}"
-        if self.first_name:
-            return self.first_name
-        if self.username:
-            return f"@{self.username}"
-        return f"User {self.telegram_id}"
+        return User.compose_full_name(self.display_name, self.first_name, self.last_name,
+                                      self.username, self.telegram_id)
+
+    @staticmethod
+    def compose_full_name(display_name, first_name, last_name, username, telegram_id):
+        """Nome da mostrare; usabile anche su colonne selezionate senza caricare l'oggetto"""
+        if display_name:
+            return display_name
+        if first_name and last_name:
+            return f"{first_name} {last_name}"
+        if first_name:
+            return first_name
+        if username:
+            return f"@{username}"
+        return f"User {telegram_id}"
+
+class MessageBody(db.Model):
+    """
+    Testo di un messaggio, salvato una sola volta e indirizzato per hash.
+
+    Un invio a migliaia di destinatari con lo stesso testo produce una sola
+    riga qui e tanti MessageLog che la referenziano.
+    """
+    __tablename__ = 'message_bodies'
+
+    id = db.Column(db.Integer, primary_key=True)
+    hash = db.Column(db.String(64), unique=True, nullable=False)  # sha256 esadecimale del testo
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<MessageBody {self.hash[:12]}>'
+
+    @staticmethod
+    def hash_text(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def intern_many(cls, texts):
+        """
+        Ritorna {testo: MessageBody} per tutti i testi, con una query per
+        quelli già presenti e un inserimento per i nuovi.
+        """
+        # texts può essere un generatore: in caso di conflitto serve di nuovo
+        texts = set(texts)
+        by_hash = {cls.hash_text(text): text for text in texts}
+        if not by_hash:
+            return {}
+
+        with db.session.no_autoflush:
+            bodies = {body.hash: body for body in cls.query.filter(cls.hash.in_(list(by_hash)))}
+
+        new_bodies = [cls(hash=h, content=text) for h, text in by_hash.items() if h not in bodies]
+        if new_bodies:
+            try:
+                with db.session.begin_nested():
+                    db.session.add_all(new_bodies)
+            except IntegrityError:
+                # Un'altra richiesta ha inserito gli stessi testi nel frattempo: rilegge
+                return cls.intern_many(texts)
+            bodies.update((body.hash, body) for body in new_bodies)
+
+        return {text: bodies[h] for h, text in by_hash.items()}
+
+    @classmethod
+    def intern(cls, text):
+        return cls.intern_many([text])[text]
+
+class MediaFile(db.Model):
+    """
+    file_id restituito da Telegram per un file già caricato.
+
+    I file_id valgono solo per il bot che ha fatto l'upload: la chiave è
+    (sha256 del contenuto, bot, tipo). Un invio media carica il file una
+    volta per bot e riusa il file_id per tutti gli altri destinatari.
+    """
+    __tablename__ = 'media_files'
+    __table_args__ = (
+        db.UniqueConstraint('sha256', 'bot_id', 'kind', name='uq_media_files_sha256_bot_kind'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False)
+    bot_id = db.Column(db.BigInteger, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # photo, document
+    file_id = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<MediaFile {self.sha256[:12]} bot={self.bot_id}>'
+
+    @classmethod
+    def lookup(cls, sha256s, bot_ids):
+        """{(sha256, bot_id, kind): file_id} per i file e i bot indicati, in una query"""
+        if not sha256s or not bot_ids:
+            return {}
+        rows = db.session.query(cls.sha256, cls.bot_id, cls.kind, cls.file_id) \
+            .filter(cls.sha256.in_(list(sha256s)), cls.bot_id.in_(list(bot_ids)))
+        return {(sha256, bot_id, kind): file_id for sha256, bot_id, kind, file_id in rows}
+
+    @classmethod
+    def remember(cls, file_ids):
+        """Salva i nuovi file_id {(sha256, bot_id, kind): file_id}, ignorando quelli già presenti"""
+        known = cls.lookup({key[0] for key in file_ids}, {key[1] for key in file_ids})
+        new_files = [
+            cls(sha256=sha256, bot_id=bot_id, kind=kind, file_id=file_id)
+            for (sha256, bot_id, kind), file_id in file_ids.items()
+            if (sha256, bot_id, kind) not in known
+        ]
+        if not new_files:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.add_all(new_files)
+        except IntegrityError:
+            # Un altro invio ha salvato gli stessi file nel frattempo: il suo file_id va bene
+            pass
+
+class Dispatch(db.Model):
+    """
+    Un invio a più destinatari (messaggi diretti, template, broadcast o media).
+
+    Lo stato per destinatario è nei MessageLog collegati: i falliti per
+    errori temporanei si possono rinviare senza ripetere tutto l'invio.
+
+    Le correzioni e i ritiri di un invio già fatto (kind edit/delete) sono a
+    loro volta Dispatch, con source_dispatch_id che punta all'invio originale
+    e un MessageLog per ogni messaggio modificato o cancellato.
+    """
+    __tablename__ = 'dispatches'
+
+    id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('groups.id'), nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False)  # direct, template, broadcast, media, edit, delete
+    template_id = db.Column(db.Integer, db.ForeignKey('message_templates.id'))
+    template_version = db.Column(db.Integer)  # Versione del template fissata all'inizio dell'invio
+    media = db.Column(db.Text)  # Invii media: JSON con sha256, tipo e nome dei file
+    source_dispatch_id = db.Column(db.Integer, db.ForeignKey('dispatches.id'))  # Invio corretto o ritirato
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime)  # Ultimo invio o ultimo retry completato
+    # Ultimo segno di vita del thread di invio (avvio, retry, salvataggio dei risultati):
+    # un invio non finito e fermo da DISPATCH_STALE_AFTER secondi è considerato interrotto
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    group = db.relationship('Group', backref='dispatches')
+
+    def __repr__(self):
+        return f'<Dispatch {self.id} {self.kind}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'group_id': self.group_id,
+            'kind': self.kind,
+            'template_id': self.template_id,
+            'template_version': self.template_version,
+            'media': json.loads(self.media) if self.media else None,
+            'source_dispatch_id': self.source_dispatch_id,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
 
 class MessageLog(db.Model):
     __tablename__ = 'message_logs'
+    __table_args__ = (
+        # Messaggi consegnati di un invio, per correggerli o cancellarli in blocco
+        db.Index('ix_message_logs_group_dispatch_message', 'group_id', 'dispatch_id', 'telegram_message_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     group_id = db.Column(db.Integer, db.ForeignKey('groups.id'), nullable=False, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
-    message_text = db.Column(db.Text, nullable=False)
+    body_id = db.Column(db.Integer, db.ForeignKey('message_bodies.id'), nullable=False, index=True)
+    dispatch_id = db.Column(db.Integer, db.ForeignKey('dispatches.id'), index=True)
+    template_id = db.Column(db.Integer, db.ForeignKey('message_templates.id'))  # Se inviato da un template
+    template_version = db.Column(db.Integer)  # Versione del template inviata
     sent_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     status = db.Column(db.String(20), default='pending', nullable=False, index=True)  # pending, sent, failed
     error_message = db.Column(db.Text)
-    telegram_message_id = db.Column(db.String(50))  # ID del messaggio su Telegram se inviato
+    error_code = db.Column(db.Integer)  # error_code della Bot API; NULL per timeout ed errori di rete
+    telegram_message_id = db.Column(db.String(255))  # ID del messaggio su Telegram se inviato (album: id separati da virgola)
+    bot_id = db.Column(db.BigInteger)  # Bot del pool che ha inviato il messaggio (NULL = bot principale o non inviato)
 
     group = db.relationship('Group', backref='message_logs')
     user = db.relationship('User', backref='message_logs')
+    body = db.relationship('MessageBody')
+    dispatch = db.relationship('Dispatch', backref=db.backref('message_logs', lazy='dynamic'))
+
+    @property
+    def message_text(self):
+        return self.body.content if self.body else None
+
+    @message_text.setter
+    def message_text(self, text):
+        # Per gli invii in blocco conviene MessageBody.intern_many() e body=...
+        self.body = MessageBody.intern(text)
 
     def to_dict(self):
         return {
@@ -101,6 +281,10 @@ class MessageLog(db.Model):
             'sent_at': self.sent_at.isoformat(),
             'status': self.status,
             'error_message': self.error_message,
+            'error_code': self.error_code,
+            'dispatch_id': self.dispatch_id,
+            'template_id': self.template_id,
+            'template_version': self.template_version,
             'telegram_message_id': self.telegram_message_id
         }
 # Aggiungi questo alla fine del tuo file models.py esistente
@@ -115,9 +299,17 @@ class MessageTemplate(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True, nullable=False)  # Per "eliminazione" soft
+    version = db.Column(db.Integer, default=1, nullable=False)  # Incrementata ad ogni modifica dei messaggi
 
     # Relazione con il gruppo
     group = db.relationship('Group', backref='message_templates')
+    # Solo i messaggi della versione corrente (le versioni precedenti restano per i log)
+    template_messages = db.relationship(
+        'TemplateMessage',
+        primaryjoin='and_(TemplateMessage.template_id == MessageTemplate.id, TemplateMessage.valid_to.is_(None))',
+        order_by='TemplateMessage.order_index',
+        viewonly=True
+    )
 
     def __repr__(self):
         return f'<MessageTemplate {self.name}>'
@@ -131,23 +323,49 @@ class MessageTemplate(db.Model):
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'is_active': self.is_active,
+            'version': self.version,
             'message_count': len(self.template_messages)
         }
 
 class TemplateMessage(db.Model):
+    """
+    Messaggio di un template per un utente, immutabile.
+
+    Vale per le versioni del template da valid_from (inclusa) a valid_to
+    (esclusa, NULL = versione corrente): modificarlo significa chiudere la
+    riga e crearne una nuova, così ogni versione resta ricostruibile.
+    """
     __tablename__ = 'template_messages'
+    __table_args__ = (
+        db.Index('ix_template_messages_template_valid_to', 'template_id', 'valid_to'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     template_id = db.Column(db.Integer, db.ForeignKey('message_templates.id'), nullable=False, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     message_text = db.Column(db.Text, nullable=False)
     order_index = db.Column(db.Integer, default=0)  # Ordine dei messaggi
+    valid_from = db.Column(db.Integer, default=1, nullable=False)  # Prima versione del template che lo contiene
+    valid_to = db.Column(db.Integer)  # Prima versione che non lo contiene più
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
     # Relazioni
-    template = db.relationship('MessageTemplate', backref='template_messages')
+    template = db.relationship('MessageTemplate')
     user = db.relationship('User', backref='template_messages')
 
+    @staticmethod
+    def current():
+        """Filtro per i messaggi della versione corrente"""
+        return TemplateMessage.valid_to.is_(None)
+
+    @staticmethod
+    def at_version(version):
+        """Filtro per i messaggi di una versione del template"""
+        return db.and_(
+            TemplateMessage.valid_from <= version,
+            db.or_(TemplateMessage.valid_to.is_(None), TemplateMessage.valid_to > version)
+        )
+
     def __repr__(self):
         return f'<TemplateMessage {self.template_id}-{self.user_id}>'
 
@@ -158,6 +376,35 @@ class TemplateMessage(db.Model):
             'user_id': self.user_id,
             'message_text': self.message_text,
             'order_index': self.order_index,
+            'valid_from': self.valid_from,
+            'valid_to': self.valid_to,
             'created_at': self.created_at.isoformat(),
             'user_name': self.user.full_name if self.user else None
-        }
\ No newline at end of file
+        }
+
+class CacheVersion(db.Model):
+    """
+    Contatori di versione di ViewCache quando non c'è Redis: stanno nel
+    database per essere condivisi tra i worker (vedi app/utils/cache.py)
+    """
+    __tablename__ = 'cache_versions'
+
+    key = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+class DebugReportRecord(db.Model):
+    """
+    Report salvato di una route di debug: sta nel database perché qualsiasi
+    worker possa mostrarlo (vedi app/utils/reports.py)
+    """
+    __tablename__ = 'debug_reports'
+    __table_args__ = (
+        db.Index('ix_debug_reports_group_id_id', 'group_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('groups.id'))
+    title = db.Column(db.String(255), nullable=False)
+    lines = db.Column(db.Text, nullable=False)  # JSON: [[livello, testo], ...]
+    dropped = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -1,13 +1,203 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
-from app.models import Group, User, MessageLog, MessageTemplate, TemplateMessage
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort,
+                   current_app, stream_with_context)
+from sqlalchemy import case, func
+from sqlalchemy.orm import joinedload, noload
+from app.models import (Group, User, DebugReportRecord, Dispatch, MessageBody, MessageLog, MessageTemplate,
+                        TemplateMessage, group_users)
+from app.utils.telegram_helper import (send_telegram_message, test_bot_connection, get_bot_token,
+                                       get_bot_tokens, get_circuit_breaker)
+from app.utils.cache import cache
+from app.utils.dispatcher import load_roster, dispatch, retryable_condition
+from app.utils.broadcast import (BroadcastTemplateError, compile_message, group_by_language, render_for_roster,
+                                 render_variants)
+from app.utils.media import MediaSender, items_from_json, items_to_json, prepare_album, store_upload
+from app.utils.progress import dispatch_progress
+from app.utils.revisions import DELETE, EDIT, REVISION_KINDS, RevisionSender, load_sent_messages, route_to_senders
+from app.utils.reports import debug_reports
+from app.utils.serializers import dumps, json_response, member_projection, project
+from app.utils.streaming import stream_page
 from app import db
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import os
+import threading
+import time
+import traceback
 
 groups_bp = Blueprint('groups', __name__)
 
+# Snapshot per le viste in cache: oggetti semplici e serializzabili con gli
+# stessi attributi usati dai template, così le pagine non toccano l'ORM
+
+def _user_view(user):
+    return SimpleNamespace(
+        id=user.id,
+        full_name=user.full_name,
+        username=user.username,
+        telegram_id=user.telegram_id,
+        is_active=user.is_active,
+        last_interaction=user.last_interaction
+    )
+
+def _group_view(group, users=None, user_count=None):
+    return SimpleNamespace(
+        id=group.id,
+        name=group.name,
+        description=group.description,
+        created_at=group.created_at,
+        updated_at=group.updated_at,
+        users=users if users is not None else [],
+        user_count=user_count if user_count is not None else len(users or [])
+    )
+
+def _group_updated_at(group_id):
+    """Legge solo updated_at del gruppo (per la chiave di cache) o risponde 404"""
+    row = db.session.query(Group.updated_at).filter(Group.id == group_id).first()
+    if row is None:
+        abort(404)
+    return row.updated_at
+
+# Membri mostrati nella pagina del gruppo al caricamento: gli altri arrivano
+# a pagine dall'endpoint group_members mentre si scorre la lista
+GROUP_MEMBERS_PAGE_SIZE = 100
+GROUP_MEMBERS_MAX_PAGE_SIZE = 500
+
+def _member_query(group_id):
+    """Membri del gruppo come tuple di colonne (nessun oggetto User), per id"""
+    return db.session.query(
+        User.id, User.display_name, User.first_name, User.last_name, User.username,
+        User.telegram_id, User.is_active, User.last_interaction
+    ).join(group_users, group_users.c.user_id == User.id) \
+        .filter(group_users.c.group_id == group_id) \
+        .order_by(User.id)
+
+def _member_view(row):
+    """Come _user_view, da una riga di _member_query"""
+    user_id, display_name, first_name, last_name, username, telegram_id, is_active, last_interaction = row
+    return SimpleNamespace(
+        id=user_id,
+        full_name=User.compose_full_name(display_name, first_name, last_name, username, telegram_id),
+        username=username,
+        telegram_id=telegram_id,
+        is_active=is_active,
+        last_interaction=last_interaction
+    )
+
+def _iter_members(group_id):
+    """Tutti i membri, letti dal database a blocchi mentre la pagina viene generata (stream_page)"""
+    for row in _member_query(group_id).yield_per(GROUP_MEMBERS_PAGE_SIZE):
+        yield _member_view(row)
+
+def _member_ids(group_id):
+    return [
+        user_id for (user_id,) in db.session.query(group_users.c.user_id)
+        .filter(group_users.c.group_id == group_id)
+        .order_by(group_users.c.user_id)
+    ]
+
+def _member_count(group_id):
+    return db.session.query(func.count(group_users.c.user_id)) \
+        .filter(group_users.c.group_id == group_id) \
+        .scalar()
+
+def _load_groups_view():
+    user_counts = dict(
+        db.session.query(group_users.c.group_id, func.count(group_users.c.user_id))
+        .group_by(group_users.c.group_id)
+        .all()
+    )
+    groups = Group.query.options(noload(Group.users)).order_by(Group.created_at.desc()).all()
+    return [_group_view(group, user_count=user_counts.get(group.id, 0)) for group in groups]
+
+def _load_group_detail_view(group_id):
+    """
+    Gruppo con la prima pagina di membri (group.users) e il totale
+    (group.user_count), più il numero di utenti che si possono aggiungere:
+    si cercano con /telegram/users/search, senza caricarli tutti
+    """
+    group = Group.query.options(noload(Group.users)).get_or_404(group_id)
+    members = [_member_view(row) for row in _member_query(group_id).limit(GROUP_MEMBERS_PAGE_SIZE)]
+    user_count = _member_count(group_id)
+    available_count = db.session.query(func.count(User.id)).scalar() - user_count
+    return _group_view(group, users=members, user_count=user_count), available_count
+
+def _load_templates_view(group_id):
+    message_counts = dict(
+        db.session.query(TemplateMessage.template_id, func.count(TemplateMessage.id))
+        .join(MessageTemplate, MessageTemplate.id == TemplateMessage.template_id)
+        .filter(MessageTemplate.group_id == group_id, MessageTemplate.is_active == True, TemplateMessage.current())
+        .group_by(TemplateMessage.template_id)
+        .all()
+    )
+    templates = MessageTemplate.query.filter_by(
+        group_id=group_id,
+        is_active=True
+    ).order_by(MessageTemplate.created_at.asc()).all()
+
+    return [
+        SimpleNamespace(
+            id=template.id,
+            name=template.name,
+            description=template.description,
+            created_at=template.created_at,
+            message_count=message_counts.get(template.id, 0)
+        )
+        for template in templates
+    ]
+
+def _load_template_view(group_id, template_id):
+    template = MessageTemplate.query.filter_by(
+        id=template_id,
+        group_id=group_id,
+        is_active=True
+    ).first_or_404()
+    template_messages = TemplateMessage.query.options(joinedload(TemplateMessage.user)) \
+        .filter(TemplateMessage.template_id == template.id, TemplateMessage.current()) \
+        .order_by(TemplateMessage.order_index) \
+        .all()
+
+    return SimpleNamespace(
+        id=template.id,
+        name=template.name,
+        description=template.description,
+        created_at=template.created_at,
+        updated_at=template.updated_at,
+        version=template.version,
+        template_messages=[
+            SimpleNamespace(
+                user_id=message.user_id,
+                message_text=message.message_text,
+                user=_user_view(message.user)
+            )
+            for message in template_messages
+        ]
+    )
+
+def _load_group_summary(group_id):
+    group = Group.query.options(noload(Group.users)).get_or_404(group_id)
+    return _group_view(group, user_count=_member_count(group_id))
+
+def _touch_group(group):
+    """Aggiorna updated_at (parte delle chiavi di cache del gruppo): chiamare prima del commit"""
+    group.updated_at = datetime.utcnow()
+
+def _invalidate_group(group_id):
+    """
+    Invalida le viste del gruppo: chiamare dopo il commit, altrimenti un
+    altro worker potrebbe rileggere i dati vecchi e salvarli con la nuova
+    versione
+    """
+    cache.invalidate('group', group_id)
+    cache.invalidate('groups', 'all')
+
 @groups_bp.route('/')
 def list_groups():
     """Lista tutti i gruppi"""
-    groups = Group.query.order_by(Group.created_at.desc()).all()
+    last_updated, group_count = db.session.query(func.max(Group.updated_at), func.count(Group.id)).one()
+    groups = cache.get_or_set(
+        cache.key('groups', 'all', last_updated, group_count),
+        _load_groups_view
+    )
     return render_template('groups.html', groups=groups)
 
 @groups_bp.route('/create', methods=['GET', 'POST'])
@@ -29,6 +219,7 @@ def create_group():
         group = Group(name=name, description=description)
         db.session.add(group)
         db.session.commit()
+        cache.invalidate('groups', 'all')
 
         flash(f'Gruppo "{name}" creato con successo', 'success')
         return redirect(url_for('groups.group_detail', group_id=group.id))
@@ -38,12 +229,50 @@ def create_group():
 @groups_bp.route('/<int:group_id>')
 def group_detail(group_id):
     """Dettaglio gruppo con lista utenti e form per messaggi"""
-    group = Group.query.get_or_404(group_id)
-    available_users = User.query.filter(~User.id.in_([u.id for u in group.users])).all()
+    updated_at = _group_updated_at(group_id)
+    group, available_count = cache.get_or_set(
+        cache.key('group', group_id, updated_at, cache.version('users', 'all')),
+        lambda: _load_group_detail_view(group_id)
+    )
 
-    return render_template('group_detail.html',
-                           group=group,
-                           available_users=available_users)
+    return stream_page('group_detail.html',
+                       group=group,
+                       available_count=available_count,
+                       progress_dispatch_id=request.args.get('dispatch', type=int))
+
+@groups_bp.route('/<int:group_id>/members')
+def group_members(group_id):
+    """
+    Membri del gruppo a pagine, per la lista caricata mentre si scorre.
+
+    Query string: after (id dell'ultimo utente ricevuto), limit e template_id
+    (aggiunge il testo del template per ogni utente, come load_template)
+    """
+    Group.query.options(noload(Group.users)).get_or_404(group_id)
+    after = request.args.get('after', 0, type=int)
+    limit = min(max(request.args.get('limit', GROUP_MEMBERS_PAGE_SIZE, type=int), 1), GROUP_MEMBERS_MAX_PAGE_SIZE)
+    template_id = request.args.get('template_id', type=int)
+
+    members = project(_member_query(group_id).filter(User.id > after).limit(limit), member_projection())
+
+    if template_id and members:
+        texts = dict(
+            db.session.query(TemplateMessage.user_id, TemplateMessage.message_text)
+            .join(MessageTemplate, MessageTemplate.id == TemplateMessage.template_id)
+            .filter(
+                MessageTemplate.group_id == group_id,
+                TemplateMessage.template_id == template_id,
+                TemplateMessage.current(),
+                TemplateMessage.user_id.in_([member['id'] for member in members])
+            )
+        )
+        for member in members:
+            member['message_text'] = texts.get(member['id'])
+
+    return json_response({
+        'members': members,
+        'next_after': members[-1]['id'] if len(members) == limit else None
+    })
 
 @groups_bp.route('/<int:group_id>/add_user', methods=['POST'])
 def add_user_to_group(group_id):
@@ -61,7 +290,9 @@ def add_user_to_group(group_id):
         flash(f'L\'utente {user.full_name} è già nel gruppo', 'warning')
     else:
         group.users.append(user)
+        _touch_group(group)
         db.session.commit()
+        _invalidate_group(group_id)
         flash(f'Utente {user.full_name} aggiunto al gruppo', 'success')
 
     return redirect(url_for('groups.group_detail', group_id=group_id))
@@ -74,122 +305,312 @@ def remove_user_from_group(group_id, user_id):
 
     if user in group.users:
         group.users.remove(user)
+        _touch_group(group)
         db.session.commit()
+        _invalidate_group(group_id)
         flash(f'Utente {user.full_name} rimosso dal gruppo', 'success')
     else:
         flash('Utente non trovato nel gruppo', 'error')
 
     return redirect(url_for('groups.group_detail', group_id=group_id))
-# Sostituisci la funzione send_messages nel tuo groups.py con questa versione debug:
+
+def _send_result_values(result):
+    """Colonne del MessageLog per un risultato di send_telegram_message"""
+    if isinstance(result, dict) and result.get('success'):
+        return {
+            'status': 'sent',
+            'telegram_message_id': result.get('message_id'),
+            'bot_id': result.get('bot_id'),
+            'error_message': None,
+            'error_code': None
+        }
+
+    if isinstance(result, dict):
+        return {
+            'status': 'failed',
+            'error_message': result.get('error') or 'Errore sconosciuto',
+            'error_code': result.get('error_code')
+        }
+    return {'status': 'failed', 'error_message': f'Risultato inaspettato: {result}'}
+
+# Risultati salvati sui MessageLog ogni N invii (o ogni N secondi, che
+# aggiornano anche Dispatch.updated_at): l'avanzamento resta leggibile dal
+# database anche dagli altri worker
+DISPATCH_FLUSH_EVERY = 100
+DISPATCH_HEARTBEAT_EVERY = 30
+
+def _dispatch_stale_before():
+    """Gli invii non finiti senza segni di vita da prima di questo istante sono fermi"""
+    return datetime.utcnow() - timedelta(seconds=current_app.config.get('DISPATCH_STALE_AFTER', 300))
+
+def _dispatch_running(dispatch_record):
+    """True se l'invio è ancora in corso, in questo worker o (a giudicare dal database) in un altro"""
+    progress = dispatch_progress.get(dispatch_record.id)
+    if progress is not None:
+        return not progress.finished
+    if dispatch_record.finished_at is not None:
+        return False
+    last_seen = dispatch_record.updated_at or dispatch_record.created_at
+    return last_seen >= _dispatch_stale_before()
+
+def _deliver(dispatch_id, log_ids, jobs, progress, sender=None):
+    """
+    Invia i (Recipient, testo) e salva i risultati sui log con UPDATE in blocco.
+
+    log_ids: {user_id: id del MessageLog}
+    sender: funzione di invio passata a dispatch() (default send_telegram_message)
+    """
+    updates = []
+    last_flush = time.monotonic()
+
+    def flush(**dispatch_values):
+        nonlocal last_flush
+        db.session.bulk_update_mappings(MessageLog, updates)
+        Dispatch.query.filter_by(id=dispatch_id) \
+            .update(dict(dispatch_values, updated_at=datetime.utcnow()), synchronize_session=False)
+        db.session.commit()
+        updates.clear()
+        last_flush = time.monotonic()
+
+    try:
+        for recipient, message_text, result in dispatch(jobs, sender=sender):
+            values = _send_result_values(result)
+            values['id'] = log_ids[recipient.user_id]
+            updates.append(values)
+            progress.record(values['status'] == 'sent')
+            if len(updates) >= DISPATCH_FLUSH_EVERY or time.monotonic() - last_flush >= DISPATCH_HEARTBEAT_EVERY:
+                flush()
+
+        if isinstance(sender, MediaSender):
+            sender.save()  # file_id dei file caricati, riusati dai prossimi invii
+        flush(finished_at=datetime.utcnow())
+    except Exception as e:
+        # I log non salvati restano pending: "Riprova falliti" li rinvia
+        db.session.rollback()
+        current_app.logger.error(f"Invio #{dispatch_id} interrotto: {str(e)}", exc_info=True)
+        progress.finish(error=str(e))
+        return
+    progress.finish()
+
+def _run_in_background(app, dispatch_id, log_ids, jobs, progress, sender):
+    with app.app_context():
+        _deliver(dispatch_id, log_ids, jobs, progress, sender)
+
+def _start_dispatch(dispatch_record, log_ids, jobs, sender=None):
+    """
+    Avvia l'invio dei jobs di un Dispatch già salvato, in un thread separato
+    (DISPATCH_IN_BACKGROUND) o nella richiesta corrente.
+
+    L'avanzamento si segue con l'endpoint SSE dispatch_progress_stream.
+    """
+    progress = dispatch_progress.start(dispatch_record.id, len(jobs))
+    if not current_app.config.get('DISPATCH_IN_BACKGROUND', True):
+        _deliver(dispatch_record.id, log_ids, jobs, progress, sender)
+        return progress
+
+    threading.Thread(
+        target=_run_in_background,
+        args=(current_app._get_current_object(), dispatch_record.id, log_ids, jobs, progress, sender),
+        name=f'dispatch-{dispatch_record.id}',
+        daemon=True
+    ).start()
+    return progress
+
+def _send_jobs(dispatch_record, jobs, sender=None, message_ids=None):
+    """
+    Crea il Dispatch e i suoi log (pending), poi avvia l'invio dei
+    (Recipient, testo), eventualmente con una funzione di invio diversa
+    (sender, vedi _deliver).
+
+    message_ids: {user_id: telegram_message_id} già noti (correzioni e ritiri:
+    il messaggio da modificare), salvati sui log prima dell'invio insieme al
+    bot del Recipient, che li ha inviati
+
+    Returns:
+        DispatchProgress dell'invio
+    """
+    # Un solo corpo salvato per ogni testo distinto
+    bodies = MessageBody.intern_many(message_text for _, message_text in jobs)
+    message_logs = {}
+    for recipient, message_text in jobs:
+        message_logs[recipient.user_id] = MessageLog(
+            group_id=dispatch_record.group_id,
+            user_id=recipient.user_id,
+            body=bodies[message_text],
+            dispatch=dispatch_record,
+            template_id=dispatch_record.template_id,
+            template_version=dispatch_record.template_version,
+            telegram_message_id=(message_ids or {}).get(recipient.user_id),
+            bot_id=recipient.bot_id,
+            status='pending'
+        )
+    db.session.add_all(message_logs.values())
+    db.session.commit()
+
+    log_ids = {user_id: message_log.id for user_id, message_log in message_logs.items()}
+    return _start_dispatch(dispatch_record, log_ids, jobs, sender)
+
+def _redirect_to_progress(group_id, progress):
+    """Torna al gruppo mostrando la barra di avanzamento dell'invio"""
+    return redirect(url_for('groups.group_detail', group_id=group_id, dispatch=progress.dispatch_id))
+
+def _pending_member_texts(group_id, user_ids):
+    """
+    Testi per i membri non ancora caricati nella pagina, come li avrebbe
+    compilati il browser: quello di "Compila Tutti" (fill_message, anche
+    vuoto dopo "Pulisci Tutti") o, se non usato, quello del template
+    caricato (template_id).
+
+    Returns: {user_id: testo}
+    """
+    if not user_ids:
+        return {}
+    if 'fill_message' in request.form:
+        return dict.fromkeys(user_ids, request.form['fill_message'])
+
+    template_id = request.form.get('template_id', type=int)
+    if not template_id:
+        return {}
+    # Tutti i testi del template e non un IN con migliaia di id
+    wanted = set(user_ids)
+    rows = db.session.query(TemplateMessage.user_id, TemplateMessage.message_text) \
+        .join(MessageTemplate, MessageTemplate.id == TemplateMessage.template_id) \
+        .filter(
+            MessageTemplate.group_id == group_id,
+            MessageTemplate.is_active.is_(True),
+            TemplateMessage.template_id == template_id,
+            TemplateMessage.current()
+        )
+    return {user_id: message_text for user_id, message_text in rows if user_id in wanted}
 
 @groups_bp.route('/<int:group_id>/send_messages', methods=['POST'])
 def send_messages(group_id):
-    """Invia messaggi personalizzati agli utenti del gruppo con debug esteso"""
-    group = Group.query.get_or_404(group_id)
+    """Invia messaggi personalizzati agli utenti del gruppo"""
+    Group.query.options(noload(Group.users)).get_or_404(group_id)
+    roster = load_roster(group_id)
 
-    if not group.users:
+    if not roster:
         flash('Il gruppo non ha utenti', 'error')
         return redirect(url_for('groups.group_detail', group_id=group_id))
 
-    messages_sent = 0
-    messages_failed = 0
-    debug_info = []
-
-    # Importa la funzione di invio
-    from app.utils.telegram_helper import send_telegram_message
+    # Prepara i messaggi leggendo il form per ogni destinatario del roster;
+    # i membri delle pagine non ancora caricate non hanno un campo nel form
+    pending_texts = _pending_member_texts(group_id, [
+        recipient.user_id for recipient in roster if f'direct_message_{recipient.user_id}' not in request.form
+    ])
+    jobs = []
+    for recipient in roster:
+        message_text = request.form.get(f'direct_message_{recipient.user_id}')
+        if message_text is None:
+            message_text = pending_texts.get(recipient.user_id, '')
+        message_text = message_text.strip()
+        if message_text:
+            jobs.append((recipient, message_text))
+
+    if not jobs:
+        flash('ℹ️ Nessun messaggio da inviare (tutti i campi erano vuoti)', 'warning')
+        return redirect(url_for('groups.group_detail', group_id=group_id))
 
-    for user in group.users:
-        message_text = request.form.get(f'direct_message_{user.id}', '').strip()
+    progress = _send_jobs(Dispatch(group_id=group_id, kind='direct'), jobs)
+    flash(f'📨 Invio #{progress.dispatch_id} avviato: {len(jobs)} messaggi', 'info')
+    return _redirect_to_progress(group_id, progress)
+
+@groups_bp.route('/<int:group_id>/broadcast', methods=['POST'])
+def broadcast_message(group_id):
+    """
+    Invia lo stesso messaggio a tutto il gruppo, con i segnaposto sostituiti
+    per ogni utente e una variante opzionale per ogni lingua
+    """
+    Group.query.options(noload(Group.users)).get_or_404(group_id)
+    message_text = request.form.get('broadcast_message', '').strip()
+
+    if not message_text:
+        flash('Scrivi il messaggio da inviare al gruppo', 'error')
+        return redirect(url_for('groups.group_detail', group_id=group_id))
 
-        if not message_text:
-            debug_info.append(f"⏭️ {user.full_name}: messaggio vuoto, saltato")
-            continue
+    # Varianti per lingua: broadcast_message_<lingua>, vuote = testo predefinito
+    variants = {}
+    for language in current_app.config.get('LANGUAGES', {}):
+        variant_text = request.form.get(f'broadcast_message_{language}', '').strip()
+        if variant_text:
+            variants[language] = variant_text
 
-        debug_info.append(f"📝 Preparazione messaggio per {user.full_name} (ID: {user.telegram_id})")
+    for language, text in [(None, message_text), *variants.items()]:
+        try:
+            compile_message(text)
+        except BroadcastTemplateError as e:
+            label = f' ({language.upper()})' if language else ''
+            flash(f'Messaggio non valido{label}: {str(e)}', 'error')
+            return redirect(url_for('groups.group_detail', group_id=group_id))
+
+    roster = load_roster(group_id)
+    if not roster:
+        flash('Il gruppo non ha utenti', 'error')
+        return redirect(url_for('groups.group_detail', group_id=group_id))
 
-        # Crea log del messaggio
-        message_log = MessageLog(
-            group_id=group.id,
-            user_id=user.id,
-            message_text=message_text,
-            status='pending'
-        )
-        db.session.add(message_log)
-        db.session.flush()  # Per ottenere l'ID del log
+    roster_by_language = group_by_language(roster, variants)
+    jobs = list(render_variants(message_text, variants, roster_by_language))
+    if variants:
+        flash('🌍 Destinatari per lingua: ' + ', '.join(
+            f"{language.upper() if language else 'predefinito'} {len(recipients)}"
+            for language, recipients in roster_by_language.items()
+        ), 'info')
+    skipped = len(roster) - len(jobs)
+    if skipped > 0:
+        flash(f'ℹ️ {skipped} utenti saltati: il messaggio risultava vuoto dopo la sostituzione', 'warning')
+    if not jobs:
+        return redirect(url_for('groups.group_detail', group_id=group_id))
 
-        debug_info.append(f"💾 Log creato con ID: {message_log.id}")
+    progress = _send_jobs(Dispatch(group_id=group_id, kind='broadcast'), jobs)
+    flash(f'📢 Broadcast #{progress.dispatch_id} avviato: {len(jobs)} messaggi', 'info')
+    return _redirect_to_progress(group_id, progress)
+
+@groups_bp.route('/<int:group_id>/broadcast_media', methods=['POST'])
+def broadcast_media(group_id):
+    """
+    Invia foto o documenti a tutto il gruppo, con una didascalia opzionale
+    (stessi segnaposto del broadcast): ogni file viene caricato una volta
+    per bot, poi inviato a tutti con il file_id
+    """
+    Group.query.options(noload(Group.users)).get_or_404(group_id)
+    uploads = [file for file in request.files.getlist('media') if file and file.filename]
+    caption = request.form.get('media_caption', '').strip()
+
+    if not uploads:
+        flash('Seleziona almeno un file da inviare', 'error')
+        return redirect(url_for('groups.group_detail', group_id=group_id))
 
-        # Invia messaggio via Telegram
-        try:
-            debug_info.append(f"🚀 Tentativo invio a {user.full_name}...")
-
-            result = send_telegram_message(user.telegram_id, message_text)
-
-            debug_info.append(f"📨 Risultato per {user.full_name}: {result}")
-
-            if result and isinstance(result, dict) and result.get('success'):
-                message_log.status = 'sent'
-                message_log.telegram_message_id = result.get('message_id')
-                messages_sent += 1
-                debug_info.append(f"✅ {user.full_name}: INVIATO (Message ID: {result.get('message_id')})")
-            elif result and isinstance(result, dict):
-                # Risultato con errore
-                message_log.status = 'failed'
-                message_log.error_message = result.get('error', 'Errore sconosciuto')
-                messages_failed += 1
-                debug_info.append(f"❌ {user.full_name}: FALLITO - {result.get('error')}")
-            elif result is True:
-                # Vecchio formato (True/False)
-                message_log.status = 'sent'
-                messages_sent += 1
-                debug_info.append(f"✅ {user.full_name}: INVIATO (formato vecchio)")
-            elif result is False:
-                # Vecchio formato (True/False)
-                message_log.status = 'failed'
-                message_log.error_message = 'Invio fallito (nessun dettaglio disponibile)'
-                messages_failed += 1
-                debug_info.append(f"❌ {user.full_name}: FALLITO (formato vecchio)")
-            else:
-                # Risultato inaspettato
-                message_log.status = 'failed'
-                message_log.error_message = f'Risultato inaspettato: {result}'
-                messages_failed += 1
-                debug_info.append(f"❓ {user.full_name}: RISULTATO INASPETTATO - {result}")
-
-        except Exception as e:
-            message_log.status = 'failed'
-            message_log.error_message = f"Eccezione Python: {str(e)}"
-            messages_failed += 1
-            debug_info.append(f"💥 {user.full_name}: ECCEZIONE - {str(e)}")
-
-    # Salva tutti i log
-    db.session.commit()
-    debug_info.append(f"💾 Tutti i log salvati nel database")
-
-    # Debug completo
-    debug_info.append(f"📊 RISULTATI FINALI:")
-    debug_info.append(f"📊 Messaggi inviati: {messages_sent}")
-    debug_info.append(f"📊 Messaggi falliti: {messages_failed}")
-
-    # Mostra debug info come flash messages
-    for info in debug_info:
-        if "✅" in info or "INVIATO" in info:
-            flash(info, 'success')
-        elif "❌" in info or "FALLITO" in info or "💥" in info:
-            flash(info, 'error')
-        else:
-            flash(info, 'info')
+    try:
+        render = compile_message(caption)
+    except BroadcastTemplateError as e:
+        flash(f'Didascalia non valida: {str(e)}', 'error')
+        return redirect(url_for('groups.group_detail', group_id=group_id))
 
-    # Messaggi di feedback riassuntivi
-    if messages_sent > 0:
-        flash(f'🎉 SUCCESSO: {messages_sent} messaggi inviati con successo', 'success')
-    if messages_failed > 0:
-        flash(f'⚠️ PROBLEMI: {messages_failed} messaggi non inviati. Controlla i dettagli sopra.', 'error')
+    roster = load_roster(group_id)
+    if not roster:
+        flash('Il gruppo non ha utenti', 'error')
+        return redirect(url_for('groups.group_detail', group_id=group_id))
 
-    if messages_sent == 0 and messages_failed == 0:
-        flash('ℹ️ Nessun messaggio da inviare (tutti i campi erano vuoti)', 'warning')
+    folder = current_app.config['MEDIA_UPLOAD_FOLDER']
+    items = [item for item in (store_upload(file, folder) for file in uploads) if item]
+    try:
+        prepare_album(items)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('groups.group_detail', group_id=group_id))
+    if not items:
+        flash('I file selezionati sono vuoti', 'error')
+        return redirect(url_for('groups.group_detail', group_id=group_id))
 
-    return redirect(url_for('groups.group_detail', group_id=group_id))
+    # La didascalia vuota va bene: i file partono comunque a tutti
+    jobs = [(recipient, render(recipient).strip()) for recipient in roster]
+    progress = _send_jobs(
+        Dispatch(group_id=group_id, kind='media', media=items_to_json(items)),
+        jobs,
+        sender=MediaSender.for_items(items)
+    )
+    flash(f'🖼️ Invio media #{progress.dispatch_id} avviato: {len(items)} file a {len(jobs)} utenti', 'info')
+    return _redirect_to_progress(group_id, progress)
 
 @groups_bp.route('/<int:group_id>/delete', methods=['POST'])
 def delete_group(group_id):
@@ -197,39 +618,44 @@ def delete_group(group_id):
     group = Group.query.get_or_404(group_id)
     group_name = group.name
 
-    # Rimuovi prima i messaggi associati
+    # Rimuovi prima i messaggi associati, gli invii e i report di debug
+    DebugReportRecord.query.filter_by(group_id=group_id).delete()
     MessageLog.query.filter_by(group_id=group_id).delete()
+    # Correzioni e ritiri puntano all'invio originale: MySQL verifica la
+    # chiave esterna riga per riga, quindi i riferimenti vanno tolti prima
+    Dispatch.query.filter_by(group_id=group_id) \
+        .filter(Dispatch.source_dispatch_id.isnot(None)) \
+        .update({Dispatch.source_dispatch_id: None}, synchronize_session=False)
+    Dispatch.query.filter_by(group_id=group_id).delete()
 
     db.session.delete(group)
     db.session.commit()
+    _invalidate_group(group_id)
+    cache.invalidate('templates', group_id)
 
     flash(f'Gruppo "{group_name}" eliminato con successo', 'success')
     return redirect(url_for('groups.list_groups'))
-# Aggiungi queste route alla fine del tuo file groups.py esistente
-# Aggiungi anche questo import all'inizio del file:
-# from app.models import Group, User, MessageLog, MessageTemplate, TemplateMessage
 
 @groups_bp.route('/<int:group_id>/templates')
 def list_templates(group_id):
     """Lista dei template di messaggi salvati per un gruppo"""
-    from app.models import MessageTemplate
-
-    group = Group.query.get_or_404(group_id)
-    templates = MessageTemplate.query.filter_by(
-        group_id=group_id,
-        is_active=True
-    ).order_by(MessageTemplate.created_at.asc()).all()
+    group = Group.query.options(noload(Group.users)).get_or_404(group_id)
+    last_updated, template_count = db.session.query(
+        func.max(MessageTemplate.updated_at), func.count(MessageTemplate.id)
+    ).filter_by(group_id=group_id, is_active=True).one()
+    templates = cache.get_or_set(
+        cache.key('templates', group_id, 'list', last_updated, template_count),
+        lambda: _load_templates_view(group_id)
+    )
 
     return render_template('groups/templates.html', group=group, templates=templates)
 
 @groups_bp.route('/<int:group_id>/templates/create', methods=['GET', 'POST'])
 def create_template(group_id):
     """Crea un nuovo template di messaggi"""
-    from app.models import MessageTemplate, TemplateMessage
+    group = Group.query.options(noload(Group.users)).get_or_404(group_id)
 
-    group = Group.query.get_or_404(group_id)
-
-    if not group.users:
+    if not _member_count(group_id):
         flash('Il gruppo deve avere almeno un utente per creare un template', 'error')
         return redirect(url_for('groups.group_detail', group_id=group_id))
 
@@ -239,7 +665,7 @@ def create_template(group_id):
 
         if not template_name:
             flash('Il nome del template è obbligatorio', 'error')
-            return render_template('groups/create_template.html', group=group)
+            return _render_create_template(group)
 
         # Verifica che non esista già un template con questo nome per il gruppo
         existing_template = MessageTemplate.query.filter_by(
@@ -250,7 +676,7 @@ def create_template(group_id):
 
         if existing_template:
             flash('Esiste già un template con questo nome per questo gruppo', 'error')
-            return render_template('groups/create_template.html', group=group)
+            return _render_create_template(group)
 
         # Crea il template
         template = MessageTemplate(
@@ -263,12 +689,12 @@ def create_template(group_id):
 
         # Salva i messaggi per ogni utente
         messages_saved = 0
-        for user in group.users:
-            message_text = request.form.get(f'message_{user.id}', '').strip()
+        for user_id in _member_ids(group_id):
+            message_text = request.form.get(f'message_{user_id}', '').strip()
             if message_text:
                 template_message = TemplateMessage(
                     template_id=template.id,
-                    user_id=user.id,
+                    user_id=user_id,
                     message_text=message_text,
                     order_index=messages_saved
                 )
@@ -278,108 +704,119 @@ def create_template(group_id):
         if messages_saved == 0:
             db.session.rollback()
             flash('Devi inserire almeno un messaggio per salvare il template', 'error')
-            return render_template('groups/create_template.html', group=group)
+            return _render_create_template(group)
 
         db.session.commit()
+        cache.invalidate('templates', group_id)
         flash(f'Template "{template_name}" salvato con {messages_saved} messaggi', 'success')
         return redirect(url_for('groups.list_templates', group_id=group_id))
 
-    return render_template('groups/create_template.html', group=group)
+    return _render_create_template(group)
+
+def _render_create_template(group):
+    """Form di creazione, con i membri letti a blocchi mentre la pagina viene inviata"""
+    return stream_page('groups/create_template.html',
+                       group=group,
+                       members=_iter_members(group.id),
+                       member_count=_member_count(group.id))
 
 @groups_bp.route('/<int:group_id>/templates/<int:template_id>')
 def view_template(group_id, template_id):
     """Visualizza un template di messaggi"""
-    from app.models import MessageTemplate
+    updated_at = _group_updated_at(group_id)
+    group = cache.get_or_set(
+        cache.key('group', group_id, 'summary', updated_at),
+        lambda: _load_group_summary(group_id)
+    )
 
-    group = Group.query.get_or_404(group_id)
-    template = MessageTemplate.query.filter_by(
+    row = db.session.query(MessageTemplate.updated_at).filter_by(
         id=template_id,
         group_id=group_id,
         is_active=True
     ).first_or_404()
+    template = cache.get_or_set(
+        cache.key('templates', group_id, template_id, row.updated_at, cache.version('users', 'all')),
+        lambda: _load_template_view(group_id, template_id)
+    )
 
     return render_template('groups/view_template.html', group=group, template=template)
 
 @groups_bp.route('/<int:group_id>/templates/<int:template_id>/load')
 def load_template(group_id, template_id):
     """Carica un template nella pagina di invio messaggi"""
-    from app.models import MessageTemplate
-
-    group = Group.query.get_or_404(group_id)
+    updated_at = _group_updated_at(group_id)
+    group, available_count = cache.get_or_set(
+        cache.key('group', group_id, updated_at, cache.version('users', 'all')),
+        lambda: _load_group_detail_view(group_id)
+    )
     template = MessageTemplate.query.filter_by(
         id=template_id,
         group_id=group_id,
         is_active=True
     ).first_or_404()
 
-    # Crea un dizionario con i messaggi per ogni utente
-    template_data = {}
-    for template_msg in template.template_messages:
-        template_data[template_msg.user_id] = template_msg.message_text
+    # Testi per i membri della prima pagina; gli altri arrivano con group_members?template_id=
+    template_data = dict(
+        db.session.query(TemplateMessage.user_id, TemplateMessage.message_text)
+        .filter(
+            TemplateMessage.template_id == template.id,
+            TemplateMessage.current(),
+            TemplateMessage.user_id.in_([user.id for user in group.users])
+        )
+    )
 
-    return render_template('group_detail.html',
-                           group=group,
-                           template=template,
-                           template_data=template_data,
-                           available_users=User.query.filter(~User.id.in_([u.id for u in group.users])).all())
+    return stream_page('group_detail.html',
+                       group=group,
+                       template=template,
+                       template_data=template_data,
+                       available_count=available_count)
+
+# Le versioni dei template sono immutabili: i testi restano validi per sempre,
+# il TTL serve solo a liberare memoria
+TEMPLATE_PAYLOAD_TTL = 24 * 3600
+
+def _load_template_payload(template_id, version):
+    """Testi di una versione del template: {user_id: testo}, nell'ordine del template"""
+    return dict(
+        db.session.query(TemplateMessage.user_id, TemplateMessage.message_text)
+        .filter(TemplateMessage.template_id == template_id, TemplateMessage.at_version(version))
+        .order_by(TemplateMessage.order_index)
+        .all()
+    )
 
 @groups_bp.route('/<int:group_id>/templates/<int:template_id>/send', methods=['POST'])
 def send_template_messages(group_id, template_id):
     """Invia i messaggi di un template"""
-    from app.models import MessageTemplate
-
-    group = Group.query.get_or_404(group_id)
+    Group.query.options(noload(Group.users)).get_or_404(group_id)
     template = MessageTemplate.query.filter_by(
         id=template_id,
         group_id=group_id,
         is_active=True
     ).first_or_404()
 
-    messages_sent = 0
-    messages_failed = 0
-
-    # Importa qui per evitare import circolari
-    from app.utils.telegram_helper import send_telegram_message
-
-    for template_msg in template.template_messages:
-        # Crea log del messaggio
-        message_log = MessageLog(
-            group_id=group.id,
-            user_id=template_msg.user_id,
-            message_text=template_msg.message_text,
-            status='pending'
-        )
-        db.session.add(message_log)
-
-        # Invia messaggio via Telegram
-        try:
-            success = send_telegram_message(template_msg.user.telegram_id, template_msg.message_text)
-            if success:
-                message_log.status = 'sent'
-                messages_sent += 1
-            else:
-                message_log.status = 'failed'
-                message_log.error_message = 'Errore nell\'invio del messaggio'
-                messages_failed += 1
-        except Exception as e:
-            message_log.status = 'failed'
-            message_log.error_message = str(e)
-            messages_failed += 1
-
-    db.session.commit()
+    # Versione fissata qui: una modifica durante l'invio crea una versione nuova
+    # e non tocca le righe di questa
+    version = template.version
+    template_texts = cache.get_or_set(
+        f'template_payload:{template.id}:v{version}',
+        lambda: _load_template_payload(template.id, version),
+        ttl=TEMPLATE_PAYLOAD_TTL
+    )
+    roster = load_roster(user_ids=template_texts.keys())
 
-    if messages_sent > 0:
-        flash(f'Template "{template.name}": {messages_sent} messaggi inviati con successo', 'success')
-    if messages_failed > 0:
-        flash(f'Template "{template.name}": {messages_failed} messaggi non inviati', 'error')
+    jobs = [(recipient, template_texts[recipient.user_id]) for recipient in roster]
+    if not jobs:
+        flash(f'Template "{template.name}": nessun destinatario attivo', 'warning')
+        return redirect(url_for('groups.group_detail', group_id=group_id))
 
-    return redirect(url_for('groups.group_detail', group_id=group_id))
+    dispatch_record = Dispatch(group_id=group_id, kind='template', template_id=template.id, template_version=version)
+    progress = _send_jobs(dispatch_record, jobs)
+    flash(f'Template "{template.name}": invio #{progress.dispatch_id} avviato ({len(jobs)} messaggi)', 'info')
+    return _redirect_to_progress(group_id, progress)
 
 @groups_bp.route('/<int:group_id>/templates/<int:template_id>/delete', methods=['POST'])
 def delete_template(group_id, template_id):
     """Elimina un template (soft delete)"""
-    from app.models import MessageTemplate
-
     group = Group.query.get_or_404(group_id)
     template = MessageTemplate.query.filter_by(
         id=template_id,
@@ -390,10 +827,262 @@ def delete_template(group_id, template_id):
     template_name = template.name
     template.is_active = False  # Soft delete
     db.session.commit()
+    cache.invalidate('templates', group_id)
 
     flash(f'Template "{template_name}" eliminato', 'success')
     return redirect(url_for('groups.list_templates', group_id=group_id))
 
+@groups_bp.route('/<int:group_id>/dispatches/<int:dispatch_id>/retry', methods=['POST'])
+def retry_dispatch(group_id, dispatch_id):
+    """Rinvia solo i messaggi di un invio falliti per errori temporanei (429, 5xx, timeout) o mai inviati"""
+    dispatch_record = Dispatch.query.filter_by(id=dispatch_id, group_id=group_id).first_or_404()
+
+    # I pending di un invio in corso verrebbero inviati due volte
+    if _dispatch_running(dispatch_record):
+        flash(f'L\'invio #{dispatch_id} è ancora in corso: riprova quando è terminato', 'warning')
+        return redirect(url_for('groups.message_history', group_id=group_id))
+
+    # user_id -> (id del log, testo, messaggio Telegram e bot che lo ha
+    # inviato: per correzioni e ritiri quello da modificare)
+    retryable = {
+        user_id: (message_log_id, content, telegram_message_id, bot_id)
+        for message_log_id, user_id, content, telegram_message_id, bot_id in db.session.query(
+            MessageLog.id, MessageLog.user_id, MessageBody.content, MessageLog.telegram_message_id,
+            MessageLog.bot_id
+        ).join(MessageBody, MessageBody.id == MessageLog.body_id)
+        .join(Dispatch, Dispatch.id == MessageLog.dispatch_id)
+        .filter(MessageLog.dispatch_id == dispatch_record.id, retryable_condition(_dispatch_stale_before()))
+    }
+    roster = load_roster(user_ids=retryable.keys())
+    if dispatch_record.kind in REVISION_KINDS:
+        route_to_senders(roster, {user_id: values[3] for user_id, values in retryable.items()})
+    jobs = [(recipient, retryable[recipient.user_id][1]) for recipient in roster]
+    if not jobs:
+        flash('Nessun messaggio da ritentare per questo invio', 'info')
+        return redirect(url_for('groups.message_history', group_id=group_id))
+
+    # Invio di nuovo in corso: l'avanzamento letto dal database non deve
+    # considerarlo concluso
+    dispatch_record.finished_at = None
+    dispatch_record.updated_at = datetime.utcnow()
+    db.session.commit()
+
+    sender = None
+    if dispatch_record.kind in REVISION_KINDS:
+        source_kind = db.session.query(Dispatch.kind) \
+            .filter(Dispatch.id == dispatch_record.source_dispatch_id) \
+            .scalar()
+        sender = RevisionSender(
+            dispatch_record.kind,
+            {recipient.chat_id: retryable[recipient.user_id][2] for recipient in roster},
+            caption=source_kind == 'media'
+        )
+    elif dispatch_record.media:
+        sender = MediaSender.for_items(
+            items_from_json(dispatch_record.media, current_app.config['MEDIA_UPLOAD_FOLDER'])
+        )
+
+    log_ids = {user_id: message_log_id for user_id, (message_log_id, *_) in retryable.items()}
+    progress = _start_dispatch(dispatch_record, log_ids, jobs, sender)
+    flash(f'🔁 Retry invio #{dispatch_id} avviato: {len(jobs)} messaggi', 'info')
+    return _redirect_to_progress(group_id, progress)
+
+def _revise_dispatch(group_id, dispatch_id, action, text=None):
+    """
+    Corregge (EDIT, con il nuovo testo) o cancella (DELETE) tutti i messaggi
+    consegnati di un invio, con un nuovo Dispatch che punta all'originale.
+
+    Returns: DispatchProgress, o None (con un flash) se non c'è nulla da modificare
+    """
+    source = Dispatch.query.filter_by(id=dispatch_id, group_id=group_id).first_or_404()
+    if source.kind in REVISION_KINDS:
+        flash('Correzioni e ritiri non si possono modificare: usa l\'invio originale', 'error')
+        return None
+
+    sent_messages = load_sent_messages(group_id, source.id)
+    roster = route_to_senders(
+        load_roster(user_ids=sent_messages.keys()),
+        {user_id: bot_id for user_id, (_, _, bot_id) in sent_messages.items()}
+    )
+    if not roster:
+        flash('Nessun messaggio consegnato da modificare per questo invio', 'info')
+        return None
+
+    if action == EDIT:
+        jobs = list(render_for_roster(text, roster))
+    else:
+        # Il log del ritiro riporta il testo cancellato
+        jobs = [(recipient, sent_messages[recipient.user_id][1]) for recipient in roster]
+
+    sender = RevisionSender(
+        action,
+        {recipient.chat_id: sent_messages[recipient.user_id][0] for recipient, _ in jobs},
+        caption=source.kind == 'media'
+    )
+    return _send_jobs(
+        Dispatch(group_id=group_id, kind=action, source_dispatch_id=source.id),
+        jobs,
+        sender=sender,
+        message_ids={recipient.user_id: sent_messages[recipient.user_id][0] for recipient, _ in jobs}
+    )
+
+@groups_bp.route('/<int:group_id>/dispatches/<int:dispatch_id>/edit', methods=['POST'])
+def edit_dispatch(group_id, dispatch_id):
+    """Sostituisce il testo (o la didascalia) di tutti i messaggi consegnati di un invio"""
+    message_text = request.form.get('edit_message', '').strip()
+    if not message_text:
+        flash('Scrivi il testo corretto del messaggio', 'error')
+        return redirect(url_for('groups.message_history', group_id=group_id))
+    try:
+        compile_message(message_text)
+    except BroadcastTemplateError as e:
+        flash(f'Messaggio non valido: {str(e)}', 'error')
+        return redirect(url_for('groups.message_history', group_id=group_id))
+
+    progress = _revise_dispatch(group_id, dispatch_id, EDIT, message_text)
+    if progress is None:
+        return redirect(url_for('groups.message_history', group_id=group_id))
+    flash(f'✏️ Correzione #{progress.dispatch_id} dell\'invio #{dispatch_id} avviata: {progress.total} messaggi', 'info')
+    return _redirect_to_progress(group_id, progress)
+
+@groups_bp.route('/<int:group_id>/dispatches/<int:dispatch_id>/delete', methods=['POST'])
+def delete_dispatch(group_id, dispatch_id):
+    """Cancella dalle chat tutti i messaggi consegnati di un invio (entro 48 ore dall'invio)"""
+    progress = _revise_dispatch(group_id, dispatch_id, DELETE)
+    if progress is None:
+        return redirect(url_for('groups.message_history', group_id=group_id))
+    flash(f'🗑️ Ritiro #{progress.dispatch_id} dell\'invio #{dispatch_id} avviato: {progress.total} messaggi', 'info')
+    return _redirect_to_progress(group_id, progress)
+
+# Stream SSE: al massimo un evento ogni PROGRESS_INTERVAL secondi; dopo
+# PROGRESS_STREAM_MAX secondi la connessione si chiude e il browser si
+# riconnette da solo, così un invio lungo non occupa un thread per sempre.
+# Ogni stream aperto tiene un thread del worker: oltre PROGRESS_MAX_STREAMS
+# stream per processo la risposta è un solo aggiornamento e il browser
+# riprova dopo PROGRESS_BUSY_RETRY millisecondi
+PROGRESS_INTERVAL = 0.5
+PROGRESS_POLL_INTERVAL = 2.0
+PROGRESS_HEARTBEAT = 15.0
+PROGRESS_STREAM_MAX = 60.0
+PROGRESS_RETRY = 2000
+PROGRESS_BUSY_RETRY = 5000
+
+_progress_streams = {}
+_progress_streams_lock = threading.Lock()
+
+def _progress_stream_slots():
+    """Semaforo degli stream SSE aperti in questo processo"""
+    limit = current_app.config.get('PROGRESS_MAX_STREAMS', 4)
+    with _progress_streams_lock:
+        if limit not in _progress_streams:
+            _progress_streams[limit] = threading.BoundedSemaphore(limit)
+        return _progress_streams[limit]
+
+def _progress_from_logs(dispatch_id):
+    """Avanzamento ricavato dai MessageLog, per gli invii di altri worker o già conclusi"""
+    total, sent, failed, finished_at = db.session.query(
+        func.count(MessageLog.id),
+        func.sum(case((MessageLog.status == 'sent', 1), else_=0)),
+        func.sum(case((MessageLog.status == 'failed', 1), else_=0)),
+        Dispatch.finished_at
+    ).select_from(Dispatch) \
+        .outerjoin(MessageLog, MessageLog.dispatch_id == Dispatch.id) \
+        .filter(Dispatch.id == dispatch_id) \
+        .group_by(Dispatch.id, Dispatch.finished_at) \
+        .one()
+    sent = int(sent or 0)
+    failed = int(failed or 0)
+    db.session.commit()  # Chiude la transazione: il poll successivo vede i nuovi salvataggi
+    return {
+        'dispatch_id': dispatch_id,
+        'total': total,
+        'sent': sent,
+        'failed': failed,
+        'done': sent + failed,
+        'rate': None,
+        'elapsed': None,
+        'finished': finished_at is not None and sent + failed == total,
+        'error': None
+    }
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
+
+@groups_bp.route('/<int:group_id>/dispatches/<int:dispatch_id>/progress')
+def dispatch_progress_stream(group_id, dispatch_id):
+    """Avanzamento di un invio in tempo reale (Server-Sent Events)"""
+    if db.session.query(Dispatch.id).filter_by(id=dispatch_id, group_id=group_id).first() is None:
+        abort(404)
+    # Lo stream dura minuti: la connessione al database torna subito al pool
+    db.session.remove()
+    progress = dispatch_progress.get(dispatch_id)
+    slots = _progress_stream_slots()
+
+    def read_progress():
+        if progress is not None:
+            return progress.snapshot()
+        snapshot = _progress_from_logs(dispatch_id)
+        db.session.remove()
+        return snapshot
+
+    def generate():
+        if not slots.acquire(blocking=False):
+            snapshot = read_progress()
+            yield f'retry: {PROGRESS_BUSY_RETRY}\n\n'
+            yield _sse_event('progress', snapshot)
+            if snapshot['finished']:
+                yield _sse_event('done', snapshot)
+            return
+
+        try:
+            deadline = time.monotonic() + PROGRESS_STREAM_MAX
+            version = None
+            yield f'retry: {PROGRESS_RETRY}\n\n'
+            while True:
+                if progress is not None:
+                    version = progress.wait_for_change(version, PROGRESS_HEARTBEAT)
+                snapshot = read_progress()
+                yield _sse_event('progress', snapshot)
+
+                if snapshot['finished']:
+                    yield _sse_event('done', snapshot)
+                    return
+                if time.monotonic() > deadline:
+                    return
+                time.sleep(PROGRESS_INTERVAL if progress is not None else PROGRESS_POLL_INTERVAL)
+        finally:
+            slots.release()
+
+    response = current_app.response_class(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx: niente buffering dello stream
+    return response
+
+def _dispatch_summaries(group_id, limit=10):
+    """Ultimi invii del gruppo con conteggi inviati/falliti/ritentabili, in una query aggregata"""
+    retryable = retryable_condition(_dispatch_stale_before())
+    rows = db.session.query(
+        Dispatch.id,
+        Dispatch.kind,
+        Dispatch.created_at,
+        Dispatch.source_dispatch_id,
+        func.count(MessageLog.id),
+        func.sum(case((MessageLog.status == 'sent', 1), else_=0)),
+        func.sum(case((MessageLog.status == 'failed', 1), else_=0)),
+        func.sum(case((retryable, 1), else_=0))
+    ).outerjoin(MessageLog, MessageLog.dispatch_id == Dispatch.id) \
+        .filter(Dispatch.group_id == group_id) \
+        .group_by(Dispatch.id, Dispatch.kind, Dispatch.created_at, Dispatch.source_dispatch_id) \
+        .order_by(Dispatch.id.desc()) \
+        .limit(limit)
+
+    return [
+        SimpleNamespace(id=dispatch_id, kind=kind, created_at=created_at, source_dispatch_id=source_dispatch_id,
+                        total=total, sent=sent or 0, failed=failed or 0, retryable=retryable_count or 0,
+                        revisable=kind not in REVISION_KINDS and bool(sent))
+        for dispatch_id, kind, created_at, source_dispatch_id, total, sent, failed, retryable_count in rows
+    ]
+
 @groups_bp.route('/<int:group_id>/message_history')
 def message_history(group_id):
     """Cronologia dei messaggi inviati per un gruppo usando la tabella message_logs esistente"""
@@ -402,9 +1091,13 @@ def message_history(group_id):
     # Filtri opzionali
     status_filter = request.args.get('status', '')
     user_filter = request.args.get('user_id', '', type=int)
+    dispatch_filter = request.args.get('dispatch_id', '', type=int)
 
-    # Query base
+    # Query base: tutto il gruppo o il report di un solo invio
     query = MessageLog.query.filter_by(group_id=group_id)
+    if dispatch_filter:
+        query = query.filter(MessageLog.dispatch_id == dispatch_filter)
+    stats_query = query
 
     # Applica filtri
     if status_filter:
@@ -416,13 +1109,18 @@ def message_history(group_id):
     page = request.args.get('page', 1, type=int)
     per_page = 50
 
-    messages = query.order_by(MessageLog.sent_at.desc()) \
+    messages = query.options(joinedload(MessageLog.body)) \
+        .order_by(MessageLog.sent_at.desc()) \
         .paginate(page=page, per_page=per_page, error_out=False)
 
-    # Statistiche rapide
-    total_messages = MessageLog.query.filter_by(group_id=group_id).count()
-    sent_messages = MessageLog.query.filter_by(group_id=group_id, status='sent').count()
-    failed_messages = MessageLog.query.filter_by(group_id=group_id, status='failed').count()
+    # Statistiche rapide, in una sola query aggregata
+    total_messages, sent_messages, failed_messages = stats_query.with_entities(
+        func.count(MessageLog.id),
+        func.sum(case((MessageLog.status == 'sent', 1), else_=0)),
+        func.sum(case((MessageLog.status == 'failed', 1), else_=0))
+    ).one()
+    sent_messages = int(sent_messages or 0)
+    failed_messages = int(failed_messages or 0)
 
     stats = {
         'total': total_messages,
@@ -435,17 +1133,46 @@ def message_history(group_id):
                            group=group,
                            messages=messages,
                            stats=stats,
+                           dispatches=_dispatch_summaries(group_id),
                            current_status=status_filter,
-                           current_user=user_filter)
+                           current_user=user_filter,
+                           current_dispatch=dispatch_filter)
+
+def _show_report(report):
+    """
+    Salva il report e lo mostra, con un solo flash di riepilogo: le righe
+    restano nel report, lato server.
+    """
+    debug_reports.save(report)
+    flash(report.summary(), report.level)
+    return _render_report(report.group_id, report)
+
+def _render_report(group_id, report):
+    group = Group.query.options(noload(Group.users)).get_or_404(group_id)
+    return render_template('groups/debug_report.html', group=group, report=report,
+                           reports=debug_reports.recent(group_id))
+
+@groups_bp.route('/<int:group_id>/reports')
+@groups_bp.route('/<int:group_id>/reports/<int:report_id>')
+def debug_report(group_id, report_id=None):
+    """Report delle route di debug: uno in dettaglio e gli ultimi del gruppo"""
+    if report_id is None:
+        reports = debug_reports.recent(group_id)
+        return _render_report(group_id, reports[0] if reports else None)
+
+    report = debug_reports.get(report_id)
+    if report is None or report.group_id != group_id:
+        flash('Report non più disponibile (ne vengono tenuti solo gli ultimi)', 'warning')
+        return redirect(url_for('groups.debug_report', group_id=group_id))
+    return _render_report(group_id, report)
+
 # Aggiungi queste route alla fine del tuo groups.py:
 
 @groups_bp.route('/<int:group_id>/debug_bot')
 def debug_bot(group_id):
     """Route di debug completo per il bot"""
     group = Group.query.get_or_404(group_id)
-
-    from app.utils.telegram_helper import test_bot_connection, get_bot_token
-    import os
+    report = debug_reports.new('Debug bot', group_id)
 
     # Test token
     token = get_bot_token()
@@ -460,33 +1187,43 @@ def debug_bot(group_id):
     bot_test = test_bot_connection()
 
     # Mostra risultati
-    flash(f"🔑 Token trovato: {token_status['found']} (lunghezza: {token_status['length']})", 'info')
-    flash(f"🌍 Da variabile ambiente: {token_status['env_var']}", 'info')
+    report.add('info', f"🔑 Token trovato: {token_status['found']} (lunghezza: {token_status['length']})")
+    report.add('info', f"🌍 Da variabile ambiente: {token_status['env_var']}")
 
     if token_status['found']:
-        flash(f"👁️ Preview token: {token_status['preview']}", 'info')
+        report.add('info', f"👁️ Preview token: {token_status['preview']}")
 
     if bot_test['success']:
         bot_info = bot_test['bot_info']
-        flash(f"✅ Bot connesso: @{bot_info.get('username')} ({bot_info.get('first_name')})", 'success')
-        flash(f"🤖 Bot ID: {bot_info.get('id')}", 'info')
+        report.add('success', f"✅ Bot connesso: @{bot_info.get('username')} ({bot_info.get('first_name')})")
+        report.add('info', f"🤖 Bot ID: {bot_info.get('id')}")
     else:
-        flash(f"❌ Errore connessione bot: {bot_test['error']}", 'error')
+        report.add('error', f"❌ Errore connessione bot: {bot_test['error']}")
 
-    return redirect(url_for('groups.group_detail', group_id=group_id))
+    bot_tokens = get_bot_tokens()
+    if len(bot_tokens) > 1:
+        report.add('info', f"🤖 Bot nel pool di invio: {len(bot_tokens)} ({', '.join(str(bot_id) for bot_id in bot_tokens)})")
+
+    for bot_id, bot_token in bot_tokens.items():
+        breaker = get_circuit_breaker(bot_token).snapshot()
+        report.add('info' if breaker['state'] == 'closed' else 'warning',
+                   f"🔌 Circuit breaker bot {bot_id}: {breaker['state']} - errori {breaker['failures']}/{breaker['calls']} "
+                   f"({breaker['failure_rate']:.0%}) nelle ultime chiamate")
+        if breaker['retry_after']:
+            report.add('warning', f"⏸️ Invii del bot {bot_id} sospesi ancora per {breaker['retry_after']}s")
+
+    return _show_report(report)
 
 @groups_bp.route('/<int:group_id>/test_message/<int:user_id>')
 def test_single_message(group_id, user_id):
     """Testa invio a un singolo utente con debug completo"""
     group = Group.query.get_or_404(group_id)
     user = User.query.get_or_404(user_id)
-
-    from app.utils.telegram_helper import send_telegram_message
-    from datetime import datetime
+    report = debug_reports.new(f'Test messaggio a {user.full_name}', group_id)
 
     test_message = f"🧪 Test message sent at {datetime.now().strftime('%H:%M:%S')} from {group.name}"
 
-    flash(f"🚀 Tentativo invio a {user.full_name} (ID: {user.telegram_id})", 'info')
+    report.add('info', f"🚀 Tentativo invio a {user.full_name} (ID: {user.telegram_id})")
 
     # Crea log
     message_log = MessageLog(
@@ -505,17 +1242,17 @@ def test_single_message(group_id, user_id):
     if result['success']:
         message_log.status = 'sent'
         message_log.telegram_message_id = result['message_id']
-        flash(f"✅ Messaggio inviato! Message ID: {result['message_id']}", 'success')
+        report.add('success', f"✅ Messaggio inviato! Message ID: {result['message_id']}")
     else:
         message_log.status = 'failed'
         message_log.error_message = result['error']
-        flash(f"❌ ERRORE: {result['error']}", 'error')
+        report.add('error', f"❌ ERRORE: {result['error']}")
         if result['error_code']:
-            flash(f"🔢 Codice errore: {result['error_code']}", 'error')
+            report.add('error', f"🔢 Codice errore: {result['error_code']}")
 
     db.session.commit()
 
-    return redirect(url_for('groups.group_detail', group_id=group_id))
+    return _show_report(report)
 # Aggiungi questa route al tuo groups.py per test diretto:
 
 @groups_bp.route('/<int:group_id>/raw_test/<int:user_id>')
@@ -523,63 +1260,60 @@ def raw_test_message(group_id, user_id):
     """Test diretto della funzione send_telegram_message senza database"""
     group = Group.query.get_or_404(group_id)
     user = User.query.get_or_404(user_id)
-
-    from app.utils.telegram_helper import send_telegram_message, get_bot_token
-    from datetime import datetime
-    import os
+    report = debug_reports.new(f'Test diretto a {user.full_name}', group_id)
 
     # Info preliminari
     token = get_bot_token()
-    flash(f"🔑 Token presente: {bool(token)}", 'info')
-    flash(f"🎯 Target: {user.full_name} (ID: {user.telegram_id})", 'info')
+    report.add('info', f"🔑 Token presente: {bool(token)}")
+    report.add('info', f"🎯 Target: {user.full_name} (ID: {user.telegram_id})")
 
     # Test message
     test_message = f"🔧 RAW TEST {datetime.now().strftime('%H:%M:%S')}"
-    flash(f"📝 Messaggio: {test_message}", 'info')
+    report.add('info', f"📝 Messaggio: {test_message}")
 
     try:
         # Chiamata diretta
-        flash("🚀 Chiamata diretta send_telegram_message...", 'info')
+        report.add('info', "🚀 Chiamata diretta send_telegram_message...")
         result = send_telegram_message(user.telegram_id, test_message)
 
         # Analisi risultato
-        flash(f"📊 Tipo risultato: {type(result)}", 'info')
-        flash(f"📊 Valore risultato: {result}", 'info')
+        report.add('info', f"📊 Tipo risultato: {type(result)}")
+        report.add('info', f"📊 Valore risultato: {result}")
 
         if isinstance(result, dict):
-            flash(f"📊 Success: {result.get('success')}", 'info')
-            flash(f"📊 Message ID: {result.get('message_id')}", 'info')
-            flash(f"📊 Error: {result.get('error')}", 'info')
+            report.add('info', f"📊 Success: {result.get('success')}")
+            report.add('info', f"📊 Message ID: {result.get('message_id')}")
+            report.add('info', f"📊 Error: {result.get('error')}")
 
             if result.get('success'):
-                flash("✅ La funzione dice che è andato a buon fine!", 'success')
+                report.add('success', "✅ La funzione dice che è andato a buon fine!")
             else:
-                flash(f"❌ La funzione dice che è fallito: {result.get('error')}", 'error')
+                report.add('error', f"❌ La funzione dice che è fallito: {result.get('error')}")
         elif result is True:
-            flash("✅ Risultato True (formato vecchio)", 'success')
+            report.add('success', "✅ Risultato True (formato vecchio)")
         elif result is False:
-            flash("❌ Risultato False (formato vecchio)", 'error')
+            report.add('error', "❌ Risultato False (formato vecchio)")
         else:
-            flash(f"❓ Risultato inaspettato: {result}", 'warning')
+            report.add('warning', f"❓ Risultato inaspettato: {result}")
 
     except Exception as e:
-        flash(f"💥 Eccezione durante test: {str(e)}", 'error')
-        import traceback
-        flash(f"🔍 Traceback: {traceback.format_exc()}", 'error')
+        report.add('error', f"💥 Eccezione durante test: {str(e)}")
+        report.add('error', f"🔍 Traceback: {traceback.format_exc()}")
 
-    return redirect(url_for('groups.group_detail', group_id=group_id))
+    return _show_report(report)
 
 @groups_bp.route('/<int:group_id>/check_logs')
 def check_recent_logs(group_id):
     """Controlla gli ultimi log di messaggi per questo gruppo"""
     group = Group.query.get_or_404(group_id)
+    report = debug_reports.new('Ultimi log', group_id)
 
     # Ultimi 10 messaggi
     recent_logs = MessageLog.query.filter_by(group_id=group_id) \
         .order_by(MessageLog.sent_at.desc()) \
         .limit(10).all()
 
-    flash(f"📊 Ultimi {len(recent_logs)} messaggi del gruppo:", 'info')
+    report.add('info', f"📊 Ultimi {len(recent_logs)} messaggi del gruppo:")
 
     for log in recent_logs:
         timestamp = log.sent_at.strftime('%H:%M:%S')
@@ -589,26 +1323,25 @@ def check_recent_logs(group_id):
             msg = f"✅ {timestamp} - {user_name}: INVIATO"
             if log.telegram_message_id:
                 msg += f" (Msg ID: {log.telegram_message_id})"
-            flash(msg, 'success')
+            report.add('success', msg)
         elif log.status == 'failed':
             msg = f"❌ {timestamp} - {user_name}: FALLITO"
             if log.error_message:
                 msg += f" - {log.error_message}"
-            flash(msg, 'error')
+            report.add('error', msg)
         else:
-            flash(f"⏳ {timestamp} - {user_name}: {log.status.upper()}", 'warning')
+            report.add('warning', f"⏳ {timestamp} - {user_name}: {log.status.upper()}")
 
     if not recent_logs:
-        flash("📭 Nessun messaggio trovato per questo gruppo", 'info')
+        report.add('info', "📭 Nessun messaggio trovato per questo gruppo")
 
-    return redirect(url_for('groups.group_detail', group_id=group_id))
+    return _show_report(report)
 # Aggiungi questa route temporanea al tuo groups.py per debug:
 
 @groups_bp.route('/<int:group_id>/debug_env')
 def debug_environment(group_id):
     """Debug delle variabili ambiente"""
-    import os
-
+    report = debug_reports.new('Variabili ambiente', group_id)
     # Controlla tutte le variabili del .env
     env_vars = {
         'TELEGRAM_BOT_TOKEN': os.environ.get('TELEGRAM_BOT_TOKEN'),
@@ -619,59 +1352,59 @@ def debug_environment(group_id):
         'DB_NAME': os.environ.get('DB_NAME'),
     }
 
-    flash("🔍 DEBUG VARIABILI AMBIENTE:", 'info')
+    report.add('info', "🔍 DEBUG VARIABILI AMBIENTE:")
 
     for var_name, var_value in env_vars.items():
         if var_value:
             if 'TOKEN' in var_name or 'PASSWORD' in var_name or 'KEY' in var_name:
                 # Per variabili sensibili, mostra solo info generali
                 preview = f"{var_value[:6]}...{var_value[-4:]}" if len(var_value) > 10 else "***"
-                flash(f"✅ {var_name}: PRESENTE (lunghezza: {len(var_value)}, preview: {preview})", 'success')
+                report.add('success', f"✅ {var_name}: PRESENTE (lunghezza: {len(var_value)}, preview: {preview})")
             else:
-                flash(f"✅ {var_name}: {var_value}", 'success')
+                report.add('success', f"✅ {var_name}: {var_value}")
         else:
-            flash(f"❌ {var_name}: NON TROVATA", 'error')
+            report.add('error', f"❌ {var_name}: NON TROVATA")
 
     # Test diretto import dotenv
     try:
         from dotenv import load_dotenv
-        flash("✅ Modulo dotenv importato correttamente", 'success')
+        report.add('success', "✅ Modulo dotenv importato correttamente")
 
         # Prova a ricaricare
         load_dotenv()
         token_dopo_reload = os.environ.get('TELEGRAM_BOT_TOKEN')
-        flash(f"🔄 Token dopo reload: {'PRESENTE' if token_dopo_reload else 'ASSENTE'}", 'info')
+        report.add('info', f"🔄 Token dopo reload: {'PRESENTE' if token_dopo_reload else 'ASSENTE'}")
 
     except ImportError:
-        flash("❌ Modulo dotenv NON INSTALLATO!", 'error')
+        report.add('error', "❌ Modulo dotenv NON INSTALLATO!")
 
     # Controlla se il file .env esiste
-    import os
     env_file_path = os.path.join(os.getcwd(), '.env')
     env_exists = os.path.exists(env_file_path)
-    flash(f"📁 File .env esiste: {env_exists} ({env_file_path})", 'info')
+    report.add('info', f"📁 File .env esiste: {env_exists} ({env_file_path})")
 
     if env_exists:
         with open(env_file_path, 'r') as f:
             content = f.read()
             has_token = 'TELEGRAM_BOT_TOKEN' in content
-            flash(f"🔍 File .env contiene TELEGRAM_BOT_TOKEN: {has_token}", 'info')
+            report.add('info', f"🔍 File .env contiene TELEGRAM_BOT_TOKEN: {has_token}")
 
-    return redirect(url_for('groups.group_detail', group_id=group_id))
+    return _show_report(report)
 # Aggiungi questa route al tuo groups.py
 
 @groups_bp.route('/<int:group_id>/templates/<int:template_id>/edit', methods=['GET', 'POST'])
 def edit_template(group_id, template_id):
-    """Modifica un template esistente - Versione ottimizzata"""
-    from app.models import MessageTemplate, TemplateMessage
-    from datetime import datetime
-
-    group = Group.query.get_or_404(group_id)
-    template = MessageTemplate.query.filter_by(
+    """Modifica un template esistente: ogni modifica dei messaggi crea una nuova versione"""
+    group = Group.query.options(noload(Group.users)).get_or_404(group_id)
+    query = MessageTemplate.query.filter_by(
         id=template_id,
         group_id=group_id,
         is_active=True
-    ).first_or_404()
+    )
+    if request.method == 'POST':
+        # Due modifiche concorrenti non devono creare la stessa versione
+        query = query.with_for_update()
+    template = query.first_or_404()
 
     if request.method == 'POST':
         # Aggiorna nome e descrizione del template
@@ -680,15 +1413,7 @@ def edit_template(group_id, template_id):
 
         if not template_name:
             flash('Il nome del template è obbligatorio', 'error')
-            # CORREZIONE: Prepara existing_messages anche per il caso di errore
-            existing_messages = {
-                msg.user_id: msg.message_text
-                for msg in template.template_messages
-            }
-            return render_template('groups/edit_template.html',
-                                   group=group,
-                                   template=template,
-                                   existing_messages=existing_messages)
+            return _render_edit_template(group, template)
 
         # Verifica che non esista già un template con questo nome per il gruppo (escludendo se stesso)
         existing_template = MessageTemplate.query.filter_by(
@@ -699,82 +1424,82 @@ def edit_template(group_id, template_id):
 
         if existing_template:
             flash('Esiste già un template con questo nome per questo gruppo', 'error')
-            # CORREZIONE: Prepara existing_messages anche per il caso di errore
-            existing_messages = {
-                msg.user_id: msg.message_text
-                for msg in template.template_messages
-            }
-            return render_template('groups/edit_template.html',
-                                   group=group,
-                                   template=template,
-                                   existing_messages=existing_messages)
+            return _render_edit_template(group, template)
 
         # Aggiorna il template
         template.name = template_name
         template.description = template_description
         template.updated_at = datetime.utcnow()
 
-        # MIGLIORAMENTO: Aggiorna i messaggi esistenti invece di eliminarli tutti
+        # Messaggi correnti del template in una sola query: user_id -> (id, testo, posizione)
+        existing = {
+            user_id: (message_id, message_text, order_index)
+            for message_id, user_id, message_text, order_index in db.session.query(
+                TemplateMessage.id, TemplateMessage.user_id, TemplateMessage.message_text,
+                TemplateMessage.order_index
+            ).filter(TemplateMessage.template_id == template.id, TemplateMessage.current())
+        }
+        member_ids = _member_ids(group_id)
+
+        # Diff in memoria tra form ed esistenti. Le righe non si modificano mai:
+        # un testo cambiato, o spostato di posizione (i messaggi sono numerati
+        # nell'ordine dei membri), chiude la riga vecchia e ne inserisce una nuova
+        new_version = template.version + 1
+        inserts = []
+        closed = []
         messages_saved = 0
 
-        for user in group.users:
-            # MODIFICA: Usa il nuovo formato dei nomi dei campi
-            field_name = f'message_{template.id}_{user.id}'
-            message_text = request.form.get(field_name, '').strip()
-
-            # Debug del campo letto
-            print(f"DEBUG: Reading field {field_name} = '{message_text[:30]}...'")
-
-            # Cerca il messaggio esistente per questo utente e template specifico
-            existing_message = TemplateMessage.query.filter_by(
-                template_id=template.id,
-                user_id=user.id
-            ).first()
+        for user_id in member_ids:
+            message_text = request.form.get(f'message_{template.id}_{user_id}', '').strip()
+            current = existing.get(user_id)
 
             if message_text:
-                if existing_message:
-                    # Aggiorna il messaggio esistente
-                    existing_message.message_text = message_text
-                    existing_message.order_index = messages_saved
-                else:
-                    # Crea nuovo messaggio
-                    new_message = TemplateMessage(
-                        template_id=template.id,
-                        user_id=user.id,
-                        message_text=message_text,
-                        order_index=messages_saved
-                    )
-                    db.session.add(new_message)
+                if current is None or current[1:] != (message_text, messages_saved):
+                    if current is not None:
+                        closed.append(current[0])
+                    inserts.append({
+                        'template_id': template.id,
+                        'user_id': user_id,
+                        'message_text': message_text,
+                        'order_index': messages_saved,
+                        'valid_from': new_version
+                    })
                 messages_saved += 1
-            else:
-                # Se il messaggio è vuoto, elimina quello esistente se presente
-                if existing_message:
-                    db.session.delete(existing_message)
+            elif current is not None:
+                closed.append(current[0])
+
+        # Messaggi di utenti usciti dal gruppo: la nuova versione non li include
+        member_set = set(member_ids)
+        closed.extend(message_id for user_id, (message_id, _, _) in existing.items() if user_id not in member_set)
 
         if messages_saved == 0:
             flash('Devi inserire almeno un messaggio per salvare il template', 'error')
-            # CORREZIONE: Prepara existing_messages per il render
-            existing_messages = {
-                msg.user_id: msg.message_text
-                for msg in template.template_messages
-            }
-            return render_template('groups/edit_template.html',
-                                   group=group,
-                                   template=template,
-                                   existing_messages=existing_messages)
+            return _render_edit_template(group, template)
+
+        if inserts or closed:
+            template.version = new_version
+        if closed:
+            TemplateMessage.query.filter(TemplateMessage.id.in_(closed)) \
+                .update({TemplateMessage.valid_to: new_version}, synchronize_session=False)
+        if inserts:
+            db.session.bulk_insert_mappings(TemplateMessage, inserts)
 
         db.session.commit()
-        flash(f'Template "{template_name}" aggiornato con {messages_saved} messaggi', 'success')
+        cache.invalidate('templates', group_id)
+        flash(f'Template "{template_name}" aggiornato con {messages_saved} messaggi (versione {template.version})', 'success')
         return redirect(url_for('groups.view_template', group_id=group_id, template_id=template.id))
 
-    # GET - Prepara i dati per la modifica
-    # CORREZIONE PRINCIPALE: Filtra solo i messaggi di QUESTO template specifico
-    existing_messages = {
-        msg.user_id: msg.message_text
-        for msg in template.template_messages  # Usa template.template_messages invece di group.template_messages
-    }
+    return _render_edit_template(group, template)
 
-    return render_template('groups/edit_template.html',
-                           group=group,
-                           template=template,
-                           existing_messages=existing_messages)
\ No newline at end of file
+def _render_edit_template(group, template):
+    """Form di modifica con i testi correnti del template, in streaming come _render_create_template"""
+    existing_messages = dict(
+        db.session.query(TemplateMessage.user_id, TemplateMessage.message_text)
+        .filter(TemplateMessage.template_id == template.id, TemplateMessage.current())
+    )
+    return stream_page('groups/edit_template.html',
+                       group=group,
+                       template=template,
+                       existing_messages=existing_messages,
+                       members=_iter_members(group.id),
+                       member_count=_member_count(group.id))
\ No newline at end of file
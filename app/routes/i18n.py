@@ -7,8 +7,7 @@ def set_language(language=None):
     """Cambia la lingua dell'interfaccia"""
 
     # Verifica che la lingua sia supportata
-    supported_languages = ['it', 'en', 'es', 'fr', 'de']
-    if language not in supported_languages:
+    if language not in current_app.config.get('LANGUAGES', {}):
         language = current_app.config.get('BABEL_DEFAULT_LOCALE', 'it')
         flash(f'Lingua non supportata, impostata su {language}', 'warning')
 
@@ -16,9 +15,6 @@ def set_language(language=None):
     session['language'] = language
     session.permanent = True  # Rendi la sessione permanente
 
-    print(f"DEBUG: Lingua impostata su: {language}")  # Debug
-    print(f"DEBUG: Sessione dopo cambio: {session.get('language')}")  # Debug
-
     flash(f'Lingua cambiata in: {language.upper()}', 'success')
 
     # Redirect alla pagina precedente o homepage
@@ -1,17 +1,34 @@
 from flask import Blueprint, request, redirect, url_for, flash, jsonify, render_template
 from app.models import User
+from app.utils.telegram_helper import (get_bot_users, manual_add_user_from_chat_id,
+                                       test_bot_connection, get_specific_updates,
+                                       get_bot_token, get_bot_tokens, bot_id_from_token)
+from app.utils.broadcast import language_of
+from app.utils.cache import cache
+from app.utils.conditional import make_etag, not_modified, add_validators
+from app.utils.serializers import project, user_projection, json_response
+from app.utils.user_search import SEARCH_LIMIT, SEARCH_MAX_LIMIT, search_users
 from app import db
-from datetime import datetime
+from sqlalchemy import and_, func, or_
+from datetime import datetime, timezone
+import logging
+
+logger = logging.getLogger(__name__)
 
 telegram_bp = Blueprint('telegram', __name__)
 
 @telegram_bp.route('/import_users', methods=['POST'])
 def import_users():
-    """Importa utenti dal bot Telegram"""
+    """Importa utenti dai bot Telegram del pool, assegnando ogni utente al bot con cui ha interagito"""
     try:
-        from app.utils.telegram_helper import get_bot_users
-
-        bot_users = get_bot_users()
+        # telegram_id -> (dati utente, bot che lo hanno visto, nell'ordine del pool)
+        seen = {}
+        for bot_id, token in get_bot_tokens().items():
+            for user_data in get_bot_users(token):
+                entry = seen.setdefault(int(user_data['id']), (user_data, []))
+                entry[1].append(bot_id)
+
+        bot_users = [user_data for user_data, _ in seen.values()]
         imported_count = 0
         updated_count = 0
 
@@ -19,21 +36,34 @@ def import_users():
             flash('Nessun utente trovato negli updates recenti del bot. Prova ad aggiungere utenti manualmente.', 'warning')
             return redirect(url_for('main.index'))
 
+        # Un'unica query per trovare gli utenti già presenti, per id intero
+        telegram_ids = [int(user_data['id']) for user_data in bot_users]
+        existing_users = {
+            user.telegram_id: user
+            for user in User.query.filter(User.telegram_id.in_(telegram_ids))
+        }
+
         for user_data in bot_users:
-            telegram_id = str(user_data.get('id'))
+            telegram_id = int(user_data['id'])
+            bot_ids = seen[telegram_id][1]
             username = user_data.get('username')
             first_name = user_data.get('first_name', '')
             last_name = user_data.get('last_name', '')
+            language_code = language_of(user_data.get('language_code'))
 
-            # Cerca se l'utente esiste già
-            existing_user = User.query.filter_by(telegram_id=telegram_id).first()
+            existing_user = existing_users.get(telegram_id)
 
             if existing_user:
                 # Aggiorna i dati esistenti
                 existing_user.username = username
                 existing_user.first_name = first_name
                 existing_user.last_name = last_name
+                if language_code:
+                    existing_user.language_code = language_code
                 existing_user.last_interaction = datetime.utcnow()
+                existing_user.is_active = True  # Ha scritto al bot: di nuovo raggiungibile
+                if existing_user.bot_id not in bot_ids:
+                    existing_user.bot_id = bot_ids[0]
                 updated_count += 1
             else:
                 # Crea nuovo utente
@@ -43,12 +73,16 @@ def import_users():
                     first_name=first_name,
                     last_name=last_name,
                     display_name=f"{first_name} {last_name}".strip() or username or f"User {telegram_id}",
+                    language_code=language_code or 'it',
+                    bot_id=bot_ids[0],
                     last_interaction=datetime.utcnow()
                 )
                 db.session.add(new_user)
+                existing_users[telegram_id] = new_user
                 imported_count += 1
 
         db.session.commit()
+        cache.invalidate('users', 'all')
 
         message = f"Importazione completata: {imported_count} nuovi utenti, {updated_count} aggiornati"
         flash(message, 'success')
@@ -68,15 +102,13 @@ def add_user_by_chat_id():
         return redirect(url_for('main.index'))
 
     try:
-        from app.utils.telegram_helper import manual_add_user_from_chat_id
-
         user_data = manual_add_user_from_chat_id(chat_id)
 
         if not user_data:
             flash(f'Impossibile recuperare informazioni per Chat ID {chat_id}. Verifica che sia corretto e che il bot possa accedere alla chat.', 'error')
             return redirect(url_for('main.index'))
 
-        telegram_id = str(user_data.get('id'))
+        telegram_id = int(user_data['id'])
 
         # Verifica che l'utente non esista già
         existing_user = User.query.filter_by(telegram_id=telegram_id).first()
@@ -92,11 +124,13 @@ def add_user_by_chat_id():
             first_name=user_data.get('first_name', ''),
             last_name=user_data.get('last_name', ''),
             display_name=f"{user_data.get('first_name', '')} {user_data.get('last_name', '')}".strip() or user_data.get('username') or f"User {telegram_id}",
+            bot_id=bot_id_from_token(get_bot_token()),  # Trovato tramite il bot principale
             last_interaction=datetime.utcnow()
         )
 
         db.session.add(new_user)
         db.session.commit()
+        cache.invalidate('users', 'all')
 
         flash(f'Utente {new_user.full_name} aggiunto con successo!', 'success')
 
@@ -118,6 +152,12 @@ def create_user():
         flash('L\'ID Telegram è obbligatorio', 'error')
         return redirect(url_for('main.index'))
 
+    try:
+        telegram_id = int(telegram_id)
+    except ValueError:
+        flash('L\'ID Telegram deve essere numerico', 'error')
+        return redirect(url_for('main.index'))
+
     # Verifica che l'utente non esista già
     if User.query.filter_by(telegram_id=telegram_id).first():
         flash('Un utente con questo ID Telegram esiste già', 'error')
@@ -144,22 +184,127 @@ def create_user():
 
     db.session.add(user)
     db.session.commit()
+    cache.invalidate('users', 'all')
 
     flash(f'Utente "{display_name}" creato con successo', 'success')
     return redirect(url_for('main.index'))
 
+def _encode_cursor(row, since_mode):
+    """Posizione dell'ultimo utente di una pagina: (updated_at, id) per ?since=, altrimenti id"""
+    if since_mode:
+        return f"{row['updated_at'].isoformat()}_{row['id']}"
+    return str(row['id'])
+
+def _decode_cursor(cursor, since_mode):
+    """Inverso di _encode_cursor; ValueError se il cursore non è valido"""
+    if since_mode:
+        updated_at, _, user_id = cursor.rpartition('_')
+        return datetime.fromisoformat(updated_at), int(user_id)
+    return int(cursor)
+
 @telegram_bp.route('/users')
 def list_users():
-    """API per ottenere la lista degli utenti"""
-    users = User.query.filter_by(is_active=True).all()
-    return jsonify([user.to_dict() for user in users])
+    """
+    API per ottenere la lista degli utenti
+
+    Parametri opzionali:
+        since: data ISO 8601; ritorna solo gli utenti modificati da questa
+               data in poi, compresi quelli disattivati (is_active=false).
+               updated_at ha la precisione del secondo: il confronto è >=
+               e un utente può tornare due volte, il client lo riconosce
+               dall'id. Per la sincronizzazione successiva usare come since
+               il massimo updated_at ricevuto.
+        per_page, cursor: paginazione a cursore (per_page massimo 1000). Il
+               cursore della pagina successiva è nell'header X-Next-Cursor
+               (e nel Link rel="next"); il totale in X-Total-Count. Gli
+               utenti modificati mentre si scorrono le pagine si spostano in
+               fondo, nessuno viene saltato.
+
+    Supporta ETag/Last-Modified: se nulla è cambiato risponde 304.
+    """
+    since_arg = request.args.get('since')
+    cursor_arg = request.args.get('cursor')
+    paginated = cursor_arg is not None or 'per_page' in request.args
+    per_page = min(max(request.args.get('per_page', 100, type=int), 1), 1000)
+
+    if since_arg:
+        try:
+            since = datetime.fromisoformat(since_arg.replace('Z', '+00:00'))
+        except ValueError:
+            return jsonify({'error': 'Parametro since non valido, usa il formato ISO 8601'}), 400
+        if since.tzinfo is not None:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        query = User.query.filter(User.updated_at >= since)
+    else:
+        query = User.query.filter_by(is_active=True)
+
+    # Validatori calcolati senza caricare le righe
+    last_modified, total = query.with_entities(func.max(User.updated_at), func.count(User.id)).one()
+    etag = make_etag('users', last_modified, total, since_arg, cursor_arg, per_page if paginated else None)
+
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+
+    if cursor_arg:
+        try:
+            position = _decode_cursor(cursor_arg, since_mode=bool(since_arg))
+        except ValueError:
+            return jsonify({'error': 'Parametro cursor non valido'}), 400
+        if since_arg:
+            updated_at, user_id = position
+            query = query.filter(or_(
+                User.updated_at > updated_at,
+                and_(User.updated_at == updated_at, User.id > user_id)
+            ))
+        else:
+            query = query.filter(User.id > position)
+
+    if since_arg:
+        query = query.order_by(User.updated_at, User.id)
+    else:
+        query = query.order_by(User.id)
+    if paginated:
+        # Una riga in più dice se c'è una pagina successiva
+        query = query.limit(per_page + 1)
+
+    users = project(query, user_projection())
+    next_cursor = None
+    if paginated and len(users) > per_page:
+        users = users[:per_page]
+        next_cursor = _encode_cursor(users[-1], since_mode=bool(since_arg))
+
+    response = json_response(users)
+    response.headers['X-Total-Count'] = str(total)
+    if next_cursor:
+        next_url = url_for('telegram.list_users', since=since_arg, cursor=next_cursor, per_page=per_page)
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+
+    return add_validators(response, etag, last_modified)
+
+@telegram_bp.route('/users/search')
+def search_users_api():
+    """
+    Ricerca utenti per l'autocompletamento (nome, cognome, display name,
+    username o telegram_id)
+
+    Parametri:
+        q: testo da cercare, termini di almeno due caratteri
+        limit: numero di risultati (massimo 50)
+        exclude_group: id di un gruppo i cui membri non vanno restituiti
+    """
+    limit = min(max(request.args.get('limit', SEARCH_LIMIT, type=int), 1), SEARCH_MAX_LIMIT)
+    exclude_group = request.args.get('exclude_group', type=int)
+
+    hits = search_users(request.args.get('q', ''), exclude_group=exclude_group)
+
+    return json_response({'users': [hit.data for hit in hits[:limit]]})
 
 @telegram_bp.route('/test_connection')
 def test_connection():
     """Testa la connessione con il bot Telegram"""
     try:
-        from app.utils.telegram_helper import test_bot_connection
-
         if test_bot_connection():
             flash('Connessione al bot Telegram riuscita', 'success')
         else:
@@ -174,15 +319,11 @@ def test_connection():
 def debug_updates():
     """Debug: mostra gli updates recenti del bot"""
     try:
-        from app.utils.telegram_helper import get_specific_updates
-
         updates = get_specific_updates(limit=50)
 
         if updates:
             flash(f'Trovati {len(updates)} updates recenti. Controlla i log per dettagli.', 'info')
             # Log degli updates per debug
-            import logging
-            logger = logging.getLogger(__name__)
             logger.info(f"Updates recenti: {updates}")
         else:
             flash('Nessun update trovato. Il bot potrebbe non aver ricevuto messaggi di recente.', 'warning')
@@ -176,9 +176,9 @@ function validateForm(formId) {
     return isValid;
 }
 
-// Auto-save functionality for textareas
-function enableAutoSave() {
-    const textareas = document.querySelectorAll('.message-textarea');
+// Auto-save functionality for textareas (root: also rows added later)
+function enableAutoSave(root = document) {
+    const textareas = root.querySelectorAll('.message-textarea');
 
     textareas.forEach(textarea => {
         const key = `autosave_${textarea.id}`;
@@ -271,11 +271,304 @@ function fallbackCopyToClipboard(text) {
     document.body.removeChild(textArea);
 }
 
+// Live progress of a dispatch (Server-Sent Events)
+function setupDispatchProgress() {
+    const card = document.getElementById('dispatchProgress');
+    if (!card || typeof EventSource === 'undefined') {
+        return;
+    }
+
+    const bar = card.querySelector('.progress-bar');
+    const field = name => card.querySelector(`[data-progress="${name}"]`);
+    const source = new EventSource(card.dataset.progressUrl);
+
+    function render(data) {
+        const percent = data.total ? Math.round(data.done * 100 / data.total) : 100;
+        bar.style.width = `${percent}%`;
+        bar.setAttribute('aria-valuenow', percent);
+        bar.textContent = `${percent}%`;
+
+        field('done').textContent = data.done;
+        field('total').textContent = data.total;
+        field('sent').textContent = data.sent;
+        field('failed').textContent = data.failed;
+        field('rate').textContent = data.rate === null ? '-' : data.rate;
+    }
+
+    source.addEventListener('progress', function(e) {
+        render(JSON.parse(e.data));
+    });
+
+    source.addEventListener('done', function(e) {
+        const data = JSON.parse(e.data);
+        source.close();
+        render(data);
+
+        bar.classList.remove('progress-bar-animated', 'progress-bar-striped');
+        bar.classList.add(data.error ? 'bg-danger' : (data.failed ? 'bg-warning' : 'bg-success'));
+        field('hint').classList.add('d-none');
+        field('summary').classList.remove('d-none');
+
+        if (data.error) {
+            showAlert(`Invio interrotto: ${data.error}`, 'error');
+        } else if (data.failed) {
+            showAlert(`Invio completato: ${data.sent} inviati, ${data.failed} falliti`, 'warning');
+        } else {
+            showAlert(`Invio completato: ${data.sent} messaggi inviati`, 'success');
+        }
+    });
+}
+
+// Members of large groups: the page renders the first ones, the rest are
+// fetched page by page from the members endpoint while scrolling
+function setupMemberList() {
+    const more = document.getElementById('memberListMore');
+    const rowTemplate = document.getElementById('memberRowTemplate');
+    if (!more || !rowTemplate) {
+        return;
+    }
+
+    const button = more.querySelector('button');
+    const loadedCount = more.querySelector('[data-members="loaded"]');
+    const groupId = more.dataset.groupId;
+    let after = more.dataset.after;
+    let loading = false;
+    let observer = null;
+
+    function buildRow(member) {
+        const fragment = rowTemplate.content.cloneNode(true);
+        const field = name => fragment.querySelector(`[data-field="${name}"]`);
+
+        fragment.querySelector('.user-message-row').dataset.userId = member.id;
+        fragment.querySelectorAll('[data-field="full_name"]').forEach(el => {
+            el.textContent = member.full_name;
+        });
+        field('telegram_id').textContent = member.telegram_id;
+        if (member.is_active === false) {
+            field('inactive').classList.remove('d-none');
+        }
+        if (member.username) {
+            field('username').textContent = member.username;
+            field('username_row').classList.remove('d-none');
+        }
+        if (member.last_interaction) {
+            field('last_interaction').textContent = new Date(member.last_interaction).toLocaleDateString('it-IT');
+            field('last_interaction_row').classList.remove('d-none');
+        }
+        field('remove').addEventListener('click', () => removeUser(groupId, member.id, member.full_name));
+
+        const textarea = fragment.querySelector('textarea');
+        textarea.id = textarea.name = `direct_message_${member.id}`;
+        fragment.querySelector('label').htmlFor = textarea.id;
+        fragment.querySelector('.char-count').dataset.target = textarea.id;
+        // Text of "fill all" (or empty after "clear all") if used before this page arrived,
+        // otherwise the text of the loaded template
+        textarea.value = 'fill' in more.dataset ? more.dataset.fill : (member.message_text || '');
+        return fragment;
+    }
+
+    function loadMore() {
+        if (loading || !after) {
+            return;
+        }
+        loading = true;
+        button.disabled = true;
+
+        const url = new URL(more.dataset.membersUrl, window.location.origin);
+        url.searchParams.set('after', after);
+        fetch(url)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => {
+                const rows = document.createDocumentFragment();
+                data.members.forEach(member => rows.appendChild(buildRow(member)));
+                enableAutoSave(rows);
+                rows.querySelectorAll('.message-textarea').forEach(textarea => {
+                    if (typeof updateCharCount === 'function') {
+                        updateCharCount(textarea);
+                        textarea.addEventListener('input', () => updateCharCount(textarea));
+                    }
+                });
+                more.before(rows);
+
+                loadedCount.textContent = parseInt(loadedCount.textContent, 10) + data.members.length;
+                after = data.next_after;
+                if (!after) {
+                    if (observer) {
+                        observer.disconnect();
+                    }
+                    more.remove();
+                } else if (observer) {
+                    // Still in view (short rows): observing again fires the next page
+                    observer.unobserve(more);
+                    observer.observe(more);
+                }
+            })
+            .catch(error => {
+                showAlert('Errore nel caricamento degli utenti: ' + error.message, 'error');
+            })
+            .finally(() => {
+                loading = false;
+                button.disabled = false;
+            });
+    }
+
+    button.addEventListener('click', loadMore);
+    if ('IntersectionObserver' in window) {
+        observer = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                loadMore();
+            }
+        }, { rootMargin: '600px' });
+        observer.observe(more);
+    }
+}
+
+// Autocomplete user picker of the "add users" form (searches /telegram/users/search)
+function setupUserPicker() {
+    const input = document.getElementById('userPickerInput');
+    if (!input) {
+        return;
+    }
+
+    const value = document.getElementById('userPickerValue');
+    const results = document.getElementById('userPickerResults');
+    const submit = document.getElementById('userPickerSubmit');
+    const minLength = 2;
+    let timer = null;
+    let controller = null;
+    let active = -1;
+
+    function select(user) {
+        input.value = user.username ? `${user.full_name} (@${user.username})` : user.full_name;
+        value.value = user.id;
+        submit.disabled = false;
+        hide();
+    }
+
+    function hide() {
+        results.classList.add('d-none');
+        results.replaceChildren();
+        active = -1;
+    }
+
+    function highlight(index) {
+        const items = results.querySelectorAll('.list-group-item-action');
+        if (!items.length) {
+            return;
+        }
+        active = (index + items.length) % items.length;
+        items.forEach((item, i) => item.classList.toggle('active', i === active));
+        items[active].scrollIntoView({ block: 'nearest' });
+    }
+
+    function show(users) {
+        results.replaceChildren();
+        active = -1;
+        if (!users.length) {
+            const empty = document.createElement('div');
+            empty.className = 'list-group-item text-muted';
+            empty.textContent = 'Nessun utente trovato';
+            results.appendChild(empty);
+        }
+        users.forEach(user => {
+            const item = document.createElement('button');
+            item.type = 'button';
+            item.className = 'list-group-item list-group-item-action';
+            item.textContent = user.full_name;
+
+            const details = document.createElement('small');
+            details.className = 'text-muted ms-2';
+            details.textContent = (user.username ? `@${user.username} · ` : '') + user.telegram_id;
+            item.appendChild(details);
+            if (user.is_active === false) {
+                const badge = document.createElement('span');
+                badge.className = 'badge bg-secondary ms-2';
+                badge.textContent = 'Inattivo';
+                item.appendChild(badge);
+            }
+
+            // mousedown runs before the input loses focus
+            item.addEventListener('mousedown', event => {
+                event.preventDefault();
+                select(user);
+            });
+            results.appendChild(item);
+        });
+        results.classList.remove('d-none');
+    }
+
+    function search() {
+        const query = input.value.trim();
+        if (controller) {
+            controller.abort();
+        }
+        if (query.length < minLength) {
+            hide();
+            return;
+        }
+
+        controller = new AbortController();
+        const url = new URL(input.dataset.searchUrl, window.location.origin);
+        url.searchParams.set('q', query);
+        url.searchParams.set('exclude_group', input.dataset.groupId);
+        fetch(url, { signal: controller.signal })
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => show(data.users))
+            .catch(error => {
+                if (error.name !== 'AbortError') {
+                    showAlert('Errore nella ricerca degli utenti: ' + error.message, 'error');
+                }
+            });
+    }
+
+    input.addEventListener('input', () => {
+        // A typed text is not a selection
+        value.value = '';
+        submit.disabled = true;
+        clearTimeout(timer);
+        timer = setTimeout(search, 150);
+    });
+
+    input.addEventListener('keydown', event => {
+        if (event.key === 'ArrowDown' || event.key === 'ArrowUp') {
+            event.preventDefault();
+            highlight(active + (event.key === 'ArrowDown' ? 1 : -1));
+        } else if (event.key === 'Enter' && active >= 0) {
+            event.preventDefault();
+            results.querySelectorAll('.list-group-item-action')[active]
+                .dispatchEvent(new MouseEvent('mousedown', { cancelable: true }));
+        } else if (event.key === 'Escape') {
+            hide();
+        }
+    });
+
+    input.addEventListener('blur', hide);
+}
+
 // Initialize everything when DOM is loaded
 document.addEventListener('DOMContentLoaded', function() {
     // Setup keyboard shortcuts
     setupKeyboardShortcuts();
 
+    // Live progress bar after a send
+    setupDispatchProgress();
+
+    // Lazily loaded members of large groups
+    setupMemberList();
+
+    // User search of the "add users" form
+    setupUserPicker();
+
     // Enable auto-save for message forms
     if (document.querySelector('.message-textarea')) {
         enableAutoSave();
@@ -0,0 +1,136 @@
+"""
+Messaggi broadcast: un solo testo per tutto il gruppo, con segnaposto
+sostituiti per ogni destinatario
+
+Segnaposto supportati: {first_name}, {display_name}, {username}.
+Le graffe letterali si scrivono raddoppiate ({{ e }}), come in str.format.
+I messaggi partono con parse_mode HTML: i valori dei segnaposto vengono
+sottoposti a escape (un nome con < o & non deve rompere il messaggio),
+il testo scritto nel template resta com'è, markup compreso.
+
+Il testo viene analizzato una volta sola e trasformato in una lista di pezzi
+(stringhe fisse e getter sugli attributi del Recipient); la versione compilata
+resta in cache, quindi rendere il messaggio per ogni utente del roster costa
+solo una join di stringhe.
+
+Un broadcast può avere varianti per lingua: i destinatari vengono raggruppati
+per lingua (language_code dell'utente) e ogni variante è compilata una volta
+per gruppo; un testo senza segnaposto è reso una sola volta per lingua e lo
+stesso testo va a tutti gli utenti di quella lingua.
+"""
+
+from collections import defaultdict
+from functools import lru_cache
+from html import escape
+from operator import attrgetter
+from string import Formatter
+
+# Segnaposto -> attributo del Recipient (display_name usa il nome completo,
+# che ha già i fallback su nome, username e id)
+PLACEHOLDERS = {
+    'first_name': 'first_name',
+    'display_name': 'full_name',
+    'username': 'username',
+}
+
+
+class BroadcastTemplateError(ValueError):
+    """Testo broadcast con segnaposto non validi"""
+
+
+@lru_cache(maxsize=256)
+def compile_message(text):
+    """
+    Compila il testo in una funzione render(recipient) -> str.
+
+    Raises:
+        BroadcastTemplateError: segnaposto sconosciuti o graffe non bilanciate
+    """
+    try:
+        parsed = list(Formatter().parse(text))
+    except ValueError as e:
+        raise BroadcastTemplateError(f"graffe non bilanciate ({str(e)})")
+
+    pieces = []
+    for literal, field, format_spec, conversion in parsed:
+        if literal:
+            pieces.append(literal)
+        if field is None:
+            continue
+        if field not in PLACEHOLDERS or format_spec or conversion:
+            raise BroadcastTemplateError(
+                f"segnaposto {{{field}}} non supportato, usa "
+                + ', '.join(f'{{{name}}}' for name in PLACEHOLDERS)
+            )
+        pieces.append(attrgetter(PLACEHOLDERS[field]))
+
+    if all(isinstance(piece, str) for piece in pieces):
+        # Nessun segnaposto: stesso testo per tutti
+        constant = ''.join(pieces)
+
+        def render_constant(recipient):
+            return constant
+
+        render_constant.constant = constant  # render_for_roster lo rende una volta sola
+        return render_constant
+
+    def render(recipient):
+        return ''.join(
+            piece if isinstance(piece, str) else escape(piece(recipient) or '', quote=False)
+            for piece in pieces
+        )
+
+    return render
+
+
+def render_for_roster(text, roster):
+    """Genera (Recipient, testo) per ogni destinatario, saltando i testi vuoti"""
+    render = compile_message(text)
+
+    constant = getattr(render, 'constant', None)
+    if constant is not None:
+        message_text = constant.strip()
+        if message_text:
+            for recipient in roster:
+                yield recipient, message_text
+        return
+
+    for recipient in roster:
+        message_text = render(recipient).strip()
+        if message_text:
+            yield recipient, message_text
+
+
+def language_of(language_code):
+    """Lingua base di un language_code ('pt-BR' -> 'pt'), None se assente"""
+    if not language_code:
+        return None
+    return language_code.replace('_', '-').split('-', 1)[0].lower() or None
+
+
+def group_by_language(roster, languages):
+    """
+    Raggruppa il roster per lingua.
+
+    Returns:
+        {lingua: [Recipient]}; la chiave None raccoglie chi non ha una
+        lingua tra languages (riceverà il testo predefinito)
+    """
+    groups = defaultdict(list)
+    for recipient in roster:
+        language = language_of(recipient.language_code)
+        groups[language if language in languages else None].append(recipient)
+    return groups
+
+
+def render_variants(default_text, variants, roster_by_language):
+    """
+    Genera (Recipient, testo) usando per ogni utente la variante della sua
+    lingua, o default_text se non c'è.
+
+    variants: {lingua: testo}
+    roster_by_language: risultato di group_by_language(roster, variants)
+    """
+    for language, recipients in roster_by_language.items():
+        text = variants[language] if language is not None else default_text
+        yield from render_for_roster(text, recipients)
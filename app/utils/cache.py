@@ -0,0 +1,263 @@
+"""
+Cache lato server per le pagine di sola lettura (gruppi e template)
+
+Di default è una LRU in memoria con TTL, una per processo. Se CACHE_REDIS_URL
+è configurato (e il pacchetto redis è installato) le voci vanno in uno store
+Redis-compatibile condiviso tra tutti i worker.
+
+Le chiavi includono id e updated_at della riga letta, più un contatore di
+versione che viene incrementato ad ogni modifica: una scrittura rende subito
+irraggiungibili le voci vecchie, che poi escono per LRU o TTL. I contatori
+sono sempre condivisi tra i worker: in Redis, oppure nella tabella
+cache_versions quando le voci stanno nella LRU locale (un'invalidazione in
+un worker deve valere anche per le LRU degli altri). updated_at ha la
+precisione del secondo, quindi è il contatore a distinguere due modifiche
+nello stesso secondo: va incrementato dopo il commit.
+"""
+
+import logging
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from flask import g, has_request_context
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import CacheVersion
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - dipendenza opzionale
+    redis = None
+
+
+class LRUCache:
+    """LRU in memoria con scadenza per voce, thread-safe"""
+
+    def __init__(self, max_entries=1024, default_ttl=60):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        # I contatori di versione non sono soggetti a LRU: se sparissero
+        # tornerebbero a 0 e renderebbero di nuovo valide voci obsolete
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (ttl or self.default_ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+
+
+class RedisCache:
+    """Stesso contratto di LRUCache su uno store Redis-compatibile"""
+
+    def __init__(self, url, default_ttl=60, prefix='tgm:'):
+        self.client = redis.Redis.from_url(url)
+        self.default_ttl = default_ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.setex(self.prefix + key, ttl or self.default_ttl, pickle.dumps(value))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+
+class DatabaseCounters:
+    """
+    Contatori di versione nella tabella cache_versions.
+
+    Le letture usano la connessione della sessione, senza occuparne
+    un'altra del pool; dentro una richiesta ogni contatore si legge una
+    volta sola (resta in g fino alla fine della richiesta). Gli incrementi di una richiesta si accumulano
+    e si applicano tutti insieme prima della risposta (flush(), da
+    after_request), in una transazione propria; fuori da una richiesta
+    (thread di invio) si applicano subito.
+    """
+
+    def counter(self, key):
+        if not has_request_context():
+            return self._read(key)
+        known = g.setdefault('cache_versions', {})
+        if key not in known:
+            known[key] = self._read(key)
+        # Gli incrementi non ancora applicati valgono già per questa richiesta
+        return known[key] + g.get('cache_version_increments', Counter())[key]
+
+    def incr(self, key):
+        if has_request_context():
+            g.setdefault('cache_version_increments', Counter())[key] += 1
+        else:
+            self._apply({key: 1})
+
+    def flush(self):
+        """Fine della richiesta: applica gli incrementi accumulati e dimentica i contatori letti"""
+        g.pop('cache_versions', None)
+        increments = g.pop('cache_version_increments', None)
+        if increments:
+            self._apply(increments)
+
+    @staticmethod
+    def _read(key):
+        return db.session.execute(select(CacheVersion.version).where(CacheVersion.key == key)).scalar() or 0
+
+    @staticmethod
+    def _apply(increments):
+        with db.engine.begin() as conn:
+            for key, amount in increments.items():
+                increment = update(CacheVersion).where(CacheVersion.key == key) \
+                    .values(version=CacheVersion.version + amount)
+                if conn.execute(increment).rowcount:
+                    continue
+                try:
+                    with conn.begin_nested():
+                        conn.execute(insert(CacheVersion).values(key=key, version=amount))
+                except IntegrityError:
+                    # Creato nel frattempo da un altro worker
+                    conn.execute(increment)
+
+
+class ViewCache:
+    """
+    Punto di accesso alla cache, inizializzato come le altre estensioni.
+
+    Uso tipico nelle route:
+        snapshot = cache.get_or_set(cache.key('group', group_id, updated_at), loader)
+    e dopo il commit di una modifica:
+        cache.invalidate('group', group_id)
+    """
+
+    def __init__(self):
+        self.backend = LRUCache()
+        self.versions = self.backend
+
+    def init_app(self, app):
+        ttl = app.config.get('CACHE_DEFAULT_TTL', 60)
+        redis_url = app.config.get('CACHE_REDIS_URL')
+
+        if redis_url and redis is not None:
+            self.backend = RedisCache(redis_url, default_ttl=ttl)
+            self.versions = self.backend
+            logger.info("Cache viste su Redis")
+        else:
+            if redis_url:
+                logger.warning("CACHE_REDIS_URL impostato ma il pacchetto redis non è installato: uso la LRU locale")
+            self.backend = LRUCache(max_entries=app.config.get('CACHE_MAX_ENTRIES', 1024), default_ttl=ttl)
+            self.versions = DatabaseCounters()
+            # Prima della risposta: la richiesta successiva vede già le invalidazioni.
+            # Il teardown copre le richieste finite con un'eccezione
+            app.after_request(self._flush_versions)
+            app.teardown_request(self._flush_versions)
+
+        app.extensions['view_cache'] = self
+
+    def version(self, kind, ident):
+        """Contatore di versione di un namespace (es. 'group', 5)"""
+        try:
+            return self.versions.counter(self._version_key(kind, ident))
+        except Exception as e:
+            logger.warning(f"Lettura versione cache fallita per {kind}:{ident}: {str(e)}")
+            return 0
+
+    def key(self, kind, ident, *parts):
+        """Chiave di cache per il namespace (kind, ident) alla sua versione corrente"""
+        version = self.version(kind, ident)
+        return ':'.join(str(part) for part in (kind, ident) + parts) + f':v{version}'
+
+    def get_or_set(self, key, loader, ttl=None):
+        """Ritorna il valore in cache o lo calcola con loader() e lo salva"""
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"Lettura cache fallita per {key}: {str(e)}")
+            value = None
+
+        if value is None:
+            value = loader()
+            try:
+                self.backend.set(key, value, ttl)
+            except Exception as e:
+                # Uno store remoto non disponibile non deve rompere la pagina
+                logger.warning(f"Scrittura in cache fallita per {key}: {str(e)}")
+        return value
+
+    def invalidate(self, kind, ident):
+        """Rende obsolete tutte le voci del namespace (es. 'group', 5): chiamare dopo il commit"""
+        try:
+            self.versions.incr(self._version_key(kind, ident))
+        except Exception as e:
+            logger.warning(f"Invalidazione cache fallita per {kind}:{ident}: {str(e)}")
+
+    def invalidate_on_commit(self, kind, ident):
+        """Come invalidate(), ma al commit della sessione corrente (per chi non fa commit)"""
+        event.listen(db.session(), 'after_commit', lambda session: self.invalidate(kind, ident), once=True)
+
+    def _flush_versions(self, response=None):
+        try:
+            self.versions.flush()
+        except Exception as e:
+            logger.warning(f"Invalidazione cache fallita: {str(e)}")
+        return response
+
+    def clear(self):
+        self.backend.clear()
+
+    @staticmethod
+    def _version_key(kind, ident):
+        return f'version:{kind}:{ident}'
+
+
+cache = ViewCache()
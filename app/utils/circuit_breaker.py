@@ -0,0 +1,91 @@
+"""
+Circuit breaker per le chiamate alla Bot API
+
+Tiene gli esiti delle ultime chiamate (finestra scorrevole). Quando la quota
+di errori di rete, timeout e 5xx supera la soglia il circuito si apre: per
+open_seconds le chiamate falliscono subito invece di aspettare il timeout di
+30s, così i thread di invio non si accumulano su un Telegram irraggiungibile.
+
+Scaduto il tempo il circuito passa a half-open e lascia passare una sola
+richiesta di prova: se va a buon fine si richiude, altrimenti si riapre.
+"""
+
+import threading
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Circuit breaker thread-safe a finestra scorrevole"""
+
+    def __init__(self, failure_rate=0.5, min_calls=10, window=20, open_seconds=30.0):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self._outcomes = deque(maxlen=window)  # True = errore
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """True se la chiamata può partire; in half-open passa una sola prova alla volta"""
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    return False
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+
+            if self._state == HALF_OPEN:
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._state = CLOSED
+                self._outcomes.clear()
+            self._outcomes.append(False)
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._trip()
+                return
+            self._outcomes.append(True)
+            if len(self._outcomes) >= self.min_calls and \
+                    sum(self._outcomes) / len(self._outcomes) >= self.failure_rate:
+                self._trip()
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def retry_after(self):
+        """Secondi prima della prossima prova (0 se il circuito non è aperto)"""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def snapshot(self):
+        """Stato corrente, per le pagine di debug"""
+        retry_after = self.retry_after()
+        with self._lock:
+            calls = len(self._outcomes)
+            failures = sum(self._outcomes)
+            return {
+                'state': self._state,
+                'calls': calls,
+                'failures': failures,
+                'failure_rate': round(failures / calls, 2) if calls else 0.0,
+                'retry_after': round(retry_after, 1)
+            }
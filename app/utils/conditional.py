@@ -0,0 +1,56 @@
+"""
+Supporto per GET condizionali (ETag / Last-Modified) sugli endpoint JSON
+
+I validatori si calcolano con una query aggregata (MAX(updated_at), COUNT)
+prima di caricare le righe: se il client ha già la versione corrente
+risponde 304 senza serializzare nulla.
+"""
+
+import hashlib
+from datetime import timezone
+
+from flask import request, current_app
+
+
+def make_etag(*parts):
+    """ETag debole calcolato dalle parti che identificano il contenuto"""
+    raw = '|'.join(str(part) for part in parts)
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def _http_datetime(value):
+    """datetime naive UTC del database -> datetime aware al secondo (precisione HTTP)"""
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc, microsecond=0)
+
+
+def not_modified(etag, last_modified=None):
+    """
+    Ritorna una risposta 304 se la richiesta corrente ha già questa versione,
+    altrimenti None.
+    """
+    last_modified = _http_datetime(last_modified)
+
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified:
+        fresh = last_modified <= request.if_modified_since
+    else:
+        fresh = False
+
+    if not fresh:
+        return None
+
+    response = current_app.response_class(status=304)
+    return add_validators(response, etag, last_modified)
+
+
+def add_validators(response, etag, last_modified=None):
+    """Aggiunge ETag, Last-Modified e Cache-Control alla risposta"""
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = _http_datetime(last_modified)
+    # Il client può tenere la risposta ma deve sempre rivalidarla
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,487 @@
+"""
+Invio parallelo dei messaggi con rate limit
+
+Il roster dei destinatari si costruisce con una sola query a colonne
+(nessun oggetto User): ogni destinatario è un record con __slots__ che
+contiene solo quello che serve all'invio.
+
+Il dispatcher invia con un pool di thread limitato dal RateLimiter
+(token bucket sui limiti globali della Bot API) e restituisce i risultati
+man mano che arrivano: il chiamante aggiorna i log nel proprio thread,
+che è l'unico a usare la sessione del database.
+
+Con più bot configurati (TELEGRAM_BOT_TOKENS) ogni invio viene ripartito
+per bot: ciascuno ha i propri thread, rate limiter, sessione HTTP e circuit
+breaker, quindi il throughput cresce con il numero di bot.
+
+Il limite della Bot API è per bot, mentre i worker gunicorn sono processi
+separati: con TELEGRAM_RATE_LIMIT_REDIS_URL (o CACHE_REDIS_URL) il token
+bucket di ogni bot sta in Redis ed è condiviso da tutti i processi;
+altrimenti ogni processo usa TELEGRAM_RATE_LIMIT diviso per
+TELEGRAM_RATE_LIMIT_PROCESSES (impostato da gunicorn.conf.py al numero di
+worker), così la somma non supera mai il limite.
+
+Gli invii falliti per errori temporanei vengono rimessi in coda secondo la
+RetryPolicy (vedi app.utils.retry) senza far dormire i thread di invio.
+
+Gli utenti irraggiungibili (bot bloccato, account cancellato) vengono
+disattivati in blocco a fine invio e il roster non li include più.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import ExitStack
+
+from flask import current_app
+from sqlalchemy import and_, func, or_
+
+from app import db
+from app.models import Dispatch, MessageLog, User, group_users
+from app.utils.cache import cache
+from app.utils.retry import (
+    FLOOD_ERROR_CODE, GIVE_UP, SERVER_ERROR_CODE, RetryBudget, RetryPolicy, classify
+)
+from app.utils.telegram_helper import send_telegram_message, get_bot_tokens
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - dipendenza opzionale
+    redis = None
+
+
+class Recipient:
+    """Destinatario compatto: id utente, chat_id intero, bot assegnato, lingua e i nomi usati nei messaggi"""
+
+    __slots__ = ('user_id', 'chat_id', 'full_name', 'first_name', 'username', 'bot_id', 'language_code')
+
+    def __init__(self, user_id, chat_id, full_name, first_name=None, username=None, bot_id=None, language_code=None):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.full_name = full_name
+        self.first_name = first_name
+        self.username = username
+        self.bot_id = bot_id
+        self.language_code = language_code
+
+    def __repr__(self):
+        return f'<Recipient {self.user_id} chat={self.chat_id}>'
+
+
+def load_roster(group_id=None, user_ids=None):
+    """
+    Carica i destinatari attivi di un gruppo (o di una lista di utenti) con
+    una query a sole colonne, ordinati per id utente.
+    """
+    query = db.session.query(
+        User.id, User.telegram_id, User.display_name, User.first_name, User.last_name, User.username,
+        User.bot_id, User.language_code
+    ).filter(User.is_active == True)  # noqa: E712 - gli utenti irraggiungibili non ricevono invii
+
+    if group_id is not None:
+        query = query.join(group_users, group_users.c.user_id == User.id) \
+            .filter(group_users.c.group_id == group_id)
+    if user_ids is not None:
+        if not user_ids:
+            return []
+        query = query.filter(User.id.in_(list(user_ids)))
+
+    return [
+        Recipient(
+            user_id,
+            telegram_id,
+            User.compose_full_name(display_name, first_name, last_name, username, telegram_id),
+            first_name,
+            username,
+            bot_id,
+            language_code
+        )
+        for user_id, telegram_id, display_name, first_name, last_name, username, bot_id, language_code
+        in query.order_by(User.id)
+    ]
+
+
+def is_retryable(error_code):
+    """True se un invio fallito con questo error_code va ritentato (tabella di app.utils.retry)"""
+    return classify(error_code) != GIVE_UP
+
+
+def retryable_condition(stale_before):
+    """
+    Stessa regola di is_retryable() come filtro SQL sui MessageLog, più i
+    pending mai inviati: questi solo se l'invio è finito o fermo da prima di
+    stale_before, altrimenti il thread di invio li sta ancora elaborando.
+    La query deve includere Dispatch (join sul dispatch_id del log).
+    """
+    return or_(
+        and_(MessageLog.status == 'pending', dispatch_idle_condition(stale_before)),
+        and_(
+            MessageLog.status == 'failed',
+            or_(
+                MessageLog.error_code.is_(None),
+                MessageLog.error_code == FLOOD_ERROR_CODE,
+                MessageLog.error_code >= SERVER_ERROR_CODE
+            )
+        )
+    )
+
+
+def dispatch_idle_condition(stale_before):
+    """Filtro SQL sui Dispatch finiti o senza segni di vita da prima di stale_before"""
+    return or_(
+        Dispatch.finished_at.isnot(None),
+        func.coalesce(Dispatch.updated_at, Dispatch.created_at) < stale_before
+    )
+
+
+# 403: bot bloccato o account disattivato; 400 con una di queste descrizioni:
+# la chat non esiste più. Sono errori permanenti per quell'utente.
+UNREACHABLE_ERROR_CODE = 403
+UNREACHABLE_DESCRIPTIONS = ('chat not found', 'user is deactivated', 'peer_id_invalid')
+
+
+def is_unreachable(result):
+    """True se il risultato di send_telegram_message indica un utente non più raggiungibile"""
+    error_code = result.get('error_code')
+    if error_code == UNREACHABLE_ERROR_CODE:
+        return True
+    if error_code == 400:
+        error = (result.get('error') or '').lower()
+        return any(description in error for description in UNREACHABLE_DESCRIPTIONS)
+    return False
+
+
+def bot_not_in_pool(bot_id):
+    """
+    Risultato (come send_telegram_message) per un utente assegnato a un bot
+    non più nel pool: gli altri bot non hanno mai parlato con lui, un invio
+    da un altro bot fallirebbe con 403. Senza error_code, come un errore di
+    rete: rimesso il token nel pool, l'invio si può ritentare.
+    """
+    return {
+        'success': False,
+        'message_id': None,
+        'error': f"Bot {bot_id} non più nel pool: messaggio non inviato",
+        'error_code': None
+    }
+
+
+def deactivate_users(user_ids):
+    """Segna gli utenti come inattivi con un solo UPDATE (senza commit)"""
+    if not user_ids:
+        return 0
+    count = User.query.filter(User.id.in_(list(user_ids))) \
+        .update({User.is_active: False}, synchronize_session=False)
+    cache.invalidate_on_commit('users', 'all')
+    logger.info(f"Disattivati {count} utenti irraggiungibili")
+    return count
+
+
+class RateLimiter:
+    """
+    Token bucket thread-safe.
+
+    rate: invii al secondo a regime; burst: invii consentiti di fila.
+    La Bot API accetta circa 30 messaggi al secondo per bot.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocca finché non è disponibile un token"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait_time = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+    def pause(self, seconds):
+        """Sospende tutti gli invii (429 con retry_after: il flood limit è per bot)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+class RedisRateLimiter:
+    """
+    Stesso contratto di RateLimiter, con lo stato in Redis: un solo limite
+    per bot condiviso da tutti i processi (GCRA, l'equivalente di un token
+    bucket che salva solo l'istante teorico del prossimo invio).
+
+    Se Redis non risponde si usa il RateLimiter locale di fallback.
+    """
+
+    # Richiede Redis 5+ (TIME dentro uno script che scrive)
+    _ACQUIRE = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2]) * interval
+local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or 0), now)
+local wait = tat + interval - now - tolerance
+if wait > 0 then
+    return tostring(wait)
+end
+redis.call('SET', KEYS[1], tostring(tat + interval), 'PX', math.ceil((tat + interval - now) * 1000) + 1000)
+return '0'
+"""
+
+    _PAUSE = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local tat = now + tonumber(ARGV[1]) + tonumber(ARGV[2])
+if tat > tonumber(redis.call('GET', KEYS[1]) or 0) then
+    redis.call('SET', KEYS[1], tostring(tat), 'PX', math.ceil((tat - now) * 1000) + 1000)
+end
+return 'OK'
+"""
+
+    def __init__(self, client, key, rate, burst=None, fallback=None):
+        self.key = key
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.fallback = fallback or RateLimiter(rate, burst)
+        self._acquire = client.register_script(self._ACQUIRE)
+        self._pause = client.register_script(self._PAUSE)
+
+    def acquire(self):
+        """Blocca finché non è disponibile un token"""
+        while True:
+            try:
+                wait_time = float(self._acquire(keys=[self.key], args=[1 / self.rate, self.capacity]))
+            except redis.RedisError as e:
+                logger.warning(f"Rate limit su Redis non disponibile, uso quello locale: {str(e)}")
+                self.fallback.acquire()
+                return
+            if wait_time <= 0:
+                return
+            time.sleep(wait_time)
+
+    def pause(self, seconds):
+        """Sospende gli invii del bot in tutti i processi; alla ripresa il bucket è vuoto"""
+        self.fallback.pause(seconds)
+        try:
+            self._pause(keys=[self.key], args=[seconds, self.capacity / self.rate])
+        except redis.RedisError as e:
+            logger.warning(f"Pausa del rate limit su Redis fallita: {str(e)}")
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(bot_id=None):
+    """RateLimiter di un bot, condiviso da tutti gli invii del processo (e, con Redis, degli altri processi)"""
+    with _rate_limiters_lock:
+        rate_limiter = _rate_limiters.get(bot_id)
+        if rate_limiter is None:
+            config = current_app.config
+            rate = config.get('TELEGRAM_RATE_LIMIT', 25)
+            # Senza stato condiviso ogni processo ha la sua quota del limite del bot
+            local = RateLimiter(rate / max(config.get('TELEGRAM_RATE_LIMIT_PROCESSES', 1), 1))
+            redis_url = config.get('TELEGRAM_RATE_LIMIT_REDIS_URL')
+            if redis_url and redis is not None:
+                rate_limiter = RedisRateLimiter(redis.Redis.from_url(redis_url), f'tgm:rate:{bot_id}', rate,
+                                                fallback=local)
+            else:
+                if redis_url:
+                    logger.warning("TELEGRAM_RATE_LIMIT_REDIS_URL impostato ma il pacchetto redis non è "
+                                   "installato: uso il rate limit per processo")
+                rate_limiter = local
+            _rate_limiters[bot_id] = rate_limiter
+        return rate_limiter
+
+
+class _Shard:
+    """Stato di invio di un bot: thread, rate limiter, coda locale e invii in corso"""
+
+    __slots__ = ('bot_id', 'token', 'rate_limiter', 'executor', 'backlog', 'running')
+
+    def __init__(self, bot_id, token, rate_limiter, executor):
+        self.bot_id = bot_id
+        self.token = token
+        self.rate_limiter = rate_limiter
+        self.executor = executor
+        self.backlog = deque()  # (Recipient, testo, retry già fatti)
+        self.running = 0
+
+
+def dispatch(jobs, workers=None, rate_limiter=None, retry_policy=None, sender=None):
+    """
+    Invia i messaggi in parallelo rispettando il rate limit di ogni bot.
+
+    Args:
+        jobs: iterabile di (Recipient, testo); viene consumato man mano,
+              quindi può essere un generatore
+        workers: thread di invio per bot (default DISPATCH_WORKERS)
+        rate_limiter: forza un unico RateLimiter per tutti i bot
+                      (default quello condiviso di ciascun bot)
+        retry_policy: default RetryPolicy dalla configurazione
+        sender: funzione di invio con gli argomenti di send_telegram_message
+                (chat_id, testo, token=...), es. un MediaSender per foto e
+                documenti; default send_telegram_message
+
+    Yields:
+        (Recipient, testo, risultato di send_telegram_message) nell'ordine
+        di completamento; per gli invii ritentati, il risultato dell'ultimo
+        tentativo. I risultati dei destinatari inviati riportano anche
+        'bot_id', il bot che ha inviato
+
+    Ogni destinatario parte dal bot a cui è assegnato (Recipient.bot_id);
+    quelli senza bot dal bot principale. Quelli con un bot non più nel pool
+    non vengono inviati: il loro risultato è bot_not_in_pool(), e non
+    contano come irraggiungibili.
+
+    I retry sono pianificati in una coda a scadenza: nessun thread di invio
+    dorme in attesa del backoff, quindi una chat lenta non blocca il lotto.
+
+    Esaurito l'invio, gli utenti irraggiungibili vengono disattivati nella
+    sessione corrente: il commit del chiamante salva anche questo.
+    """
+    workers = workers or current_app.config.get('DISPATCH_WORKERS', 8)
+    retry_policy = retry_policy or RetryPolicy.from_config(current_app.config)
+    retry_budget = RetryBudget(ratio=current_app.config.get('TELEGRAM_RETRY_BUDGET', 0.1))
+    # I token si leggono qui: i thread di invio non hanno un app context
+    tokens = get_bot_tokens() or {None: None}
+    default_bot_id = next(iter(tokens))
+    sender = sender or send_telegram_message
+
+    def send(shard, recipient, text):
+        shard.rate_limiter.acquire()
+        try:
+            return sender(recipient.chat_id, text, token=shard.token)
+        except Exception as e:
+            logger.error(f"Errore imprevisto nell'invio a {recipient.chat_id}: {str(e)}", exc_info=True)
+            return {
+                'success': False,
+                'message_id': None,
+                'error': f"Eccezione Python: {str(e)}",
+                'error_code': None
+            }
+
+    jobs = iter(jobs)
+    jobs_exhausted = False
+    in_flight = {}
+    unreachable = set()
+    # Destinatari con un bot non più nel pool: (Recipient, testo, risultato)
+    skipped = []
+    missing_bots = set()
+    # Retry pianificati: (scadenza, progressivo, bot, Recipient, testo, retry già fatti)
+    scheduled = []
+    sequence = itertools.count()
+    # Pochi invii in coda oltre ai thread attivi di ogni bot: il roster non
+    # viene mai materializzato in futures tutto insieme
+    max_in_flight = workers * 2
+    max_backlog = max_in_flight * len(tokens) * 4
+
+    with ExitStack() as stack:
+        shards = {
+            bot_id: _Shard(
+                bot_id,
+                token,
+                rate_limiter or get_rate_limiter(bot_id),
+                stack.enter_context(ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'dispatch-{bot_id}'))
+            )
+            for bot_id, token in tokens.items()
+        }
+
+        def shard_for(recipient):
+            """Bot che invia al destinatario, None se il suo bot non è più nel pool"""
+            if recipient.bot_id is None:
+                return shards[default_bot_id]
+            shard = shards.get(recipient.bot_id)
+            if shard is None and recipient.bot_id not in missing_bots:
+                missing_bots.add(recipient.bot_id)
+                logger.warning(f"Bot {recipient.bot_id} non più nel pool: i suoi utenti non ricevono l'invio")
+            return shard
+
+        def pull(shard):
+            """Legge nuovi invii finché questo bot ne ha uno in coda (o il limite delle code locali)"""
+            nonlocal jobs_exhausted
+            while not shard.backlog and not jobs_exhausted and len(skipped) < max_backlog \
+                    and sum(len(s.backlog) for s in shards.values()) < max_backlog:
+                try:
+                    recipient, text = next(jobs)
+                except StopIteration:
+                    jobs_exhausted = True
+                    break
+                target = shard_for(recipient)
+                if target is None:
+                    skipped.append((recipient, text, bot_not_in_pool(recipient.bot_id)))
+                    continue
+                retry_budget.record_request()
+                target.backlog.append((recipient, text, 0))
+            return bool(shard.backlog)
+
+        while True:
+            # Prima i retry scaduti, poi nuovi invii fino a riempire ogni bot
+            now = time.monotonic()
+            while scheduled and scheduled[0][0] <= now:
+                _, _, bot_id, recipient, text, attempt = heapq.heappop(scheduled)
+                shards[bot_id].backlog.appendleft((recipient, text, attempt))
+
+            for shard in shards.values():
+                while shard.running < max_in_flight and pull(shard):
+                    recipient, text, attempt = shard.backlog.popleft()
+                    in_flight[shard.executor.submit(send, shard, recipient, text)] = (shard, recipient, text, attempt)
+                    shard.running += 1
+
+            while skipped:
+                yield skipped.pop(0)
+
+            if not in_flight and not scheduled:
+                if not jobs_exhausted:
+                    # Letti solo destinatari saltati: si continua con i successivi
+                    continue
+                deactivate_users(unreachable)
+                return
+
+            timeout = max(0.0, scheduled[0][0] - time.monotonic()) if scheduled else None
+            if not in_flight:
+                # Restano solo retry in attesa: aspetta il primo in scadenza
+                time.sleep(timeout)
+                continue
+
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                shard, recipient, text, attempt = in_flight.pop(future)
+                shard.running -= 1
+                result = future.result()
+
+                delay = retry_policy.next_delay(result, attempt)
+                if delay is not None and retry_budget.try_spend():
+                    if result.get('retry_after'):
+                        # 429 o circuito aperto: inutile inviare altro da questo bot prima della scadenza
+                        shard.rate_limiter.pause(delay)
+                    logger.info(f"Retry {attempt + 1} per {recipient.chat_id} tra {delay:.2f}s: {result.get('error')}")
+                    heapq.heappush(scheduled, (time.monotonic() + delay, next(sequence), shard.bot_id,
+                                               recipient, text, attempt + 1))
+                    continue
+
+                if is_unreachable(result):
+                    unreachable.add(recipient.user_id)
+                if isinstance(result, dict):
+                    # Correzioni e ritiri del messaggio devono passare dallo stesso bot
+                    result['bot_id'] = shard.bot_id
+                yield recipient, text, result
@@ -0,0 +1,91 @@
+"""
+Lingue dell'interfaccia: risoluzione della lingua e cataloghi precaricati
+
+Flask-Babel tiene i cataloghi in cache per processo, ma li carica alla prima
+richiesta in ogni lingua; allo stesso modo Jinja compila un template alla
+prima richiesta che lo usa. preload_translations() fa entrambe le cose
+all'avvio: con preload_app di gunicorn succede una volta nel master e i
+worker condividono cataloghi e template compilati (copy-on-write), quindi
+la prima pagina in inglese costa quanto quella in italiano.
+
+I template compilati non dipendono dalla lingua (le stringhe si traducono
+durante il render), quindi basta una compilazione per template.
+
+stale_catalogs() confronta .po e .mo: un .mo più vecchio del suo .po è una
+traduzione modificata ma non ricompilata (vedi setup_translations.py --check).
+"""
+
+import logging
+import os
+from functools import lru_cache
+
+from babel import Locale
+
+logger = logging.getLogger(__name__)
+
+# Un checkout git scrive .po e .mo a pochi millisecondi di distanza, in ordine
+# qualsiasi: sotto questa differenza (secondi) il .mo si considera aggiornato
+MTIME_TOLERANCE = 2.0
+
+TRANSLATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'translations')
+
+
+@lru_cache(maxsize=32)
+def parse_locale(code):
+    """Locale di Babel per un codice lingua, creato una volta sola"""
+    return Locale.parse(code)
+
+
+def resolve_language(value, languages, default):
+    """Codice lingua valido: value se è tra quelle configurate, altrimenti default"""
+    return value if value in languages else default
+
+
+def stale_catalogs(translations_dir=TRANSLATIONS_DIR):
+    """
+    Cataloghi da ricompilare.
+
+    Returns:
+        lista di (lingua, motivo) per i .po senza .mo o con un .mo più vecchio
+    """
+    stale = []
+    if not os.path.isdir(translations_dir):
+        return stale
+
+    for lang in sorted(os.listdir(translations_dir)):
+        lc_messages = os.path.join(translations_dir, lang, 'LC_MESSAGES')
+        po_file = os.path.join(lc_messages, 'messages.po')
+        mo_file = os.path.join(lc_messages, 'messages.mo')
+        if not os.path.exists(po_file):
+            continue
+        if not os.path.exists(mo_file):
+            stale.append((lang, 'messages.mo mancante'))
+        elif os.path.getmtime(mo_file) + MTIME_TOLERANCE < os.path.getmtime(po_file):
+            stale.append((lang, 'messages.mo più vecchio di messages.po'))
+    return stale
+
+
+def preload_translations(app):
+    """
+    Carica i cataloghi di tutte le lingue configurate e, se l'auto-reload dei
+    template è spento, compila tutti i template.
+
+    Returns: numero di cataloghi caricati
+    """
+    from flask_babel import force_locale, get_translations
+
+    for lang, reason in stale_catalogs():
+        logger.warning(f"Traduzioni '{lang}' non aggiornate ({reason}): python setup_translations.py --compile")
+
+    loaded = 0
+    with app.test_request_context():
+        for lang in app.config.get('LANGUAGES', {}):
+            with force_locale(lang):
+                get_translations()
+            loaded += 1
+
+    if not app.jinja_env.auto_reload:
+        for name in app.jinja_env.list_templates(extensions=('html',)):
+            app.jinja_env.get_template(name)
+
+    return loaded
@@ -0,0 +1,190 @@
+"""
+Invii di foto e documenti con file_id riusati
+
+Un file caricato viene salvato su disco a blocchi, calcolando lo sha256
+durante la copia (nessuna lettura in memoria del file intero), con lo
+sha256 come nome: lo stesso contenuto occupa un solo file.
+
+Telegram restituisce un file_id per ogni file caricato, valido per il bot
+che ha fatto l'upload. MediaSender carica i file con il primo invio di
+ogni bot e usa il file_id per tutti gli altri destinatari: un invio media
+costa un upload per bot più N richieste leggere. I file_id vengono salvati
+in MediaFile, quindi un nuovo invio (o un retry) degli stessi file non
+ricarica nulla.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from werkzeug.utils import secure_filename
+
+from app.models import MediaFile
+from app.utils.telegram_helper import (MEDIA_CHUNK_SIZE, MEDIA_GROUP_MAX_ITEMS, bot_id_from_token,
+                                       get_bot_tokens, send_telegram_media)
+
+# Le foto vengono ricompresse da Telegram e accettate fino a 10MB; gli
+# altri file (o le foto più grandi) partono come documenti
+PHOTO_CONTENT_TYPES = ('image/jpeg', 'image/png', 'image/webp')
+PHOTO_MAX_SIZE = 10 * 1024 * 1024
+
+
+class MediaItem:
+    """File da inviare: contenuto (sha256, percorso su disco) e come inviarlo"""
+
+    __slots__ = ('sha256', 'path', 'file_name', 'content_type', 'size', 'kind')
+
+    def __init__(self, sha256, path, file_name, content_type, size, kind):
+        self.sha256 = sha256
+        self.path = path
+        self.file_name = file_name
+        self.content_type = content_type
+        self.size = size
+        self.kind = kind
+
+    def __repr__(self):
+        return f'<MediaItem {self.file_name} {self.kind} {self.sha256[:12]}>'
+
+    def to_dict(self):
+        return {
+            'sha256': self.sha256,
+            'file_name': self.file_name,
+            'content_type': self.content_type,
+            'size': self.size,
+            'kind': self.kind
+        }
+
+
+def store_upload(file_storage, folder):
+    """
+    Salva un file caricato (FileStorage di werkzeug) in folder/<sha256>.
+
+    Returns: MediaItem, o None se il file è vuoto
+    """
+    os.makedirs(folder, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file_storage.stream.read(MEDIA_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        if not size:
+            os.remove(tmp_path)
+            return None
+        sha256 = digest.hexdigest()
+        path = os.path.join(folder, sha256)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    content_type = file_storage.mimetype or 'application/octet-stream'
+    is_photo = content_type in PHOTO_CONTENT_TYPES and size <= PHOTO_MAX_SIZE
+    return MediaItem(
+        sha256,
+        path,
+        secure_filename(file_storage.filename or '') or sha256[:16],
+        content_type,
+        size,
+        'photo' if is_photo else 'document'
+    )
+
+
+def prepare_album(items):
+    """
+    Adatta i file ai limiti di Telegram: al massimo MEDIA_GROUP_MAX_ITEMS, e
+    un album non può mescolare foto e documenti (in quel caso tutti documenti)
+    """
+    if len(items) > MEDIA_GROUP_MAX_ITEMS:
+        raise ValueError(f"Al massimo {MEDIA_GROUP_MAX_ITEMS} file per invio")
+    if len({item.kind for item in items}) > 1:
+        for item in items:
+            item.kind = 'document'
+    return items
+
+
+def items_to_json(items):
+    """Descrizione dei file salvata in Dispatch.media"""
+    return json.dumps([item.to_dict() for item in items])
+
+
+def items_from_json(raw, folder):
+    """MediaItem di un Dispatch.media, con i percorsi nella cartella degli upload"""
+    return [
+        MediaItem(data['sha256'], os.path.join(folder, data['sha256']), data['file_name'],
+                  data['content_type'], data['size'], data['kind'])
+        for data in json.loads(raw)
+    ]
+
+
+class MediaSender:
+    """
+    Funzione di invio per dispatch() (stessi argomenti di
+    send_telegram_message): la didascalia prende il posto del testo.
+
+    Per ogni bot il primo invio carica i file mentre gli altri thread dello
+    stesso bot aspettano; da lì in poi tutti usano i file_id restituiti.
+    """
+
+    def __init__(self, items, known_file_ids=None):
+        """known_file_ids: {(sha256, bot_id, kind): file_id} già salvati (MediaFile.lookup)"""
+        self.items = items
+        self._file_ids = dict(known_file_ids or {})
+        self._new_file_ids = {}
+        self._lock = threading.Lock()
+        self._upload_locks = {}
+
+    @classmethod
+    def for_items(cls, items):
+        """MediaSender con i file_id già salvati per i bot del pool (una query)"""
+        bot_ids = [bot_id for bot_id in get_bot_tokens() if bot_id is not None]
+        return cls(items, MediaFile.lookup({item.sha256 for item in items}, bot_ids))
+
+    def _known(self, bot_id):
+        """{sha256: file_id} dei file già caricati con questo bot"""
+        with self._lock:
+            return {
+                item.sha256: self._file_ids[(item.sha256, bot_id, item.kind)]
+                for item in self.items
+                if (item.sha256, bot_id, item.kind) in self._file_ids
+            }
+
+    def _upload_lock(self, bot_id):
+        with self._lock:
+            return self._upload_locks.setdefault(bot_id, threading.Lock())
+
+    def __call__(self, chat_id, caption, token=None):
+        bot_id = bot_id_from_token(token) if token else None
+        file_ids = self._known(bot_id)
+        if len(file_ids) == len(self.items):
+            return send_telegram_media(chat_id, self.items, caption or None, token=token, file_ids=file_ids)
+
+        with self._upload_lock(bot_id):
+            # Un altro thread potrebbe aver caricato i file mentre si aspettava
+            file_ids = self._known(bot_id)
+            result = send_telegram_media(chat_id, self.items, caption or None, token=token, file_ids=file_ids)
+            kinds = {item.sha256: item.kind for item in self.items}
+            with self._lock:
+                for sha256, file_id in result.get('file_ids', {}).items():
+                    key = (sha256, bot_id, kinds[sha256])
+                    if key not in self._file_ids:
+                        self._file_ids[key] = file_id
+                        if bot_id is not None:
+                            self._new_file_ids[key] = file_id
+            return result
+
+    def save(self):
+        """Salva i file_id ottenuti durante l'invio (senza commit)"""
+        with self._lock:
+            new_file_ids = dict(self._new_file_ids)
+            self._new_file_ids.clear()
+        MediaFile.remember(new_file_ids)
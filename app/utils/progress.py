@@ -0,0 +1,99 @@
+"""
+Avanzamento degli invii in corso
+
+Il thread che invia aggiorna un DispatchProgress per ogni risultato
+(contatori in memoria, nessuna query); l'endpoint SSE attende i cambiamenti
+sulla Condition e spedisce al browser lo stato corrente.
+
+Il registro è per processo e tiene solo gli ultimi invii: se l'invio gira
+in un altro worker (o è finito da tempo) l'endpoint ricava i conteggi dai
+MessageLog, che il thread di invio salva a blocchi.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class DispatchProgress:
+    """Contatori thread-safe di un invio: inviati, falliti, velocità"""
+
+    def __init__(self, dispatch_id, total):
+        self.dispatch_id = dispatch_id
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.finished = False
+        self.error = None
+        self.version = 0
+        self._started = time.monotonic()
+        self._finished_at = None
+        self._changed = threading.Condition()
+
+    def record(self, sent):
+        """Registra il risultato di un invio"""
+        with self._changed:
+            if sent:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self.version += 1
+            self._changed.notify_all()
+
+    def finish(self, error=None):
+        with self._changed:
+            self.finished = True
+            self.error = error
+            self._finished_at = time.monotonic()
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait_for_change(self, version, timeout):
+        """
+        Attende un aggiornamento successivo a version (o la fine dell'invio)
+        per al massimo timeout secondi. Returns: la versione corrente
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version or self.finished, timeout)
+            return self.version
+
+    def snapshot(self):
+        with self._changed:
+            elapsed = (self._finished_at or time.monotonic()) - self._started
+            done = self.sent + self.failed
+            return {
+                'dispatch_id': self.dispatch_id,
+                'total': self.total,
+                'sent': self.sent,
+                'failed': self.failed,
+                'done': done,
+                'rate': round(done / elapsed, 1) if elapsed > 0 else 0.0,
+                'elapsed': round(elapsed, 1),
+                'finished': self.finished,
+                'error': self.error
+            }
+
+
+class ProgressRegistry:
+    """Ultimi max_entries invii del processo, per id del Dispatch"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, dispatch_id, total):
+        progress = DispatchProgress(dispatch_id, total)
+        with self._lock:
+            self._entries[dispatch_id] = progress
+            self._entries.move_to_end(dispatch_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return progress
+
+    def get(self, dispatch_id):
+        with self._lock:
+            return self._entries.get(dispatch_id)
+
+
+dispatch_progress = ProgressRegistry()
@@ -0,0 +1,132 @@
+"""
+Report delle route di debug, tenuti lato server
+
+Le route di debug (debug_bot, raw_test, check_logs...) scrivono le righe
+del risultato in un DebugReport invece di accumulare flash(): i flash
+finiscono nel cookie di sessione firmato, che con decine di righe (e i
+traceback) cresce ad ogni richiesta fino a superare il limite dei cookie.
+
+Un report si compone in memoria e si salva a fine route nella tabella
+debug_reports, così qualsiasi worker può mostrarlo; si tengono gli ultimi
+max_reports per gruppo, ciascuno con al massimo MAX_LINES righe di
+MAX_LINE_LENGTH caratteri. L'esito dei singoli invii non passa di qui: sta
+nei MessageLog dell'invio.
+"""
+
+import json
+from collections import Counter
+from datetime import datetime
+
+from app import db
+from app.models import DebugReportRecord
+
+MAX_LINES = 200
+MAX_LINE_LENGTH = 4000
+
+
+class DebugReport:
+    """Righe (livello, testo) di una route di debug; livelli come in flash()"""
+
+    __slots__ = ('id', 'title', 'group_id', 'created_at', 'lines', 'dropped')
+
+    def __init__(self, report_id, title, group_id=None):
+        self.id = report_id  # None finché non viene salvato
+        self.title = title
+        self.group_id = group_id
+        self.created_at = datetime.utcnow()
+        self.lines = []
+        self.dropped = 0
+
+    @classmethod
+    def from_record(cls, record):
+        report = cls(record.id, record.title, record.group_id)
+        report.created_at = record.created_at
+        report.lines = [tuple(line) for line in json.loads(record.lines)]
+        report.dropped = record.dropped
+        return report
+
+    def add(self, level, text):
+        if len(self.lines) >= MAX_LINES:
+            self.dropped += 1
+            return
+        text = str(text)
+        if len(text) > MAX_LINE_LENGTH:
+            text = text[:MAX_LINE_LENGTH] + '…'
+        self.lines.append((level, text))
+
+    def counts(self):
+        """Numero di righe per livello"""
+        return Counter(level for level, _ in self.lines)
+
+    def summary(self):
+        """Riepilogo in una riga, per l'unico flash della route"""
+        counts = self.counts()
+        parts = [f"{len(self.lines)} righe"]
+        if counts['error']:
+            parts.append(f"{counts['error']} errori")
+        if counts['warning']:
+            parts.append(f"{counts['warning']} avvisi")
+        return f"{self.title}: {', '.join(parts)}"
+
+    @property
+    def level(self):
+        """Livello del flash di riepilogo"""
+        counts = self.counts()
+        if counts['error']:
+            return 'error'
+        if counts['warning']:
+            return 'warning'
+        return 'success' if counts['success'] else 'info'
+
+
+class ReportStore:
+    """Report salvati nella tabella debug_reports, condivisi da tutti i worker"""
+
+    def __init__(self, max_reports=50):
+        self.max_reports = max_reports
+
+    def new(self, title, group_id=None):
+        """Report vuoto da riempire con add(); save() lo rende visibile"""
+        return DebugReport(None, title, group_id)
+
+    def save(self, report):
+        """Salva il report con commit (assegna report.id) ed elimina i più vecchi del gruppo oltre max_reports"""
+        record = DebugReportRecord(
+            group_id=report.group_id,
+            title=report.title[:255],
+            lines=json.dumps(report.lines),
+            dropped=report.dropped,
+            created_at=report.created_at
+        )
+        db.session.add(record)
+        db.session.flush()
+        report.id = record.id
+
+        oldest_kept = db.session.query(DebugReportRecord.id) \
+            .filter(DebugReportRecord.group_id == report.group_id) \
+            .order_by(DebugReportRecord.id.desc()) \
+            .offset(self.max_reports - 1) \
+            .limit(1) \
+            .scalar()
+        if oldest_kept is not None:
+            DebugReportRecord.query.filter(
+                DebugReportRecord.group_id == report.group_id,
+                DebugReportRecord.id < oldest_kept
+            ).delete(synchronize_session=False)
+        db.session.commit()
+        return report
+
+    def get(self, report_id):
+        record = db.session.get(DebugReportRecord, report_id)
+        return DebugReport.from_record(record) if record else None
+
+    def recent(self, group_id=None):
+        """Report più recenti per primi, eventualmente di un solo gruppo"""
+        query = DebugReportRecord.query
+        if group_id is not None:
+            query = query.filter(DebugReportRecord.group_id == group_id)
+        records = query.order_by(DebugReportRecord.id.desc()).limit(self.max_reports)
+        return [DebugReport.from_record(record) for record in records]
+
+
+debug_reports = ReportStore()
@@ -0,0 +1,119 @@
+"""
+Politica di retry per gli invii Telegram
+
+Per ogni risultato di send_telegram_message la tabella decisionale stabilisce
+se ritentare e come:
+
+    error_code          azione
+    ----------          ------
+    429                 aspetta retry_after (parameters.retry_after della Bot API)
+    500 e oltre         backoff esponenziale con jitter
+    None (timeout/rete) backoff esponenziale con jitter
+    altri (400, 403...) nessun retry: si ripeterebbe uguale
+
+Un invio bloccato dal circuit breaker (circuit_open) aspetta la riapertura
+del circuito, indicata anch'essa in retry_after.
+
+Il RetryBudget limita il carico aggiuntivo: i retry non possono superare una
+quota degli invii originali, così un'interruzione di Telegram non raddoppia
+o triplica il traffico proprio mentre il servizio è in difficoltà.
+"""
+
+import random
+import threading
+
+# Azioni della tabella decisionale
+RETRY_AFTER = 'retry_after'
+BACKOFF = 'backoff'
+GIVE_UP = 'give_up'
+
+FLOOD_ERROR_CODE = 429
+SERVER_ERROR_CODE = 500
+
+
+def classify(error_code):
+    """Azione della tabella decisionale per un error_code"""
+    if error_code is None:
+        return BACKOFF
+    if error_code == FLOOD_ERROR_CODE:
+        return RETRY_AFTER
+    if error_code >= SERVER_ERROR_CODE:
+        return BACKOFF
+    return GIVE_UP
+
+
+class RetryPolicy:
+    """
+    Backoff esponenziale con full jitter: il ritardo del tentativo n è
+    casuale tra 0 e min(max_delay, base_delay * 2**n), così i destinatari
+    falliti insieme non ritentano tutti nello stesso istante.
+    """
+
+    def __init__(self, max_retries=3, base_delay=0.5, max_delay=30.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            max_retries=config.get('TELEGRAM_MAX_RETRIES', 3),
+            base_delay=config.get('TELEGRAM_RETRY_BASE_DELAY', 0.5),
+            max_delay=config.get('TELEGRAM_RETRY_MAX_DELAY', 30.0)
+        )
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def next_delay(self, result, attempt):
+        """
+        Secondi da attendere prima del prossimo tentativo, o None se non va ritentato.
+
+        attempt: numero di retry già fatti per questo invio (0 dopo il primo invio)
+        """
+        if result.get('success') or attempt >= self.max_retries:
+            return None
+
+        if result.get('circuit_open'):
+            return float(result.get('retry_after') or self.backoff(attempt))
+
+        action = classify(result.get('error_code'))
+        if action == RETRY_AFTER:
+            retry_after = result.get('retry_after')
+            # Telegram chiede di aspettare almeno retry_after: niente jitter verso il basso
+            return float(retry_after) if retry_after else self.backoff(attempt)
+        if action == BACKOFF:
+            return self.backoff(attempt)
+        return None
+
+
+class RetryBudget:
+    """
+    Quota di retry consentiti rispetto agli invii originali, thread-safe.
+
+    ratio: retry per invio (0.1 = al massimo un retry ogni 10 invii)
+    min_retries: retry sempre consentiti, per i lotti piccoli
+    """
+
+    def __init__(self, ratio=0.1, min_retries=10):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self._requests = 0
+        self._retries = 0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self._requests += 1
+
+    def try_spend(self):
+        """True (e consuma un retry) se il budget lo consente"""
+        with self._lock:
+            if self._retries < self.min_retries + self.ratio * self._requests:
+                self._retries += 1
+                return True
+            return False
+
+    @property
+    def retries(self):
+        return self._retries
@@ -0,0 +1,91 @@
+"""
+Correzione e ritiro in blocco dei messaggi di un invio già fatto
+
+I MessageLog consegnati conservano il telegram_message_id (per gli album
+tutti gli id, separati da virgola): una correzione (editMessageText, o
+editMessageCaption per gli invii media) o un ritiro (deleteMessage, o
+deleteMessages per gli album) è un nuovo Dispatch che passa dallo stesso dispatch() degli
+invii, quindi con rate limit per bot, thread paralleli, retry e avanzamento
+in tempo reale. Ogni messaggio si modifica con il bot che lo ha inviato
+(MessageLog.bot_id), anche se nel frattempo l'utente è passato a un altro
+bot del pool: gli altri bot non possono toccarlo. I messaggi si leggono con una query sull'indice
+(group_id, dispatch_id, telegram_message_id).
+"""
+
+from app import db
+from app.models import MessageBody, MessageLog
+from app.utils.telegram_helper import delete_telegram_message, edit_telegram_message
+
+EDIT = 'edit'
+DELETE = 'delete'
+REVISION_KINDS = (EDIT, DELETE)
+
+# Correggere con lo stesso testo non è un errore: il messaggio è già giusto
+NOT_MODIFIED = 'message is not modified'
+
+
+def load_sent_messages(group_id, dispatch_id):
+    """
+    Messaggi consegnati di un invio.
+
+    Returns: {user_id: (telegram_message_id, testo inviato, bot che lo ha inviato)}
+    """
+    rows = db.session.query(MessageLog.user_id, MessageLog.telegram_message_id, MessageBody.content,
+                            MessageLog.bot_id) \
+        .join(MessageBody, MessageBody.id == MessageLog.body_id) \
+        .filter(
+            MessageLog.group_id == group_id,
+            MessageLog.dispatch_id == dispatch_id,
+            MessageLog.telegram_message_id.isnot(None),
+            MessageLog.status == 'sent'
+        )
+    return {user_id: (message_id, content, bot_id) for user_id, message_id, content, bot_id in rows}
+
+
+def route_to_senders(roster, bot_ids):
+    """
+    Assegna a ogni Recipient il bot che gli ha inviato il messaggio
+    (bot_ids: {user_id: bot_id}). I log senza bot_id, salvati prima che il
+    bot venisse registrato, restano sul bot attuale dell'utente.
+    """
+    for recipient in roster:
+        bot_id = bot_ids.get(recipient.user_id)
+        if bot_id is not None:
+            recipient.bot_id = bot_id
+    return roster
+
+
+class RevisionSender:
+    """
+    Funzione di invio per dispatch() che corregge o cancella i messaggi già
+    inviati: riceve (chat_id, testo, token=...) come send_telegram_message e
+    trova il messaggio da modificare con il chat_id.
+    """
+
+    def __init__(self, action, message_ids, caption=False):
+        """
+        action: EDIT o DELETE
+        message_ids: {chat_id: telegram_message_id}
+        caption: i messaggi sono foto o documenti (si corregge la didascalia)
+        """
+        self.action = action
+        self.message_ids = message_ids
+        self.caption = caption
+
+    def __call__(self, chat_id, text, token=None):
+        message_id = self.message_ids.get(chat_id)
+        if message_id is None:
+            return {'success': False, 'message_id': None, 'error_code': 400,
+                    'error': f"Nessun messaggio da modificare per la chat {chat_id}"}
+
+        if self.action == DELETE:
+            result = delete_telegram_message(chat_id, message_id, token=token)
+        else:
+            result = edit_telegram_message(chat_id, message_id, text, token=token, caption=self.caption)
+            if not result.get('success') and NOT_MODIFIED in (result.get('error') or '').lower():
+                result = {'success': True, 'error': None, 'error_code': None}
+
+        if result.get('success'):
+            # Il log della correzione punta al messaggio modificato (deleteMessage non lo restituisce)
+            result['message_id'] = str(message_id)
+        return result
@@ -0,0 +1,120 @@
+"""
+Serializzazione JSON veloce per gli endpoint API
+
+Invece di caricare oggetti ORM e chiamare to_dict() campo per campo, le
+query selezionano solo le colonne necessarie come tuple e le convertono in
+dict con zip(). I campi derivati da più colonne (il nome da mostrare) sono
+calcolati in Python dalle colonne selezionate, senza caricare oggetti.
+
+La codifica usa orjson se installato (gestisce datetime nativamente),
+altrimenti il modulo json della libreria standard.
+"""
+
+import json
+from datetime import date, datetime
+from operator import itemgetter
+
+from flask import current_app
+from sqlalchemy import String, cast
+
+from app.models import User
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dipendenza opzionale
+    orjson = None
+
+
+class Computed:
+    """Campo calcolato in Python da più colonne (es. full_name con User.compose_full_name)"""
+
+    __slots__ = ('columns', 'compute')
+
+    def __init__(self, columns, compute):
+        self.columns = tuple(columns)
+        self.compute = compute
+
+
+def _user_name_columns():
+    return (User.display_name, User.first_name, User.last_name, User.username, User.telegram_id)
+
+
+# Proiezioni: nome del campo JSON -> espressione SQL (o Computed). Quella
+# degli utenti ha gli stessi campi, nello stesso ordine, di User.to_dict()
+
+def user_projection():
+    return {
+        'id': User.id,
+        'telegram_id': cast(User.telegram_id, String),
+        'username': User.username,
+        'first_name': User.first_name,
+        'last_name': User.last_name,
+        'display_name': User.display_name,
+        'bot_id': User.bot_id,
+        'is_active': User.is_active,
+        'created_at': User.created_at,
+        'updated_at': User.updated_at,
+        'last_interaction': User.last_interaction,
+    }
+
+
+def user_summary_projection():
+    """Utente nelle liste e nell'autocompletamento: nome da mostrare invece delle sue parti"""
+    return {
+        'id': User.id,
+        'full_name': Computed(_user_name_columns(), User.compose_full_name),
+        'username': User.username,
+        'telegram_id': cast(User.telegram_id, String),
+        'is_active': User.is_active,
+    }
+
+
+def member_projection():
+    """Membri di un gruppo nella lista caricata a pagine"""
+    return dict(user_summary_projection(), last_interaction=User.last_interaction)
+
+
+def project(query, projection):
+    """
+    Esegue la query selezionando solo le colonne della proiezione.
+
+    query: query ORM già filtrata/ordinata (es. User.query.filter_by(...))
+    Returns: lista di dict pronti per json_response()
+    """
+    fields = tuple(projection)
+    if not any(isinstance(expression, Computed) for expression in projection.values()):
+        rows = query.with_entities(*projection.values())
+        return [dict(zip(fields, row)) for row in rows]
+
+    columns = []
+    readers = []
+    for expression in projection.values():
+        if isinstance(expression, Computed):
+            start = len(columns)
+            columns.extend(expression.columns)
+            readers.append(lambda row, start=start, end=len(columns), compute=expression.compute:
+                           compute(*row[start:end]))
+        else:
+            readers.append(itemgetter(len(columns)))
+            columns.append(expression)
+
+    rows = query.with_entities(*columns)
+    return [dict(zip(fields, [read(row) for read in readers])) for row in rows]
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Tipo non serializzabile: {type(value).__name__}")
+
+
+def dumps(data):
+    """Codifica in JSON (bytes), con orjson quando disponibile"""
+    if orjson is not None:
+        return orjson.dumps(data, default=_default)
+    return json.dumps(data, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(data, status=200):
+    """Come jsonify(), ma con l'encoder veloce"""
+    return current_app.response_class(dumps(data), status=status, mimetype='application/json')
@@ -0,0 +1,65 @@
+"""
+Pagine HTML in streaming
+
+stream_page() rende il template a pezzi (Template.generate di Jinja): il browser
+riceve l'<head> (CSS e JS da scaricare) e l'inizio della pagina mentre il
+resto viene ancora generato, e il worker non tiene in memoria la pagina
+intera. Con una lista di membri passata come generatore anche le righe
+lette dal database arrivano a blocchi.
+
+Jinja produce un pezzo per ogni testo o espressione del template: i pezzi
+vengono raggruppati in blocchi di STREAM_BUFFER_SIZE caratteri, per non
+fare una write sul socket per ognuno.
+"""
+
+import contextvars
+
+from flask import current_app, get_flashed_messages
+from flask.globals import request_ctx
+
+STREAM_BUFFER_SIZE = 16 * 1024
+
+
+def _buffered(chunks, size=STREAM_BUFFER_SIZE):
+    """Blocchi di almeno size caratteri dai pezzi di chunks"""
+    buffer = []
+    length = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer.clear()
+            length = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_page(template_name, **context):
+    """Come render_template, ma la risposta parte mentre il template viene generato"""
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_or_select_template(template_name)
+    app.update_template_context(context)
+
+    # I flash si leggono (e si tolgono dalla sessione) prima di inviare gli
+    # header: durante lo streaming la sessione non viene più salvata
+    flashes = get_flashed_messages(with_categories=True)
+
+    # stream_with_context terrebbe attivo il contesto della richiesta anche
+    # tra un blocco e l'altro, nel thread di chi legge la risposta: una copia
+    # viene attivata in un contextvars.Context separato, solo mentre si
+    # genera un blocco (url_for, traduzioni, flash)
+    ctx = request_ctx.copy()
+    ctx.flashes = flashes
+
+    def generate():
+        scope = contextvars.Context()
+        scope.run(ctx.push)
+        try:
+            chunks = _buffered(template.generate(context))
+            for chunk in iter(lambda: scope.run(next, chunks, None), None):
+                yield chunk
+        finally:
+            scope.run(ctx.pop)
+
+    return app.response_class(generate(), mimetype='text/html')
@@ -1,10 +1,35 @@
+import json
 import os
+import threading
+import time
+import uuid
 import requests
 from flask import current_app
 import logging
 
+from app.utils.circuit_breaker import CircuitBreaker
+from app.utils.retry import RetryBudget, RetryPolicy
+
 logger = logging.getLogger(__name__)
 
+# Un circuit breaker per token (configurabile da ambiente, come TELEGRAM_API_URL:
+# viene usato anche dai thread di invio, che non hanno un app context)
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(token):
+    """Circuit breaker delle chiamate di invio per il bot con questo token"""
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(token)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                failure_rate=float(os.environ.get('TELEGRAM_BREAKER_FAILURE_RATE', 0.5)),
+                min_calls=int(os.environ.get('TELEGRAM_BREAKER_MIN_CALLS', 10)),
+                open_seconds=float(os.environ.get('TELEGRAM_BREAKER_OPEN_SECONDS', 30))
+            )
+            _circuit_breakers[token] = breaker
+        return breaker
+
 def get_bot_token():
     """
     Ottiene il token del bot dalle variabili ambiente (.env) o dalla configurazione Flask
@@ -30,6 +55,61 @@ def get_bot_token():
     logger.error("TELEGRAM_BOT_TOKEN non trovato né in variabili ambiente né in config Flask")
     return None
 
+def get_bot_tokens():
+    """
+    Pool di bot usati per gli invii: {bot_id: token}, nell'ordine configurato.
+
+    TELEGRAM_BOT_TOKENS accetta più token separati da virgola; senza, il pool
+    contiene solo TELEGRAM_BOT_TOKEN. Il primo è il bot principale, usato per
+    gli utenti senza bot assegnato.
+    """
+    raw_tokens = os.environ.get('TELEGRAM_BOT_TOKENS')
+    if not raw_tokens:
+        try:
+            raw_tokens = current_app.config.get('TELEGRAM_BOT_TOKENS')
+        except RuntimeError:
+            raw_tokens = None
+
+    tokens = [token.strip() for token in (raw_tokens or '').split(',') if token.strip()]
+    if not tokens:
+        token = get_bot_token()
+        tokens = [token] if token else []
+
+    return {bot_id_from_token(token): token for token in tokens}
+
+def bot_id_from_token(token):
+    """Id del bot: la parte numerica del token prima dei due punti"""
+    prefix = token.split(':', 1)[0]
+    return int(prefix) if prefix.isdigit() else None
+
+# Una sessione HTTP (connessioni keep-alive) per bot, condivisa tra i thread di invio
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+
+def get_http_session(token):
+    """Sessione requests con pool di connessioni dedicato al bot"""
+    with _http_sessions_lock:
+        session = _http_sessions.get(token)
+        if session is None:
+            session = requests.Session()
+            pool_size = int(os.environ.get('DISPATCH_WORKERS', 8))
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_sessions[token] = session
+        return session
+
+def get_api_url(token, method):
+    """
+    Costruisce l'URL di un metodo della Bot API.
+
+    La base è configurabile con TELEGRAM_API_URL (default https://api.telegram.org),
+    così l'app può essere puntata verso un server Bot API locale o finto
+    (vedi load_test.py fake-bot) durante i test di carico.
+    """
+    base_url = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+    return f"{base_url}/bot{token}/{method}"
+
 def test_bot_connection():
     """
     Testa la connessione con il bot Telegram
@@ -52,7 +132,7 @@ def test_bot_connection():
         }
 
     try:
-        url = f"https://api.telegram.org/bot{token}/getMe"
+        url = get_api_url(token, 'getMe')
         logger.info("Test connessione bot...")
         response = requests.get(url, timeout=10)
 
@@ -95,58 +175,71 @@ def test_bot_connection():
             'error': error_msg
         }
 
-# Sostituisci la tua funzione send_telegram_message esistente con questa versione:
+def _failure(error, error_code=None, **extra):
+    """Risultato di un invio fallito, nel formato di send_telegram_message"""
+    return {'success': False, 'message_id': None, 'error': error, 'error_code': error_code, **extra}
 
-def send_telegram_message(chat_id, message_text):
+def join_message_ids(message_ids):
+    """Id dei messaggi Telegram come li salva MessageLog.telegram_message_id ("101,102,103"), o None"""
+    return ','.join(str(message_id) for message_id in message_ids if message_id) or None
+
+def split_message_ids(telegram_message_id):
+    """Lista degli id (int) salvati in MessageLog.telegram_message_id: più di uno per gli album"""
+    return [int(message_id) for message_id in str(telegram_message_id).split(',') if message_id]
+
+def _call_bot_api(token, method, chat_id, timeout=30, **request_kwargs):
     """
-    Invia un messaggio Telegram a un utente specifico
+    Chiamata di invio alla Bot API con circuit breaker e gestione degli errori
+    comune a tutti i metodi (sendMessage, sendPhoto, sendMediaGroup...).
+
+    request_kwargs: passati a session.post (json=... oppure data=/headers= per gli upload)
 
     Returns:
-        dict: {
-            'success': bool,
-            'message_id': str|None,
-            'error': str|None,
-            'error_code': int|None
-        }
+        (risultato come send_telegram_message, campo 'result' della risposta o None)
     """
-    token = get_bot_token()
-    if not token:
-        error_msg = "Token del bot Telegram non configurato"
-        logger.error(error_msg)
-        return {
-            'success': False,
-            'message_id': None,
-            'error': error_msg,
-            'error_code': None
-        }
+    # Con Telegram irraggiungibile fallisce subito invece di attendere il timeout
+    breaker = get_circuit_breaker(token)
+    if not breaker.allow_request():
+        retry_after = max(breaker.retry_after(), 1.0)
+        return _failure(
+            f"Circuito aperto: Telegram non risponde, invii sospesi per {retry_after:.0f}s",
+            retry_after=retry_after,
+            circuit_open=True
+        ), None
 
     try:
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
-
-        payload = {
-            'chat_id': chat_id,
-            'text': message_text,
-            'parse_mode': 'HTML'  # Supporta formattazione HTML di base
-        }
+        url = get_api_url(token, method)
 
-        logger.info(f"Tentativo invio messaggio a chat_id: {chat_id}")
-        response = requests.post(url, json=payload, timeout=30)
+        logger.info(f"Tentativo {method} a chat_id: {chat_id}")
+        response = get_http_session(token).post(url, timeout=timeout, **request_kwargs)
 
         # Log della risposta per debug
         logger.info(f"Status code: {response.status_code}")
         logger.info(f"Response body: {response.text}")
 
+        # Per il breaker conta solo se Telegram risponde: 4xx e 429 sono risposte valide
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
         if response.status_code == 200:
             data = response.json()
             if data.get('ok'):
-                message_id = data.get('result', {}).get('message_id')
-                logger.info(f"✅ Messaggio inviato con successo a {chat_id}, message_id: {message_id}")
+                api_result = data.get('result')
+                # sendMediaGroup restituisce la lista dei messaggi dell'album:
+                # si conservano tutti gli id, separati da virgola
+                messages = api_result if isinstance(api_result, list) else [api_result]
+                message_id = join_message_ids(
+                    message.get('message_id') for message in messages if isinstance(message, dict)
+                )
+                logger.info(f"✅ {method} riuscito per {chat_id}, message_id: {message_id}")
                 return {
                     'success': True,
-                    'message_id': str(message_id) if message_id else None,
+                    'message_id': message_id,
                     'error': None,
                     'error_code': None
-                }
+                }, api_result
             else:
                 # Errore API Telegram
                 error_code = data.get('error_code')
@@ -154,18 +247,18 @@ def send_telegram_message(chat_id, message_text):
                 full_error = f"API Error {error_code}: {error_description}"
 
                 logger.error(f"❌ Errore API Telegram per {chat_id}: {full_error}")
-                return {
-                    'success': False,
-                    'message_id': None,
-                    'error': full_error,
-                    'error_code': error_code
-                }
+                return _failure(
+                    full_error, error_code,
+                    retry_after=(data.get('parameters') or {}).get('retry_after')
+                ), None
         else:
             # Errore HTTP
+            retry_after = None
             try:
                 error_data = response.json()
                 error_description = error_data.get('description', response.text)
                 error_code = error_data.get('error_code')
+                retry_after = (error_data.get('parameters') or {}).get('retry_after')
             except:
                 error_description = response.text
                 error_code = response.status_code
@@ -173,44 +266,243 @@ def send_telegram_message(chat_id, message_text):
             full_error = f"HTTP {response.status_code}: {error_description}"
             logger.error(f"❌ Errore HTTP per {chat_id}: {full_error}")
 
-            return {
-                'success': False,
-                'message_id': None,
-                'error': full_error,
-                'error_code': error_code
-            }
+            return _failure(full_error, error_code, retry_after=retry_after), None
 
     except requests.exceptions.Timeout:
-        error_msg = "Timeout nella richiesta (30s) - Telegram non risponde"
+        breaker.record_failure()
+        error_msg = f"Timeout nella richiesta ({timeout}s) - Telegram non risponde"
         logger.error(f"❌ Timeout per {chat_id}: {error_msg}")
-        return {
-            'success': False,
-            'message_id': None,
-            'error': error_msg,
-            'error_code': None
-        }
+        return _failure(error_msg), None
     except requests.exceptions.ConnectionError:
+        breaker.record_failure()
         error_msg = "Errore di connessione - Impossibile raggiungere Telegram"
         logger.error(f"❌ Connection error per {chat_id}: {error_msg}")
-        return {
-            'success': False,
-            'message_id': None,
-            'error': error_msg,
-            'error_code': None
-        }
+        return _failure(error_msg), None
     except Exception as e:
+        breaker.record_failure()
         error_msg = f"Errore imprevisto: {str(e)}"
         logger.error(f"❌ Errore generico per {chat_id}: {error_msg}", exc_info=True)
-        return {
-            'success': False,
-            'message_id': None,
-            'error': error_msg,
-            'error_code': None
+        return _failure(error_msg), None
+
+def send_telegram_message(chat_id, message_text, token=None):
+    """
+    Invia un messaggio Telegram a un utente specifico
+
+    token: token del bot da usare (default get_bot_token()); passarlo
+    esplicitamente quando si invia da thread senza app context
+
+    Returns:
+        dict: {
+            'success': bool,
+            'message_id': str|None,
+            'error': str|None,
+            'error_code': int|None,
+            'retry_after': int|None  (errori 429 e circuito aperto),
+            'circuit_open': bool  (solo se l'invio non è partito per il circuit breaker)
         }
+    """
+    token = token or get_bot_token()
+    if not token:
+        error_msg = "Token del bot Telegram non configurato"
+        logger.error(error_msg)
+        return _failure(error_msg)
+
+    payload = {
+        'chat_id': chat_id,
+        'text': message_text,
+        'parse_mode': 'HTML'  # Supporta formattazione HTML di base
+    }
+    result, _ = _call_bot_api(token, 'sendMessage', chat_id, json=payload)
+    return result
 
-def get_bot_users():
+def edit_telegram_message(chat_id, message_id, text, token=None, caption=False):
     """
-    Ottiene la lista degli utenti che hanno interagito con il bot.
+    Sostituisce il testo di un messaggio già inviato (editMessageText), o la
+    didascalia con caption=True (editMessageCaption, per foto e documenti).
+    Di un album si corregge il primo messaggio, quello con la didascalia.
+
+    Returns: dict come send_telegram_message
+    """
+    token = token or get_bot_token()
+    if not token:
+        return _failure("Token del bot Telegram non configurato")
+
+    payload = {
+        'chat_id': chat_id,
+        'message_id': split_message_ids(message_id)[0],
+        'caption' if caption else 'text': text,
+        'parse_mode': 'HTML'
+    }
+    result, _ = _call_bot_api(token, 'editMessageCaption' if caption else 'editMessageText', chat_id, json=payload)
+    return result
+
+def delete_telegram_message(chat_id, message_id, token=None):
+    """
+    Cancella un messaggio già inviato (deleteMessage), o tutti i messaggi di
+    un album in una sola chiamata (deleteMessages). Telegram lo consente solo
+    entro 48 ore dall'invio.
+
+    Returns: dict come send_telegram_message
+    """
+    token = token or get_bot_token()
+    if not token:
+        return _failure("Token del bot Telegram non configurato")
+
+    message_ids = split_message_ids(message_id)
+    if len(message_ids) > 1:
+        result, _ = _call_bot_api(token, 'deleteMessages', chat_id,
+                                  json={'chat_id': chat_id, 'message_ids': message_ids})
+    else:
+        result, _ = _call_bot_api(token, 'deleteMessage', chat_id,
+                                  json={'chat_id': chat_id, 'message_id': message_ids[0]})
+    return result
+
+# Upload dei file: timeout più lungo (un documento da 50MB su una linea lenta)
+# e letture a blocchi, il file non viene mai caricato in memoria per intero
+MEDIA_UPLOAD_TIMEOUT = 300
+MEDIA_CHUNK_SIZE = 64 * 1024
+MEDIA_GROUP_MAX_ITEMS = 10
+
+class _MultipartBody:
+    """
+    Corpo multipart/form-data letto dai file a blocchi durante l'invio.
+
+    Ha una lunghezza nota (__len__), quindi requests manda Content-Length
+    invece del chunked encoding; ogni iterazione riapre i file, così la
+    stessa richiesta si può ripetere.
+    """
+
+    def __init__(self, fields, files):
+        """
+        fields: [(nome, valore)] dei campi di testo
+        files: [(nome del campo, percorso, nome del file, content type)]
+        """
+        self.boundary = uuid.uuid4().hex
+        self._parts = []
+        for name, value in fields:
+            self._parts.append(self._header(f'name="{name}"') + str(value).encode('utf-8') + b'\r\n')
+        for name, path, file_name, content_type in files:
+            self._parts.append(self._header(
+                f'name="{name}"; filename="{file_name}"',
+                f'Content-Type: {content_type or "application/octet-stream"}\r\n'
+            ))
+            self._parts.append((path, os.path.getsize(path)))
+            self._parts.append(b'\r\n')
+        self._parts.append(f'--{self.boundary}--\r\n'.encode('ascii'))
+
+    def _header(self, disposition, extra=''):
+        return (f'--{self.boundary}\r\nContent-Disposition: form-data; {disposition}\r\n'
+                f'{extra}\r\n').encode('utf-8')
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return sum(part[1] if isinstance(part, tuple) else len(part) for part in self._parts)
+
+    def __iter__(self):
+        for part in self._parts:
+            if not isinstance(part, tuple):
+                yield part
+                continue
+            with open(part[0], 'rb') as f:
+                while True:
+                    chunk = f.read(MEDIA_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+
+def _sent_file_id(message, kind):
+    """file_id del file in un messaggio inviato (per le foto, la dimensione più grande)"""
+    if not isinstance(message, dict):
+        return None
+    if kind == 'photo':
+        sizes = message.get('photo') or []
+        return sizes[-1].get('file_id') if sizes else None
+    return (message.get(kind) or {}).get('file_id')
+
+def send_telegram_media(chat_id, items, caption=None, token=None, file_ids=None):
+    """
+    Invia foto o documenti: sendPhoto/sendDocument per un file, sendMediaGroup
+    (album) da 2 a 10 file.
+
+    items: file da inviare, con gli attributi sha256, kind ('photo' o
+           'document'), path, file_name e content_type (vedi app.utils.media)
+    caption: didascalia (HTML), sul primo file dell'album
+    file_ids: {sha256: file_id} dei file già caricati con questo bot: questi
+              non vengono ricaricati
+
+    Returns:
+        dict come send_telegram_message, più 'file_ids': {sha256: file_id}
+        restituiti da Telegram per i file inviati
+    """
+    token = token or get_bot_token()
+    if not token:
+        error_msg = "Token del bot Telegram non configurato"
+        logger.error(error_msg)
+        return _failure(error_msg)
+    if not 1 <= len(items) <= MEDIA_GROUP_MAX_ITEMS:
+        return _failure(f"Un invio media accetta da 1 a {MEDIA_GROUP_MAX_ITEMS} file", 400)
+
+    file_ids = file_ids or {}
+    uploads = []
+
+    def media_ref(item):
+        """file_id se il file è già su Telegram, altrimenti attach:// di un nuovo upload"""
+        file_id = file_ids.get(item.sha256)
+        if file_id:
+            return file_id
+        attach_name = f'file{len(uploads)}'
+        uploads.append((attach_name, item.path, item.file_name, item.content_type))
+        return f'attach://{attach_name}'
+
+    fields = {'chat_id': chat_id}
+    if len(items) == 1:
+        item = items[0]
+        method = 'sendPhoto' if item.kind == 'photo' else 'sendDocument'
+        fields[item.kind] = media_ref(item)
+        if caption:
+            fields.update(caption=caption, parse_mode='HTML')
+    else:
+        method = 'sendMediaGroup'
+        fields['media'] = [
+            {'type': item.kind, 'media': media_ref(item)} for item in items
+        ]
+        if caption:
+            fields['media'][0].update(caption=caption, parse_mode='HTML')
+
+    if uploads:
+        form = [
+            (name, json.dumps(value) if isinstance(value, list) else value)
+            for name, value in fields.items()
+        ]
+        try:
+            body = _MultipartBody(form, uploads)
+        except OSError as e:
+            # File non più su disco (es. retry dopo una pulizia): inutile ritentare
+            return _failure(f"File da caricare non disponibile: {str(e)}", 400)
+        result, api_result = _call_bot_api(
+            token, method, chat_id, timeout=MEDIA_UPLOAD_TIMEOUT,
+            data=body, headers={'Content-Type': body.content_type}
+        )
+    else:
+        # Tutti i file già su Telegram: una richiesta leggera come un messaggio di testo
+        result, api_result = _call_bot_api(token, method, chat_id, json=fields)
+
+    messages = api_result if isinstance(api_result, list) else [api_result]
+    result['file_ids'] = {
+        item.sha256: file_id
+        for item, message in zip(items, messages)
+        for file_id in [_sent_file_id(message, item.kind)]
+        if file_id
+    }
+    return result
+
+def get_bot_users(token=None):
+    """
+    Ottiene la lista degli utenti che hanno interagito con il bot
+    (default il bot principale; token per interrogare un altro bot del pool).
 
     IMPORTANTE: Telegram non fornisce direttamente una lista completa di utenti.
     Questa funzione cerca negli updates recenti e potrebbe non trovare tutti gli utenti.
@@ -218,7 +510,7 @@ def get_bot_users():
     Per una soluzione completa, implementa un webhook o salva gli utenti
     quando interagiscono con il bot.
     """
-    token = get_bot_token()
+    token = token or get_bot_token()
     if not token:
         logger.error("Token del bot Telegram non configurato")
         return []
@@ -227,7 +519,7 @@ def get_bot_users():
 
     try:
         # Metodo 1: Ottieni updates recenti con offset per recuperare più messaggi
-        url = f"https://api.telegram.org/bot{token}/getUpdates"
+        url = get_api_url(token, 'getUpdates')
 
         # Prova a recuperare fino a 1000 updates recenti
         for offset in [None, -100, -200, -300, -400, -500]:
@@ -273,6 +565,7 @@ def get_bot_users():
                                     'username': user_data.get('username'),
                                     'first_name': user_data.get('first_name', ''),
                                     'last_name': user_data.get('last_name', ''),
+                                    'language_code': user_data.get('language_code'),
                                     'is_bot': user_data.get('is_bot', False)
                                 }
                     else:
@@ -307,7 +600,7 @@ def get_specific_updates(limit=100, offset=None):
         return []
 
     try:
-        url = f"https://api.telegram.org/bot{token}/getUpdates"
+        url = get_api_url(token, 'getUpdates')
         params = {
             'limit': limit,
             'timeout': 0
@@ -341,7 +634,7 @@ def manual_add_user_from_chat_id(chat_id):
 
     try:
         # Prova a inviare un messaggio di test per ottenere info
-        url = f"https://api.telegram.org/bot{token}/getChat"
+        url = get_api_url(token, 'getChat')
         params = {'chat_id': chat_id}
 
         response = requests.get(url, params=params, timeout=10)
@@ -375,7 +668,7 @@ def get_chat_info(chat_id):
         return None
 
     try:
-        url = f"https://api.telegram.org/bot{token}/getChat"
+        url = get_api_url(token, 'getChat')
         params = {'chat_id': chat_id}
 
         response = requests.get(url, params=params, timeout=10)
@@ -391,26 +684,31 @@ def get_chat_info(chat_id):
         logger.error(f"Errore nel recupero info chat {chat_id}: {str(e)}")
         return None
 
-def send_message_with_retry(chat_id, message_text, max_retries=3, delay=1):
-    """Invia messaggio con retry automatico in caso di errore"""
-    import time
+def send_message_with_retry(chat_id, message_text, policy=None, budget=None):
+    """
+    Invia un singolo messaggio ritentando secondo la RetryPolicy.
 
-    for attempt in range(max_retries):
-        try:
-            success = send_telegram_message(chat_id, message_text)
-            if success:
-                return True
+    Attende nel thread chiamante: per gli invii a molti destinatari usare
+    app.utils.dispatcher.dispatch(), che pianifica i retry senza bloccare.
+
+    Returns:
+        dict: risultato dell'ultimo tentativo di send_telegram_message
+    """
+    policy = policy or RetryPolicy()
+    if budget is not None:
+        budget.record_request()
 
-            # Se fallisce, aspetta prima del retry
-            if attempt < max_retries - 1:
-                time.sleep(delay * (attempt + 1))  # Backoff progressivo
+    attempt = 0
+    while True:
+        result = send_telegram_message(chat_id, message_text)
 
-        except Exception as e:
-            logger.error(f"Tentativo {attempt + 1} fallito per {chat_id}: {str(e)}")
-            if attempt < max_retries - 1:
-                time.sleep(delay * (attempt + 1))
+        delay = policy.next_delay(result, attempt)
+        if delay is None or (budget is not None and not budget.try_spend()):
+            return result
 
-    return False
+        logger.warning(f"Tentativo {attempt + 1} fallito per {chat_id}, nuovo tentativo tra {delay:.2f}s: {result.get('error')}")
+        time.sleep(delay)
+        attempt += 1
 
 def batch_send_messages(messages_data, batch_size=5, delay_between_batches=1):
     """
@@ -424,8 +722,7 @@ def batch_send_messages(messages_data, batch_size=5, delay_between_batches=1):
     Returns:
         Dict con statistiche invio
     """
-    import time
-
+    budget = RetryBudget()
     results = {
         'sent': 0,
         'failed': 0,
@@ -438,18 +735,19 @@ def batch_send_messages(messages_data, batch_size=5, delay_between_batches=1):
 
         for msg_data in batch:
             try:
-                success = send_message_with_retry(
+                result = send_message_with_retry(
                     msg_data['chat_id'],
-                    msg_data['message_text']
+                    msg_data['message_text'],
+                    budget=budget
                 )
 
-                if success:
+                if result['success']:
                     results['sent'] += 1
                 else:
                     results['failed'] += 1
                     results['errors'].append({
                         'chat_id': msg_data['chat_id'],
-                        'error': 'Invio fallito dopo retry'
+                        'error': result['error'] or 'Invio fallito dopo retry'
                     })
 
             except Exception as e:
@@ -0,0 +1,188 @@
+"""
+Ricerca utenti per nome, cognome, display name e username
+
+Su MySQL (non MariaDB, che non ha il parser ngram) la ricerca usa l'indice FULLTEXT ft_users_search con parser ngram
+(migrazione add_users_search_index): ogni termine trova le sottostringhe di
+almeno due caratteri in una delle quattro colonne, senza scansione della
+tabella. Senza indice (sqlite, o migrazione non ancora eseguita) la stessa
+ricerca si fa con LIKE '%termine%'. Un termine numerico trova anche
+l'utente con quel telegram_id. La presenza dell'indice si ricontrolla ogni
+FULLTEXT_CHECK_TTL secondi: una migrazione fatta con l'app avviata viene
+usata senza riavviare i worker.
+
+I membri di un gruppo escluso (exclude_group) si tolgono nella query, prima
+del limite di SEARCH_CACHE_ROWS righe: anche in un gruppo con molti utenti
+che corrispondono, restano tutti quelli che non ne fanno parte.
+
+I risultati restano in una cache in memoria per processo, indicizzata per
+testo della ricerca e versione 'users' di ViewCache (con un gruppo escluso,
+anche per gruppo e sua versione 'group'): ogni modifica agli utenti la
+invalida, e il contatore (Redis o tabella cache_versions) è
+condiviso dai worker. Il TTL breve copre le modifiche fatte fuori dall'app. Mentre si digita ogni ricerca estende la precedente:
+se una ricerca più corta con lo stesso inizio ha tutti i risultati in
+cache (non più di SEARCH_CACHE_ROWS), quelli per il testo nuovo si
+ottengono filtrandoli in memoria, senza query.
+"""
+
+import time
+import unicodedata
+from collections import namedtuple
+
+from sqlalchemy import and_, exists, inspect, or_
+from sqlalchemy.dialects.mysql import match
+
+from app import db
+from app.models import User, group_users
+from app.utils.cache import LRUCache, cache
+from app.utils.serializers import Computed, project, user_summary_projection
+
+FULLTEXT_INDEX = 'ft_users_search'
+SEARCH_COLUMNS = (User.username, User.first_name, User.last_name, User.display_name)
+
+# Con il parser ngram (ngram_token_size=2) i termini più corti non sono nell'indice
+SEARCH_MIN_LENGTH = 2
+SEARCH_LIMIT = 20
+SEARCH_MAX_LIMIT = 50
+# Risultati letti dal database per ricerca: oltre questo numero la ricerca
+# è troppo generica e non viene usata per filtrare le successive
+SEARCH_CACHE_ROWS = 200
+# Secondi tra un controllo e l'altro della presenza dell'indice FULLTEXT
+FULLTEXT_CHECK_TTL = 300
+
+# Caratteri con un significato nella sintassi booleana di MATCH ... AGAINST
+_OPERATORS = str.maketrans({char: ' ' for char in '+-<>()~*"@\\'})
+
+# data: campi della risposta (user_summary_projection), text: colonne dei nomi normalizzate
+UserHit = namedtuple('UserHit', 'data text')
+
+_results = LRUCache(max_entries=4096, default_ttl=60)
+# engine -> (scadenza del controllo, indice presente)
+_fulltext_engines = {}
+
+
+def _fold(value):
+    """Minuscole e senza accenti, come le collation _ci di MySQL"""
+    decomposed = unicodedata.normalize('NFKD', value)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def normalize_query(query):
+    """Testo della ricerca normalizzato: chiave della cache e fonte dei termini"""
+    return ' '.join(_fold(query or '').translate(_OPERATORS).split())
+
+
+def _terms(normalized):
+    return [term for term in normalized.split() if len(term) >= SEARCH_MIN_LENGTH]
+
+
+def _has_fulltext_index(engine):
+    """True se la tabella users ha l'indice FULLTEXT (ricontrollato ogni FULLTEXT_CHECK_TTL secondi)"""
+    if engine.dialect.name != 'mysql' or getattr(engine.dialect, 'is_mariadb', False):
+        return False
+    now = time.monotonic()
+    checked = _fulltext_engines.get(engine)
+    if checked is None or checked[0] <= now:
+        has_index = any(index['name'] == FULLTEXT_INDEX for index in inspect(engine).get_indexes('users'))
+        checked = _fulltext_engines[engine] = (now + FULLTEXT_CHECK_TTL, has_index)
+    return checked[1]
+
+
+def _like(term):
+    """Pattern LIKE per una sottostringa, con % e _ letterali"""
+    return '%' + term.replace('%', r'\%').replace('_', r'\_') + '%'
+
+
+def _search_text(*names):
+    return _fold(' '.join(name for name in names if name))
+
+
+def _search_projection():
+    return dict(user_summary_projection(), text=Computed(SEARCH_COLUMNS, _search_text))
+
+
+def _hit(item):
+    text = item.pop('text')
+    return UserHit(item, text)
+
+
+def _matches(hit, terms):
+    return all(term in hit.text for term in terms)
+
+
+def _rank(hit, terms):
+    """Prima il telegram_id cercato, poi chi ha una parola che inizia con il primo termine, poi per nome"""
+    exact = len(terms) == 1 and hit.data['telegram_id'] == terms[0]
+    starts = any(word.startswith(terms[0]) for word in hit.text.split())
+    return (not exact, not starts, hit.data['full_name'].casefold(), hit.data['id'])
+
+
+def _query_hits(terms, exclude_group=None):
+    """Ricerca sul database, senza i membri di exclude_group: (completa, lista di UserHit)"""
+    query = User.query
+
+    if _has_fulltext_index(db.engine):
+        # Frase tra virgolette: con ngram trova i termini come sottostringhe
+        score = match(*SEARCH_COLUMNS, against=' '.join(f'+"{term}"' for term in terms)).in_boolean_mode()
+        condition = score > 0
+        query = query.order_by(score.desc(), User.id)
+    else:
+        condition = and_(*(
+            or_(*(column.ilike(_like(term), escape='\\') for column in SEARCH_COLUMNS))
+            for term in terms
+        ))
+        query = query.order_by(User.id)
+
+    numbers = [int(term) for term in terms if term.isdigit()]
+    if len(numbers) == 1 and len(terms) == 1:
+        condition = or_(condition, User.telegram_id == numbers[0])
+    if exclude_group:
+        condition = and_(condition, ~exists().where(
+            group_users.c.group_id == exclude_group,
+            group_users.c.user_id == User.id
+        ))
+
+    rows = project(query.filter(condition).limit(SEARCH_CACHE_ROWS + 1), _search_projection())
+    return len(rows) <= SEARCH_CACHE_ROWS, [_hit(row) for row in rows[:SEARCH_CACHE_ROWS]]
+
+
+def _narrow(scope, normalized, terms):
+    """Risultati filtrati dalla ricerca completa in cache più lunga che inizia come questa, o None"""
+    for length in range(len(normalized) - 1, SEARCH_MIN_LENGTH - 1, -1):
+        shorter = _results.get((scope, normalized[:length]))
+        if shorter is not None and shorter[0]:
+            return [hit for hit in shorter[1] if _matches(hit, terms)]
+    return None
+
+
+def search_users(query, exclude_group=None):
+    """
+    Utenti che corrispondono a tutti i termini della ricerca, i più
+    pertinenti per primi, esclusi i membri del gruppo exclude_group.
+
+    Returns:
+        lista di UserHit (al massimo SEARCH_CACHE_ROWS), vuota se la ricerca
+        non ha termini di almeno SEARCH_MIN_LENGTH caratteri
+    """
+    normalized = normalize_query(query)
+    terms = _terms(normalized)
+    if not terms:
+        return []
+
+    # Risultati validi finché non cambiano gli utenti (e i membri del gruppo escluso)
+    scope = cache.version('users', 'all')
+    if exclude_group:
+        scope = (scope, exclude_group, cache.version('group', exclude_group))
+    cached = _results.get((scope, normalized))
+    if cached is not None:
+        return cached[1]
+
+    # Un telegram_id cercato per intero non è tra i risultati del suo inizio
+    hits = None if any(term.isdigit() for term in terms) else _narrow(scope, normalized, terms)
+    if hits is not None:
+        complete = True
+    else:
+        complete, hits = _query_hits(terms, exclude_group)
+
+    hits.sort(key=lambda hit: _rank(hit, terms))
+    _results.set((scope, normalized), (complete, hits))
+    return hits
@@ -32,17 +32,62 @@ class Config:
     }
 
     TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
+    # Pool di bot (token separati da virgola): ogni bot ha il proprio rate
+    # limit, gli invii vengono ripartiti tra i bot a cui sono assegnati gli utenti
+    TELEGRAM_BOT_TOKENS = os.environ.get('TELEGRAM_BOT_TOKENS')
+
+    # Invio messaggi: invii al secondo (la Bot API ne accetta circa 30 per bot)
+    # e thread che inviano in parallelo
+    TELEGRAM_RATE_LIMIT = float(os.environ.get('TELEGRAM_RATE_LIMIT', 25))
+    # Il limite vale per bot, non per processo: con Redis è condiviso da tutti
+    # i worker, altrimenti ogni worker ne usa 1/TELEGRAM_RATE_LIMIT_PROCESSES
+    # (gunicorn.conf.py lo imposta al numero di worker)
+    TELEGRAM_RATE_LIMIT_REDIS_URL = os.environ.get('TELEGRAM_RATE_LIMIT_REDIS_URL') or os.environ.get('CACHE_REDIS_URL')
+    TELEGRAM_RATE_LIMIT_PROCESSES = int(os.environ.get('TELEGRAM_RATE_LIMIT_PROCESSES', 1))
+    DISPATCH_WORKERS = int(os.environ.get('DISPATCH_WORKERS', 8))
+    # Gli invii partono in un thread separato e la pagina ne mostra
+    # l'avanzamento (Server-Sent Events); False: invio dentro la richiesta
+    DISPATCH_IN_BACKGROUND = os.environ.get('DISPATCH_IN_BACKGROUND', 'True').lower() == 'true'
+    # Secondi senza risultati salvati dopo i quali un invio non finito (worker
+    # riavviato, thread interrotto) si considera fermo e si può ritentare
+    DISPATCH_STALE_AFTER = int(os.environ.get('DISPATCH_STALE_AFTER', 300))
+    # Stream SSE dell'avanzamento aperti insieme per processo: ognuno tiene
+    # un thread del worker (gunicorn.conf.py lo imposta a metà dei thread)
+    PROGRESS_MAX_STREAMS = int(os.environ.get('PROGRESS_MAX_STREAMS', 4))
+
+    # Invii di foto e documenti: i file caricati restano su disco (un file per
+    # contenuto, nominato con lo sha256) per i retry; la Bot API accetta upload
+    # fino a 50MB
+    MEDIA_UPLOAD_FOLDER = os.environ.get('MEDIA_UPLOAD_FOLDER') or \
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'media')
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 50 * 1024 * 1024))
+
+    # Retry degli invii falliti per errori temporanei (429, 5xx, timeout):
+    # backoff esponenziale con jitter e al massimo TELEGRAM_RETRY_BUDGET
+    # retry per invio originale
+    TELEGRAM_MAX_RETRIES = int(os.environ.get('TELEGRAM_MAX_RETRIES', 3))
+    TELEGRAM_RETRY_BASE_DELAY = float(os.environ.get('TELEGRAM_RETRY_BASE_DELAY', 0.5))
+    TELEGRAM_RETRY_MAX_DELAY = float(os.environ.get('TELEGRAM_RETRY_MAX_DELAY', 30))
+    TELEGRAM_RETRY_BUDGET = float(os.environ.get('TELEGRAM_RETRY_BUDGET', 0.1))
+
+    # Cache delle pagine di sola lettura (gruppi e template)
+    # Senza CACHE_REDIS_URL si usa una LRU in memoria per ogni worker, con i
+    # contatori di versione nella tabella cache_versions (condivisi)
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    CACHE_DEFAULT_TTL = int(os.environ.get('CACHE_DEFAULT_TTL', 60))
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
 
     # Configurazioni Babel per internazionalizzazione
     LANGUAGES = {
         'it': 'Italiano',
         'en': 'English',
-        'es': 'Español',
         'fr': 'Français',
-        'de': 'Deutsch'
+        'de': 'Deutsch',
+        'es': 'Español'
     }
     BABEL_DEFAULT_LOCALE = 'it'
-    BABEL_DEFAULT_TIMEZONE = 'Europe/Rome'
+    # Le date sono salvate in UTC (datetime.utcnow) e mostrate così come sono
+    BABEL_DEFAULT_TIMEZONE = 'UTC'
 
     # Configurazioni per l'ambiente di sviluppo
     DEBUG = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
@@ -52,12 +97,16 @@ class DevelopmentConfig(Config):
 
 class ProductionConfig(Config):
     DEBUG = False
+    # Template compilati una volta all'avvio, senza controllare i file ad ogni render
+    TEMPLATES_AUTO_RELOAD = False
     # Configurazioni aggiuntive per produzione
+    # Il pool è per processo: con gunicorn servono almeno tante connessioni
+    # quanti thread per worker (vedi gunicorn.conf.py)
     SQLALCHEMY_ENGINE_OPTIONS = {
         'pool_pre_ping': True,
         'pool_recycle': 3600,
-        'pool_size': 10,
-        'max_overflow': 20,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
         'connect_args': {
             'charset': 'utf8mb4',
             'use_unicode': True
@@ -0,0 +1,113 @@
+"""
+Fixture comuni dei test: app su un database sqlite temporaneo e Bot API
+finta (load_test.FakeBotAPIHandler) che registra le chiamate ricevute
+"""
+
+import io
+import json
+import threading
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+import pytest
+from sqlalchemy import event
+
+import config
+from app import create_app, db
+from load_test import FakeBotAPIHandler
+
+TEST_BOT_TOKEN = '1001:test-token'
+
+
+class SqliteTestConfig(config.DevelopmentConfig):
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    TELEGRAM_BOT_TOKEN = TEST_BOT_TOKEN
+    TELEGRAM_BOT_TOKENS = None
+    TELEGRAM_MAX_RETRIES = 0
+    # Invii dentro la richiesta: a fine richiesta i MessageLog sono già salvati
+    DISPATCH_IN_BACKGROUND = False
+
+
+def _enable_foreign_keys(dbapi_connection, connection_record):
+    dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    for name in ('TELEGRAM_BOT_TOKEN', 'TELEGRAM_BOT_TOKENS', 'CACHE_REDIS_URL', 'TELEGRAM_RATE_LIMIT_REDIS_URL'):
+        monkeypatch.delenv(name, raising=False)
+    SqliteTestConfig.SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+    SqliteTestConfig.MEDIA_UPLOAD_FOLDER = str(tmp_path / 'media')
+    config.config['sqlite_test'] = SqliteTestConfig
+    app = create_app('sqlite_test')
+    with app.app_context():
+        # Chiavi esterne verificate come su MySQL
+        event.listen(db.engine, 'connect', _enable_foreign_keys)
+        db.create_all()
+        yield app
+        db.session.remove()
+    del config.config['sqlite_test']
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+class RecordingBotAPIHandler(FakeBotAPIHandler):
+    """FakeBotAPIHandler che registra (token, metodo, campi) e può far fallire alcune chat"""
+
+    calls = None
+    failures = None
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.rfile = io.BytesIO(body)
+
+        token, method = self.path.split('?', 1)[0].rsplit('/', 2)[-2:]
+        fields = self._fields(body) if body else dict(parse_qsl(self.path.partition('?')[2]))
+        self.calls.append((token[len('bot'):], method, fields))
+
+        chat_id = str(fields.get('chat_id'))
+        if chat_id in self.failures:
+            error_code, description = self.failures[chat_id]
+            self._reply({'ok': False, 'error_code': error_code, 'description': description}, error_code)
+            return
+        super()._handle()
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+class FakeBotAPI:
+    """Chiamate ricevute dalla Bot API finta e risposte di errore per chat_id"""
+
+    def __init__(self, calls, failures):
+        self.calls = calls
+        self.failures = failures
+
+    def methods(self):
+        return [method for _, method, _ in self.calls]
+
+    def fail(self, chat_id, error_code, description):
+        self.failures[str(chat_id)] = (error_code, description)
+
+    @staticmethod
+    def media(fields):
+        """Elementi di un sendMediaGroup"""
+        media = fields['media']
+        return json.loads(media) if isinstance(media, str) else media
+
+
+@pytest.fixture
+def bot_api(monkeypatch):
+    calls, failures = [], {}
+    handler = type('Handler', (RecordingBotAPIHandler,), {'calls': calls, 'failures': failures})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv('TELEGRAM_API_URL', f'http://127.0.0.1:{server.server_port}')
+    yield FakeBotAPI(calls, failures)
+    server.shutdown()
+    server.server_close()
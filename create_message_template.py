@@ -40,7 +40,7 @@ def create_template_tables():
         users_sql = """
         CREATE TABLE IF NOT EXISTS users (
             id INT AUTO_INCREMENT PRIMARY KEY,
-            telegram_id VARCHAR(20) UNIQUE NOT NULL,
+            telegram_id BIGINT UNIQUE NOT NULL,
             username VARCHAR(100),
             first_name VARCHAR(100),
             last_name VARCHAR(100),
@@ -0,0 +1,60 @@
+"""
+Configurazione gunicorn per la produzione: gunicorn wsgi:app
+
+Il carico dell'app è dominato dall'I/O (MySQL e Bot API di Telegram), quindi
+usiamo worker gthread: pochi processi legati ai core e più thread per processo
+che restano in attesa sulla rete senza occupare CPU.
+Tutti i valori si possono sovrascrivere con variabili ambiente.
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Processi: 2 per core + 1, la formula classica per carichi misti CPU/I-O
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# Thread per processo: coprono le attese sulla rete durante gli invii
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Il pool SQLAlchemy è per processo: deve servire tutti i thread del worker
+os.environ.setdefault('DB_POOL_SIZE', str(threads))
+os.environ.setdefault('DB_MAX_OVERFLOW', str(threads))
+
+# Gli stream SSE dell'avanzamento occupano un thread ciascuno: al massimo
+# metà dei thread, gli altri restano per le richieste normali
+os.environ.setdefault('PROGRESS_MAX_STREAMS', str(max(1, threads // 2)))
+
+# Il rate limit della Bot API è per bot: senza Redis ogni worker ne usa una quota
+os.environ.setdefault('TELEGRAM_RATE_LIMIT_PROCESSES', str(workers))
+
+# Invii lunghi a gruppi grandi: evita che il master uccida il worker
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Ricicla i worker periodicamente per contenere la frammentazione della memoria.
+# Gli invii in background sono thread del worker: se il worker viene riciclato
+# (o riavviato) a metà invio, dopo DISPATCH_STALE_AFTER secondi l'invio risulta
+# fermo e "Riprova" nella cronologia consegna i messaggi mancanti
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = 200
+
+# Carica l'app nel master prima del fork: codice e dati in sola lettura
+# sono condivisi copy-on-write tra i worker
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """Scarta le connessioni ereditate dal master: ogni worker apre le proprie"""
+    from app import db
+    from wsgi import app
+
+    with app.app_context():
+        db.engine.dispose(close=False)
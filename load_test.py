@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Generatore di carico end-to-end per Telegram Group Manager
+
+Simula operatori concorrenti che usano l'app come farebbe una persona:
+lista gruppi -> dettaglio gruppo -> template -> invio messaggi -> cronologia.
+Alla fine riporta richieste/secondo, percentili di latenza ed errori per route,
+utili per dimensionare worker e pool del database (ProductionConfig).
+
+USO TIPICO:
+1. python load_test.py fake-bot --port 8081
+2. TELEGRAM_API_URL=http://127.0.0.1:8081 python run.py   (o il server di produzione)
+3. python load_test.py run --base-url http://127.0.0.1:5000 --operators 20 --duration 60
+"""
+
+import argparse
+import email.parser
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+import requests
+
+GROUP_LINK_RE = re.compile(r'/groups/(\d+)(?:["/])')
+DIRECT_MESSAGE_RE = re.compile(r'name="direct_message_(\d+)"')
+# Gruppi grandi: la pagina ha solo i primi membri, gli altri da /groups/<id>/members
+MEMBERS_AFTER_RE = re.compile(r'data-after="(\d+)"')
+
+# Pausa minima quando non c'è nessun gruppo (server vuoto o in errore)
+NO_GROUPS_BACKOFF = 1.0
+
+# Invii media: sempre gli stessi file, così dopo il primo upload per bot
+# gli invii riusano i file_id (cache dei file di app.utils.media)
+MEDIA_FILES = [
+    ('load_test_1.txt', b'Load test: primo allegato\n', 'text/plain'),
+    ('load_test_2.txt', b'Load test: secondo allegato\n', 'text/plain'),
+]
+DISPATCH_ID_RE = re.compile(r'[?&]dispatch=(\d+)')
+
+
+# =================================
+# SERVER BOT API FINTO
+# =================================
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    """Risponde ai metodi della Bot API usati dall'app senza contattare Telegram"""
+
+    message_ids = itertools.count(1)
+    file_ids = itertools.count(1)
+    latency = 0.0
+
+    def _reply(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fields(self, body):
+        """Campi di testo della richiesta: JSON, form urlencoded o multipart (i file sono ignorati)"""
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('application/json'):
+            return json.loads(body or b'{}')
+        if content_type.startswith('multipart/form-data'):
+            message = email.parser.BytesParser().parsebytes(
+                b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body
+            )
+            return {
+                part.get_param('name', header='content-disposition'): part.get_payload(decode=True).decode('utf-8')
+                for part in message.get_payload()
+                if part.get_filename() is None
+            }
+        return dict(parse_qsl(body.decode('utf-8')))
+
+    def _media_message(self, kind, media):
+        """Messaggio inviato con un file: stesso file_id se era già su Telegram, altrimenti uno nuovo"""
+        file_id = media if media and not media.startswith('attach://') else f'fake-file-{next(self.file_ids)}'
+        if kind == 'photo':
+            # Come Telegram: più dimensioni, la più grande per ultima
+            return {'message_id': next(self.message_ids),
+                    'photo': [{'file_id': f'{file_id}-thumb'}, {'file_id': file_id}]}
+        return {'message_id': next(self.message_ids), 'document': {'file_id': file_id}}
+
+    def _handle(self):
+        # Consuma il body per mantenere valida la connessione keep-alive
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        method = self.path.split('?', 1)[0].rsplit('/', 1)[-1]
+
+        if method == 'getMe':
+            self._reply({'ok': True, 'result': {'id': 1, 'is_bot': True,
+                                                'first_name': 'Fake Bot', 'username': 'fake_bot'}})
+        elif method in ('sendMessage', 'editMessageText', 'editMessageCaption'):
+            self._reply({'ok': True, 'result': {'message_id': next(self.message_ids)}})
+        elif method in ('sendPhoto', 'sendDocument'):
+            kind = 'photo' if method == 'sendPhoto' else 'document'
+            self._reply({'ok': True, 'result': self._media_message(kind, self._fields(body).get(kind))})
+        elif method == 'sendMediaGroup':
+            media = self._fields(body).get('media') or '[]'
+            items = json.loads(media) if isinstance(media, str) else media
+            # Un messaggio per ogni file dell'album
+            self._reply({'ok': True, 'result': [
+                self._media_message(item.get('type'), item.get('media')) for item in items
+            ]})
+        elif method in ('deleteMessage', 'deleteMessages'):
+            self._reply({'ok': True, 'result': True})
+        elif method == 'getUpdates':
+            self._reply({'ok': True, 'result': []})
+        elif method == 'getChat':
+            self._reply({'ok': False, 'error_code': 400, 'description': 'Bad Request: chat not found'}, 400)
+        else:
+            self._reply({'ok': False, 'error_code': 404, 'description': 'Not Found'}, 404)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, format, *args):
+        # Silenzia il log per richiesta: a migliaia di richieste/s sarebbe il collo di bottiglia
+        pass
+
+
+def run_fake_bot(host, port, latency):
+    """Avvia il server Bot API finto in foreground"""
+    FakeBotAPIHandler.latency = latency
+    server = ThreadingHTTPServer((host, port), FakeBotAPIHandler)
+    server.daemon_threads = True
+
+    print(f"🤖 Bot API finta in ascolto su http://{host}:{port} (latenza simulata: {latency * 1000:.0f} ms)")
+    print(f"   Avvia l'app con: TELEGRAM_API_URL=http://{host}:{port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Bot API finta arrestata")
+    finally:
+        server.server_close()
+
+
+# =================================
+# STATISTICHE
+# =================================
+
+class RouteStats:
+    """Raccoglie latenze ed errori per route, condiviso tra i thread operatore"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, route, elapsed, ok):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(elapsed)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def report(self, wall_time):
+        total = sum(len(v) for v in self.latencies.values())
+        total_errors = sum(self.errors.values())
+
+        print("\n📊 RISULTATI TEST DI CARICO")
+        print("=" * 86)
+        print(f"{'Route':<26}{'Richieste':>10}{'Req/s':>9}{'Errori':>8}"
+              f"{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+        print("-" * 86)
+
+        for route in sorted(self.latencies):
+            samples = sorted(self.latencies[route])
+            print(f"{route:<26}{len(samples):>10}{len(samples) / wall_time:>9.1f}"
+                  f"{self.errors.get(route, 0):>8}"
+                  f"{percentile(samples, 50) * 1000:>9.1f}{percentile(samples, 90) * 1000:>9.1f}"
+                  f"{percentile(samples, 99) * 1000:>9.1f}{samples[-1] * 1000:>9.1f}")
+
+        print("-" * 86)
+        print(f"{'TOTALE':<26}{total:>10}{total / wall_time:>9.1f}{total_errors:>8}")
+        print(f"\n⏱️  Durata: {wall_time:.1f}s")
+
+
+def percentile(sorted_samples, pct):
+    """Percentile con interpolazione nearest-rank su una lista già ordinata"""
+    if not sorted_samples:
+        return 0.0
+    index = max(0, min(len(sorted_samples) - 1, int(round(pct / 100 * len(sorted_samples))) - 1))
+    return sorted_samples[index]
+
+
+# =================================
+# SESSIONI OPERATORE
+# =================================
+
+class Operator(threading.Thread):
+    """Un operatore virtuale che ripete una sessione realistica fino alla scadenza"""
+
+    def __init__(self, base_url, stats, deadline, think_time, send_ratio, group_id=None, media_ratio=0.0):
+        super().__init__(daemon=True)
+        self.base_url = base_url.rstrip('/')
+        self.stats = stats
+        self.deadline = deadline
+        self.think_time = think_time
+        self.send_ratio = send_ratio
+        self.media_ratio = media_ratio
+        self.group_id = group_id
+        self.http = requests.Session()
+
+    def _request(self, route, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, timeout=60,
+                                         allow_redirects=False, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response = None
+            ok = False
+        self.stats.record(route, time.perf_counter() - start, ok)
+        return response
+
+    def _think(self):
+        if self.think_time:
+            time.sleep(random.uniform(0, 2 * self.think_time))
+
+    def _load_members(self, group_id, html):
+        """Id dei membri: quelli nella pagina più le pagine successive, come scorrendo la lista"""
+        user_ids = DIRECT_MESSAGE_RE.findall(html)
+        match = MEMBERS_AFTER_RE.search(html)
+        after = match.group(1) if match else None
+        while after:
+            response = self._request('groups.group_members', 'GET', f'/groups/{group_id}/members',
+                                     params={'after': after})
+            if response is None or response.status_code != 200:
+                break
+            data = response.json()
+            user_ids.extend(str(member['id']) for member in data['members'])
+            after = data['next_after']
+        return user_ids
+
+    def _send_media_and_revise(self, group_id):
+        """Album di due file, poi correzione della didascalia e ritiro dell'invio"""
+        files = [('media', media_file) for media_file in MEDIA_FILES]
+        response = self._request('groups.broadcast_media', 'POST', f'/groups/{group_id}/broadcast_media',
+                                 data={'media_caption': 'Load test {first_name}'}, files=files)
+        match = DISPATCH_ID_RE.search(response.headers.get('Location', '')) if response is not None else None
+        if not match:
+            return
+        dispatch_id = match.group(1)
+        self._think()
+
+        self._request('groups.edit_dispatch', 'POST', f'/groups/{group_id}/dispatches/{dispatch_id}/edit',
+                      data={'edit_message': f'Load test {time.time():.3f} {{first_name}}'})
+        self._think()
+
+        self._request('groups.delete_dispatch', 'POST', f'/groups/{group_id}/dispatches/{dispatch_id}/delete')
+        self._think()
+
+    def run_session(self):
+        response = self._request('groups.list_groups', 'GET', '/groups/')
+        group_ids = [int(g) for g in GROUP_LINK_RE.findall(response.text)] if response is not None else []
+
+        group_id = self.group_id or (random.choice(group_ids) if group_ids else None)
+        if not group_id:
+            # Senza pausa run() ripeterebbe /groups/ a ciclo continuo
+            time.sleep(max(self.think_time, NO_GROUPS_BACKOFF))
+            return
+        self._think()
+
+        response = self._request('groups.group_detail', 'GET', f'/groups/{group_id}')
+        user_ids = self._load_members(group_id, response.text) if response is not None else []
+        self._think()
+
+        self._request('groups.list_templates', 'GET', f'/groups/{group_id}/templates')
+        self._think()
+
+        if user_ids and random.random() < self.send_ratio:
+            form = {f'direct_message_{user_id}': f'Load test {time.time():.3f}' for user_id in user_ids}
+            self._request('groups.send_messages', 'POST', f'/groups/{group_id}/send_messages', data=form)
+            self._think()
+
+        if user_ids and random.random() < self.media_ratio:
+            self._send_media_and_revise(group_id)
+
+        self._request('groups.message_history', 'GET', f'/groups/{group_id}/message_history')
+        self._think()
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            self.run_session()
+
+
+def run_load_test(args):
+    """Esegue il test di carico e stampa il report"""
+    print(f"🚀 Test di carico su {args.base_url}")
+    print(f"   Operatori: {args.operators}, durata: {args.duration}s, "
+          f"pausa media: {args.think_time}s, quota invii: {args.send_ratio:.0%}, "
+          f"quota invii media: {args.media_ratio:.0%}")
+
+    stats = RouteStats()
+    start = time.monotonic()
+    deadline = start + args.duration
+
+    operators = [
+        Operator(args.base_url, stats, deadline, args.think_time, args.send_ratio, args.group_id, args.media_ratio)
+        for _ in range(args.operators)
+    ]
+    for operator in operators:
+        operator.start()
+
+    try:
+        for operator in operators:
+            operator.join()
+    except KeyboardInterrupt:
+        print("\n🛑 Interrotto, report parziale:")
+
+    stats.report(time.monotonic() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Test di carico end-to-end per Telegram Group Manager')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    fake_bot = subparsers.add_parser('fake-bot', help='Avvia un server Bot API finto')
+    fake_bot.add_argument('--host', default='127.0.0.1')
+    fake_bot.add_argument('--port', type=int, default=8081)
+    fake_bot.add_argument('--latency', type=float, default=0.05,
+                          help='Latenza simulata per chiamata, in secondi (default 0.05)')
+
+    run = subparsers.add_parser('run', help="Esegue sessioni operatore contro l'app")
+    run.add_argument('--base-url', default='http://127.0.0.1:5000')
+    run.add_argument('--operators', type=int, default=10, help='Operatori concorrenti (default 10)')
+    run.add_argument('--duration', type=float, default=30, help='Durata in secondi (default 30)')
+    run.add_argument('--think-time', type=float, default=0.5,
+                     help='Pausa media tra le azioni, in secondi (default 0.5)')
+    run.add_argument('--send-ratio', type=float, default=0.2,
+                     help='Quota di sessioni che inviano messaggi (default 0.2)')
+    run.add_argument('--media-ratio', type=float, default=0.05,
+                     help='Quota di sessioni che inviano un album e poi lo correggono e ritirano (default 0.05)')
+    run.add_argument('--group-id', type=int, help='Usa sempre questo gruppo invece di sceglierne uno a caso')
+
+    args = parser.parse_args()
+
+    if args.command == 'fake-bot':
+        run_fake_bot(args.host, args.port, args.latency)
+    else:
+        run_load_test(args)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,12 @@
-from app import create_app, db
-from app.models import Group, User
+from app import create_app
+from app.migrations import run_migrations
 
 app = create_app()
 
 def create_tables():
-    """Crea le tabelle del database se non esistono"""
+    """Crea le tabelle del database se non esistono e aggiorna lo schema"""
     with app.app_context():
-        db.create_all()
+        run_migrations()
         print("Database tables created successfully")
 
 if __name__ == '__main__':
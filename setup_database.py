@@ -145,11 +145,12 @@ def create_tables():
 
     try:
         from app import create_app, db
+        from app.migrations import run_migrations
 
         app = create_app()
         with app.app_context():
-            # Crea tutte le tabelle
-            db.create_all()
+            # Crea tutte le tabelle e applica gli aggiornamenti dello schema
+            run_migrations()
             print("✓ Tabelle create con successo")
 
             # Verifica tabelle create
@@ -160,7 +161,7 @@ def create_tables():
             print(f"✓ Tabelle trovate: {', '.join(tables)}")
 
             # Verifica struttura tabelle principali
-            expected_tables = ['users', 'groups', 'group_users', 'message_logs']
+            expected_tables = ['users', 'groups', 'group_users', 'message_bodies', 'message_logs']
             missing_tables = [t for t in expected_tables if t not in tables]
 
             if missing_tables:
@@ -9,12 +9,18 @@ FLUSSO TRADUZIONI:
 4. Traduci manualmente i file .po
 5. python setup_translations.py --compile
 6. Riavvia l'app
+
+--compile ricompila solo i cataloghi con il .po più recente del .mo
+(--compile --force li ricompila tutti); --check esce con codice 1 se ci sono
+cataloghi da ricompilare, per usarlo prima del deploy.
 """
 
 import os
 import sys
 import subprocess
 
+from app.utils.i18n import stale_catalogs
+
 def run_command(command):
     """Esegue un comando e mostra l'output"""
     print(f"🔧 Eseguendo: {command}")
@@ -96,12 +102,18 @@ def update_translations():
 
     return success
 
-def compile_translations():
-    """Compila tutte le traduzioni"""
+def compile_translations(force=False):
+    """Compila le traduzioni modificate dall'ultima compilazione (tutte con force)"""
     print("⚙️  Compilazione traduzioni...")
 
-    cmd = 'pybabel compile -d app/translations'
-    success = run_command(cmd)
+    if force:
+        success = run_command('pybabel compile -d app/translations')
+    else:
+        stale = stale_catalogs()
+        if not stale:
+            print("✅ Traduzioni già aggiornate, niente da compilare")
+            return True
+        success = all(run_command(f'pybabel compile -d app/translations -l {lang}') for lang, _ in stale)
 
     if success:
         print("✅ Traduzioni compilate")
@@ -115,6 +127,18 @@ def compile_translations():
 
     return success
 
+def check_translations():
+    """Controlla che ogni .mo sia aggiornato rispetto al suo .po"""
+    stale = stale_catalogs()
+    if not stale:
+        print("✅ Tutti i cataloghi compilati sono aggiornati")
+        return True
+
+    for lang, reason in stale:
+        print(f"❌ {lang}: {reason}")
+    print("   🔧 Esegui: python setup_translations.py --compile")
+    return False
+
 def show_translation_status():
     """Mostra lo stato delle traduzioni"""
     print("\n📊 STATO TRADUZIONI:")
@@ -216,7 +240,11 @@ def main():
             update_translations()
 
         elif command == '--compile':
-            compile_translations()
+            compile_translations(force='--force' in sys.argv[2:])
+
+        elif command == '--check':
+            if not check_translations():
+                sys.exit(1)
 
         elif command == '--init-all':
             init_all_languages()
@@ -255,7 +283,8 @@ def show_help():
     print("  --init-all     : Inizializza tutte le lingue (en, es, fr, de)")
     print("  --init <lang>  : Inizializza una lingua specifica")
     print("  --update       : Aggiorna traduzioni esistenti")
-    print("  --compile      : Compila traduzioni per l'uso")
+    print("  --compile      : Compila le traduzioni modificate (--force: tutte)")
+    print("  --check        : Verifica che le traduzioni compilate siano aggiornate")
     print("  --status       : Mostra stato traduzioni")
     print("  --full-setup   : Setup completo automatico")
     print("")
@@ -0,0 +1,70 @@
+"""
+Test dei messaggi broadcast: segnaposto, validazione, escape HTML dei
+valori e invio con la Bot API finta
+"""
+
+import pytest
+
+from app import db
+from app.models import Group, User
+from app.utils.broadcast import (BroadcastTemplateError, compile_message, group_by_language, render_for_roster,
+                                 render_variants)
+from app.utils.dispatcher import Recipient
+
+
+def recipient(user_id=1, full_name='Mario Rossi', first_name='Mario', username='mario', language_code=None):
+    return Recipient(user_id, 1000 + user_id, full_name, first_name=first_name, username=username,
+                     language_code=language_code)
+
+
+def test_placeholders_are_replaced():
+    render = compile_message('Ciao {first_name} ({username}), {display_name} {{non è un segnaposto}}')
+
+    assert render(recipient()) == 'Ciao Mario (mario), Mario Rossi {non è un segnaposto}'
+    assert render(recipient(first_name=None, username=None)) == 'Ciao  (), Mario Rossi {non è un segnaposto}'
+
+
+@pytest.mark.parametrize('text', ['Ciao {nome}', 'Ciao {first_name', 'Ciao {first_name!r}', 'Ciao {username:>10}'])
+def test_invalid_placeholders_are_rejected(text):
+    with pytest.raises(BroadcastTemplateError):
+        compile_message(text)
+
+
+def test_placeholder_values_are_html_escaped():
+    render = compile_message('<b>Ciao</b> {first_name} & {display_name} {username}')
+    user = recipient(full_name='A<B & C', first_name='A<B & C', username='x>y')
+
+    # Il markup del template resta, i valori non possono aggiungerne
+    assert render(user) == '<b>Ciao</b> A&lt;B &amp; C & A&lt;B &amp; C x&gt;y'
+
+
+def test_constant_text_is_rendered_once_and_empty_texts_skipped():
+    roster = [recipient(1), recipient(2)]
+    assert compile_message('Uguale per tutti').constant == 'Uguale per tutti'
+    assert list(render_for_roster('  Uguale per tutti ', roster)) == [(roster[0], 'Uguale per tutti'),
+                                                                      (roster[1], 'Uguale per tutti')]
+    assert list(render_for_roster('{username}', [recipient(1, username=None)])) == []
+
+
+def test_language_variants():
+    italian, english, unknown = recipient(1, language_code='it'), recipient(2, language_code='en-GB'), recipient(3)
+    by_language = group_by_language([italian, english, unknown], {'en': 'Hi {first_name}'})
+
+    assert dict(render_variants('Ciao {first_name}', {'en': 'Hi {first_name}'}, by_language)) == {
+        italian: 'Ciao Mario', english: 'Hi Mario', unknown: 'Ciao Mario'
+    }
+
+
+def test_broadcast_escapes_names_sent_to_telegram(app, client, bot_api):
+    group = Group(name='Gruppo')
+    group.users.append(User(telegram_id=777, first_name='A<B & C'))
+    db.session.add(group)
+    db.session.commit()
+
+    response = client.post(f'/groups/{group.id}/broadcast', data={'broadcast_message': '<i>Ciao</i> {first_name}'})
+    assert response.status_code == 302
+
+    sends = [fields for _, method, fields in bot_api.calls if method == 'sendMessage']
+    assert len(sends) == 1
+    assert sends[0]['text'] == '<i>Ciao</i> A&lt;B &amp; C'
+    assert sends[0]['parse_mode'] == 'HTML'
@@ -0,0 +1,64 @@
+"""
+Test dei contatori di versione della cache nella tabella cache_versions
+(senza Redis): dentro una richiesta letture e incrementi sono raggruppati
+"""
+
+from sqlalchemy import event
+
+from app import db
+from app.models import CacheVersion
+from app.utils.cache import cache
+
+
+def stored_version(key):
+    row = db.session.get(CacheVersion, key)
+    return row.version if row else 0
+
+
+def test_increments_outside_a_request_are_applied_at_once(app):
+    cache.invalidate('group', 1)
+    cache.invalidate('group', 1)
+
+    assert stored_version('version:group:1') == 2
+    assert cache.version('group', 1) == 2
+
+
+def test_increments_in_a_request_are_applied_together_before_the_response(app):
+    with app.test_request_context():
+        cache.invalidate('group', 1)
+        cache.invalidate('group', 1)
+        cache.invalidate('groups', 'all')
+
+        # Ancora da applicare, ma la richiesta vede già le nuove versioni
+        assert stored_version('version:group:1') == 0
+        assert cache.version('group', 1) == 2
+        assert cache.key('groups', 'all') == 'groups:all:v1'
+
+        app.process_response(app.response_class())
+        assert stored_version('version:group:1') == 2
+        assert stored_version('version:groups:all') == 1
+
+
+def test_counters_are_read_once_per_request(app):
+    statements = []
+    with app.test_request_context():
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            for _ in range(3):
+                cache.version('users', 'all')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+    assert len([statement for statement in statements if 'cache_versions' in statement]) == 1
+
+
+def test_invalidation_reaches_the_next_request(app, client):
+    @app.route('/_touch/<int:group_id>')
+    def touch(group_id):
+        cache.invalidate('group', group_id)
+        return ''
+
+    version = cache.version('group', 7)
+    client.get('/_touch/7')
+    assert cache.version('group', 7) == version + 1
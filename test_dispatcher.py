@@ -0,0 +1,95 @@
+"""
+Test di dispatch(): invio dal bot assegnato a ogni utente, utenti di un bot
+non più nel pool, disattivazione degli irraggiungibili e retry
+"""
+
+import pytest
+
+from app import db
+from app.models import User
+from app.utils.dispatcher import RateLimiter, Recipient, dispatch, load_roster
+from app.utils.retry import RetryPolicy
+
+FIRST_TOKEN = '111:first'
+SECOND_TOKEN = '222:second'
+
+
+@pytest.fixture
+def bot_pool(monkeypatch):
+    monkeypatch.setenv('TELEGRAM_BOT_TOKENS', f'{FIRST_TOKEN},{SECOND_TOKEN}')
+
+
+def add_users(*bot_ids):
+    users = [User(telegram_id=4000 + i, first_name=f'User{i}', bot_id=bot_id) for i, bot_id in enumerate(bot_ids)]
+    db.session.add_all(users)
+    db.session.commit()
+    return users
+
+
+def send_all(roster, **kwargs):
+    kwargs.setdefault('rate_limiter', RateLimiter(1000))
+    results = {recipient.chat_id: result for recipient, _, result in dispatch(
+        ((recipient, f'Ciao {recipient.first_name}') for recipient in roster), workers=2, **kwargs
+    )}
+    db.session.commit()
+    return results
+
+
+def tokens_by_chat(bot_api):
+    return {int(fields['chat_id']): token for token, method, fields in bot_api.calls if method == 'sendMessage'}
+
+
+def test_each_user_is_sent_from_the_assigned_bot(app, bot_api, bot_pool):
+    add_users(111, 222, None)
+
+    results = send_all(load_roster(user_ids=[user.id for user in User.query]))
+
+    assert all(result['success'] for result in results.values())
+    # Senza bot assegnato: il primo del pool
+    assert tokens_by_chat(bot_api) == {4000: FIRST_TOKEN, 4001: SECOND_TOKEN, 4002: FIRST_TOKEN}
+
+
+def test_users_of_a_bot_not_in_the_pool_are_skipped(app, bot_api, bot_pool):
+    users = add_users(111, 999, 999)
+
+    results = send_all(load_roster(user_ids=[user.id for user in users]))
+
+    # Nessun invio da un altro bot: Telegram risponderebbe 403
+    assert tokens_by_chat(bot_api) == {4000: FIRST_TOKEN}
+    assert results[4001]['success'] is False
+    assert 'non più nel pool' in results[4001]['error']
+    assert results[4001]['error_code'] is None
+    # E non vengono disattivati come irraggiungibili
+    assert all(user.is_active for user in User.query)
+
+
+def test_only_skipped_users_do_not_stop_the_dispatch(app, bot_api, bot_pool):
+    roster = [Recipient(i, 6000 + i, f'User{i}', first_name=f'User{i}', bot_id=999) for i in range(50)]
+    roster.append(Recipient(50, 6050, 'Last', first_name='Last', bot_id=222))
+
+    results = send_all(roster)
+
+    assert len(results) == 51
+    assert tokens_by_chat(bot_api) == {6050: SECOND_TOKEN}
+
+
+def test_unreachable_users_are_deactivated(app, bot_api):
+    blocked, reachable = add_users(None, None)
+    bot_api.fail(blocked.telegram_id, 403, 'Forbidden: bot was blocked by the user')
+
+    results = send_all(load_roster(user_ids=[blocked.id, reachable.id]))
+
+    assert results[blocked.telegram_id]['error_code'] == 403
+    assert db.session.get(User, blocked.id).is_active is False
+    assert db.session.get(User, reachable.id).is_active is True
+
+
+def test_temporary_errors_are_retried(app, bot_api):
+    user, = add_users(None)
+    bot_api.fail(user.telegram_id, 429, 'Too Many Requests')
+    policy = RetryPolicy(max_retries=2, base_delay=0.01, max_delay=0.01)
+
+    results = send_all(load_roster(user_ids=[user.id]), retry_policy=policy)
+
+    assert results[user.telegram_id]['success'] is False
+    assert bot_api.methods().count('sendMessage') == 3
@@ -0,0 +1,104 @@
+"""
+Test della lista membri a pagine (group_members) e dell'invio dei messaggi
+personalizzati quando non tutte le pagine sono state caricate
+"""
+
+import pytest
+
+from app import db
+from app.models import Group, MessageLog, MessageTemplate, User
+from app.routes import groups
+
+
+@pytest.fixture
+def group(app):
+    group = Group(name='Gruppo')
+    group.users.extend(User(telegram_id=7000 + i, first_name=f'User{i}') for i in range(7))
+    db.session.add(group)
+    db.session.commit()
+    return group
+
+
+def member_ids(group):
+    return sorted(user.id for user in group.users)
+
+
+def create_template(client, group, texts):
+    form = {'template_name': 'Promemoria', 'template_description': ''}
+    form.update({f'message_{user_id}': text for user_id, text in texts.items()})
+    assert client.post(f'/groups/{group.id}/templates/create', data=form).status_code == 302
+    return MessageTemplate.query.one()
+
+
+def sent_texts(group):
+    """{user_id: testo} dei messaggi inviati"""
+    return {log.user_id: log.message_text for log in MessageLog.query.filter_by(group_id=group.id, status='sent')}
+
+
+def test_pages_cover_every_member_once(client, group):
+    ids, after = [], 0
+    while after is not None:
+        page = client.get(f'/groups/{group.id}/members', query_string={'after': after, 'limit': 3}).get_json()
+        assert len(page['members']) <= 3
+        ids.extend(member['id'] for member in page['members'])
+        after = page['next_after']
+
+    assert ids == member_ids(group)
+
+
+def test_unknown_group(client, app):
+    assert client.get('/groups/999/members').status_code == 404
+
+
+def test_pages_carry_the_template_texts(client, group):
+    first, second = member_ids(group)[:2]
+    template = create_template(client, group, {first: 'Ciao uno', second: 'Ciao due'})
+
+    page = client.get(f'/groups/{group.id}/members', query_string={'template_id': template.id, 'limit': 2}).get_json()
+
+    assert [member['message_text'] for member in page['members']] == ['Ciao uno', 'Ciao due']
+    assert page['next_after'] == second
+
+
+def test_page_with_more_members_sends_the_pending_fields(client, group, monkeypatch):
+    monkeypatch.setattr(groups, 'GROUP_MEMBERS_PAGE_SIZE', 3)
+
+    html = client.get(f'/groups/{group.id}').get_data(as_text=True)
+
+    assert 'id="memberListMore"' in html
+    assert 'name="fill_message" id="pendingFillMessage" disabled' in html
+
+
+def test_fill_all_reaches_members_not_loaded(client, group, bot_api):
+    ids = member_ids(group)
+    # Prima pagina caricata (con un campo svuotato a mano), le altre no
+    form = {f'direct_message_{user_id}': 'Ciao a tutti' for user_id in ids[:2]}
+    form[f'direct_message_{ids[2]}'] = ''
+    form['fill_message'] = 'Ciao a tutti'
+
+    assert client.post(f'/groups/{group.id}/send_messages', data=form).status_code == 302
+
+    assert sent_texts(group) == {user_id: 'Ciao a tutti' for user_id in ids if user_id != ids[2]}
+
+
+def test_loaded_template_reaches_members_not_loaded(client, group, bot_api):
+    ids = member_ids(group)
+    template = create_template(client, group, {user_id: f'Testo {user_id}' for user_id in ids[1:]})
+    form = {f'direct_message_{ids[0]}': 'Scritto a mano', f'direct_message_{ids[1]}': 'Corretto a mano',
+            'template_id': template.id}
+
+    assert client.post(f'/groups/{group.id}/send_messages', data=form).status_code == 302
+
+    expected = {user_id: f'Testo {user_id}' for user_id in ids[2:]}
+    expected.update({ids[0]: 'Scritto a mano', ids[1]: 'Corretto a mano'})
+    assert sent_texts(group) == expected
+
+
+def test_clear_all_overrides_the_template(client, group, bot_api):
+    ids = member_ids(group)
+    template = create_template(client, group, {user_id: 'Testo' for user_id in ids})
+    form = {f'direct_message_{ids[0]}': 'Solo questo', 'template_id': template.id, 'fill_message': ''}
+
+    assert client.post(f'/groups/{group.id}/send_messages', data=form).status_code == 302
+
+    assert sent_texts(group) == {ids[0]: 'Solo questo'}
@@ -0,0 +1,42 @@
+"""
+Test di MessageBody.intern_many: testi nuovi inseriti nello stesso momento
+da un'altra richiesta (conflitto sull'indice unico di hash)
+"""
+
+from datetime import datetime
+
+from sqlalchemy import event, insert
+
+from app import db
+from app.models import MessageBody
+
+
+def test_intern_many_creates_and_reuses_bodies(app):
+    first = MessageBody.intern_many(['Ciao', 'Buongiorno', 'Ciao'])
+    db.session.commit()
+    second = MessageBody.intern_many(text for text in ['Ciao', 'Buonasera'])
+
+    assert set(first) == {'Ciao', 'Buongiorno'}
+    assert second['Ciao'].id == first['Ciao'].id
+    assert second['Buonasera'].content == 'Buonasera'
+
+
+def test_intern_many_concurrent_insert(app):
+    """Un'altra richiesta inserisce lo stesso testo tra la lettura e l'inserimento"""
+    text = 'Messaggio inviato da due richieste insieme'
+
+    def insert_from_other_request(session, flush_context, instances):
+        with db.engine.begin() as conn:
+            conn.execute(insert(MessageBody.__table__).values(
+                hash=MessageBody.hash_text(text), content=text, created_at=datetime.utcnow()
+            ))
+
+    event.listen(db.session(), 'before_flush', insert_from_other_request, once=True)
+
+    # Un generatore, come in _send_jobs: dopo il conflitto va riletto
+    bodies = MessageBody.intern_many(message for message in [text, 'Altro testo'])
+    db.session.commit()
+
+    assert set(bodies) == {text, 'Altro testo'}
+    assert bodies[text].id is not None
+    assert MessageBody.query.filter_by(hash=MessageBody.hash_text(text)).count() == 1
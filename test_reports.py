@@ -0,0 +1,65 @@
+"""
+Test dei report di debug: salvati nel database, visibili da qualsiasi
+worker e limitati agli ultimi max_reports per gruppo
+"""
+
+from app import db
+from app.models import Group
+from app.utils.reports import MAX_LINES, ReportStore
+
+
+def make_group(name='Gruppo'):
+    group = Group(name=name)
+    db.session.add(group)
+    db.session.commit()
+    return group
+
+
+def test_reports_are_shared_between_workers(app):
+    group = make_group()
+    # Due store come in due worker diversi
+    first_worker, second_worker = ReportStore(), ReportStore()
+
+    first = first_worker.new('Debug bot', group.id)
+    first.add('error', 'Token mancante')
+    first_worker.save(first)
+    second = second_worker.save(second_worker.new('Ultimi log', group.id))
+
+    assert first.id != second.id
+    loaded = second_worker.get(first.id)
+    assert (loaded.title, loaded.group_id, loaded.lines) == ('Debug bot', group.id, [('error', 'Token mancante')])
+    assert [report.id for report in first_worker.recent(group.id)] == [second.id, first.id]
+
+
+def test_lines_are_capped_and_old_reports_pruned(app):
+    group, other = make_group(), make_group('Altro')
+    store = ReportStore(max_reports=3)
+
+    report = store.new('Tante righe', group.id)
+    for i in range(MAX_LINES + 5):
+        report.add('info', f'riga {i}')
+    store.save(report)
+    other_report = store.save(store.new('Altro gruppo', other.id))
+    saved = [store.save(store.new(f'Report {i}', group.id)).id for i in range(3)]
+
+    assert store.get(report.id) is None
+    assert [item.id for item in store.recent(group.id)] == saved[::-1]
+    assert store.get(other_report.id) is not None
+    assert report.dropped == 5 and len(report.lines) == MAX_LINES
+
+
+def test_report_route(app, client, bot_api):
+    group = make_group()
+
+    response = client.get(f'/groups/{group.id}/debug_bot')
+    assert response.status_code == 200
+
+    report_id = ReportStore().recent(group.id)[0].id
+    response = client.get(f'/groups/{group.id}/reports/{report_id}')
+    assert response.status_code == 200
+    assert 'Debug bot' in response.get_data(as_text=True)
+
+    # Report di un altro gruppo, o non più disponibile
+    other = make_group('Altro')
+    assert client.get(f'/groups/{other.id}/reports/{report_id}').status_code == 302
+    assert client.get(f'/groups/{group.id}/reports/{report_id + 100}').status_code == 302
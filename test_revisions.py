@@ -0,0 +1,129 @@
+"""
+Test di correzione, ritiro e retry di un invio già fatto: ogni messaggio si
+modifica con il bot che lo ha inviato, anche se l'utente ha cambiato bot
+"""
+
+import pytest
+
+from app import db
+from app.models import Dispatch, Group, MessageLog, User
+
+FIRST_TOKEN = '111:first'
+SECOND_TOKEN = '222:second'
+
+
+@pytest.fixture
+def bot_pool(monkeypatch):
+    monkeypatch.setenv('TELEGRAM_BOT_TOKENS', f'{FIRST_TOKEN},{SECOND_TOKEN}')
+
+
+@pytest.fixture
+def group(app):
+    group = Group(name='Gruppo')
+    group.users.extend([
+        User(telegram_id=6000, first_name='Anna', bot_id=111),
+        User(telegram_id=6001, first_name='Bruno', bot_id=222),
+    ])
+    db.session.add(group)
+    db.session.commit()
+    return group
+
+
+def calls(bot_api, method):
+    """{chat_id: (token, campi)} delle chiamate a un metodo"""
+    return {int(fields['chat_id']): (token, fields) for token, name, fields in bot_api.calls if name == method}
+
+
+def broadcast(client, group):
+    response = client.post(f'/groups/{group.id}/broadcast', data={'broadcast_message': 'Ciao {first_name}'})
+    assert response.status_code == 302
+    return Dispatch.query.filter_by(group_id=group.id, kind='broadcast').one()
+
+
+def switch_bots(group):
+    """import_users riassegna gli utenti a un altro bot del pool"""
+    for user in group.users:
+        user.bot_id = 222 if user.bot_id == 111 else 111
+    db.session.commit()
+
+
+def test_sent_messages_record_the_sending_bot(client, group, bot_api, bot_pool):
+    source = broadcast(client, group)
+
+    assert {log.user.telegram_id: log.bot_id for log in source.message_logs} == {6000: 111, 6001: 222}
+
+
+def test_edit_goes_through_the_bot_that_sent_the_message(client, group, bot_api, bot_pool):
+    source = broadcast(client, group)
+    sent = calls(bot_api, 'sendMessage')
+    switch_bots(group)
+
+    response = client.post(f'/groups/{group.id}/dispatches/{source.id}/edit', data={'edit_message': 'Ciao di nuovo {first_name}'})
+    assert response.status_code == 302
+
+    edits = calls(bot_api, 'editMessageText')
+    assert {chat_id: token for chat_id, (token, _) in edits.items()} == {6000: FIRST_TOKEN, 6001: SECOND_TOKEN}
+    assert edits[6000][1]['text'] == 'Ciao di nuovo Anna'
+    revision = Dispatch.query.filter_by(kind='edit').one()
+    assert revision.source_dispatch_id == source.id
+    assert {log.user.telegram_id: (log.status, log.bot_id) for log in revision.message_logs} == {
+        6000: ('sent', 111), 6001: ('sent', 222)
+    }
+    assert len(sent) == 2
+
+
+def test_delete_album_and_legacy_logs(client, group, bot_api, bot_pool):
+    anna, bruno = sorted(group.users, key=lambda user: user.telegram_id)
+    source = Dispatch(group_id=group.id, kind='media')
+    db.session.add(source)
+    db.session.flush()
+    db.session.add_all([
+        MessageLog(group_id=group.id, user_id=anna.id, dispatch_id=source.id, message_text='Foto',
+                   status='sent', telegram_message_id='10,11', bot_id=222),
+        # Log salvato prima di MessageLog.bot_id: resta il bot attuale dell'utente
+        MessageLog(group_id=group.id, user_id=bruno.id, dispatch_id=source.id, message_text='Foto',
+                   status='sent', telegram_message_id='12'),
+    ])
+    db.session.commit()
+
+    response = client.post(f'/groups/{group.id}/dispatches/{source.id}/delete')
+    assert response.status_code == 302
+
+    token, fields = calls(bot_api, 'deleteMessages')[6000]
+    assert token == SECOND_TOKEN
+    assert [int(message_id) for message_id in fields['message_ids']] == [10, 11]
+    assert calls(bot_api, 'deleteMessage')[6001][0] == SECOND_TOKEN
+
+
+def test_retry_of_a_failed_edit_uses_the_original_bot(client, group, bot_api, bot_pool):
+    source = broadcast(client, group)
+    bot_api.fail(6000, 429, 'Too Many Requests: retry later')
+    client.post(f'/groups/{group.id}/dispatches/{source.id}/edit', data={'edit_message': 'Corretto'})
+    revision = Dispatch.query.filter_by(kind='edit').one()
+    failed = MessageLog.query.filter_by(dispatch_id=revision.id, status='failed').one()
+    assert failed.user.telegram_id == 6000
+
+    switch_bots(group)
+    bot_api.failures.clear()
+    bot_api.calls.clear()
+    response = client.post(f'/groups/{group.id}/dispatches/{revision.id}/retry')
+    assert response.status_code == 302
+
+    assert [(token, int(fields['chat_id'])) for token, _, fields in bot_api.calls] == [(FIRST_TOKEN, 6000)]
+    db.session.refresh(failed)
+    assert (failed.status, failed.bot_id) == ('sent', 111)
+
+
+def test_delete_group_with_revisions(client, group, bot_api, bot_pool):
+    source = broadcast(client, group)
+    client.post(f'/groups/{group.id}/dispatches/{source.id}/edit', data={'edit_message': 'Corretto'})
+    revision = Dispatch.query.filter_by(kind='edit').one()
+    client.post(f'/groups/{group.id}/dispatches/{revision.id}/retry')
+    group_id = group.id
+
+    response = client.post(f'/groups/{group_id}/delete')
+    assert response.status_code == 302
+
+    assert db.session.get(Group, group_id) is None
+    assert Dispatch.query.filter_by(group_id=group_id).count() == 0
+    assert MessageLog.query.filter_by(group_id=group_id).count() == 0
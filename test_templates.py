@@ -0,0 +1,98 @@
+"""
+Test dei template versionati: ogni modifica crea una nuova versione e le
+versioni precedenti restano ricostruibili
+"""
+
+import pytest
+
+from app import db
+from app.models import Group, MessageTemplate, TemplateMessage, User
+
+
+@pytest.fixture
+def group(app):
+    group = Group(name='Gruppo')
+    group.users.extend(User(telegram_id=3000 + i, first_name=f'User{i}') for i in range(4))
+    db.session.add(group)
+    db.session.commit()
+    return group
+
+
+def member_ids(group):
+    return sorted(user.id for user in group.users)
+
+
+def create_template(client, group, texts):
+    form = {'template_name': 'Promemoria', 'template_description': ''}
+    form.update({f'message_{user_id}': text for user_id, text in texts.items()})
+    assert client.post(f'/groups/{group.id}/templates/create', data=form).status_code == 302
+    return MessageTemplate.query.one()
+
+
+def edit_template(client, group, template, texts):
+    form = {'template_name': template.name, 'template_description': ''}
+    form.update({f'message_{template.id}_{user_id}': text for user_id, text in texts.items()})
+    return client.post(f'/groups/{group.id}/templates/{template.id}/edit', data=form)
+
+
+def messages(template, version=None):
+    """{user_id: (testo, posizione)} della versione indicata (default la corrente)"""
+    condition = TemplateMessage.at_version(version) if version else TemplateMessage.current()
+    return {
+        message.user_id: (message.message_text, message.order_index)
+        for message in TemplateMessage.query.filter(TemplateMessage.template_id == template.id, condition)
+    }
+
+
+def test_edit_creates_a_new_version_and_keeps_the_old_one(client, group):
+    first, second, third, _ = member_ids(group)
+    template = create_template(client, group, {first: 'Uno', second: 'Due', third: 'Tre'})
+    assert template.version == 1
+
+    response = edit_template(client, group, template, {first: 'Uno', second: 'Due corretto', third: 'Tre'})
+    assert response.status_code == 302
+
+    db.session.refresh(template)
+    assert template.version == 2
+    assert messages(template) == {first: ('Uno', 0), second: ('Due corretto', 1), third: ('Tre', 2)}
+    assert messages(template, 1) == {first: ('Uno', 0), second: ('Due', 1), third: ('Tre', 2)}
+    # Il testo invariato è la stessa riga in entrambe le versioni
+    assert TemplateMessage.query.filter_by(user_id=first).count() == 1
+
+
+def test_saving_without_changes_keeps_the_version(client, group):
+    first, second, _, _ = member_ids(group)
+    template = create_template(client, group, {first: 'Uno', second: 'Due'})
+
+    edit_template(client, group, template, {first: 'Uno', second: 'Due'})
+
+    db.session.refresh(template)
+    assert template.version == 1
+    assert TemplateMessage.query.count() == 2
+
+
+def test_removed_message_and_departed_member_are_closed(client, group):
+    first, second, third, fourth = member_ids(group)
+    template = create_template(client, group, {first: 'Uno', second: 'Due', third: 'Tre', fourth: 'Quattro'})
+
+    assert client.post(f'/groups/{group.id}/remove_user/{first}').status_code == 302
+    edit_template(client, group, template, {second: 'Due', third: '', fourth: 'Quattro'})
+
+    db.session.refresh(template)
+    assert template.version == 2
+    # Numerati di nuovo nell'ordine dei membri, senza buchi né doppioni
+    assert messages(template) == {second: ('Due', 0), fourth: ('Quattro', 1)}
+    assert messages(template, 1) == {first: ('Uno', 0), second: ('Due', 1), third: ('Tre', 2), fourth: ('Quattro', 3)}
+
+
+def test_edit_without_messages_is_rejected(client, group):
+    first, _, _, _ = member_ids(group)
+    template = create_template(client, group, {first: 'Uno'})
+
+    response = edit_template(client, group, template, {first: ''})
+
+    assert response.status_code == 200
+    assert 'almeno un messaggio' in response.get_data(as_text=True)
+    db.session.refresh(template)
+    assert template.version == 1
+    assert messages(template) == {first: ('Uno', 0)}
@@ -0,0 +1,124 @@
+"""
+Test della ricerca utenti: cache dei risultati, ricerche che ne estendono
+una già in cache, invalidazione ed esclusione dei membri di un gruppo
+"""
+
+import pytest
+
+from app import db
+from app.models import Group, User
+from app.utils import user_search
+from app.utils.cache import LRUCache, cache
+
+
+@pytest.fixture(autouse=True)
+def results(monkeypatch):
+    """Cache dei risultati vuota per ogni test (le versioni ripartono da capo a ogni database)"""
+    monkeypatch.setattr(user_search, '_results', LRUCache(max_entries=4096, default_ttl=60))
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    """Termini di ogni ricerca arrivata al database"""
+    calls = []
+    query_hits = user_search._query_hits
+
+    def recording(terms, exclude_group=None):
+        calls.append(terms)
+        return query_hits(terms, exclude_group)
+
+    monkeypatch.setattr(user_search, '_query_hits', recording)
+    return calls
+
+
+def search(client, q, **params):
+    response = client.get('/telegram/users/search', query_string=dict(params, q=q))
+    assert response.status_code == 200
+    return [user['full_name'] for user in response.get_json()['users']]
+
+
+@pytest.fixture
+def people(app):
+    db.session.add_all([
+        User(telegram_id=8000, first_name='Mario', last_name='Rossi', username='mario_r'),
+        User(telegram_id=8001, first_name='Maria', last_name='Bianchi'),
+        User(telegram_id=8002, first_name='Anna', last_name='Maria'),
+    ])
+    db.session.commit()
+
+
+def test_ranking_and_short_terms(client, people):
+    assert search(client, 'mari') == ['Anna Maria', 'Maria Bianchi', 'Mario Rossi']
+    assert search(client, 'mario ros') == ['Mario Rossi']
+    assert search(client, '8001') == ['Maria Bianchi']
+    assert search(client, 'm') == []
+
+
+def test_longer_searches_are_filtered_from_the_cache(client, people, queries):
+    assert search(client, 'ros') == ['Mario Rossi']
+    assert search(client, 'ross') == ['Mario Rossi']
+    assert search(client, 'rossi') == ['Mario Rossi']
+    assert search(client, 'ros') == ['Mario Rossi']
+
+    assert queries == [['ros']]
+
+
+def test_user_changes_invalidate_the_results(client, people, queries):
+    assert search(client, 'rossi') == ['Mario Rossi']
+
+    db.session.add(User(telegram_id=8003, first_name='Luca', last_name='Rossi'))
+    db.session.commit()
+    cache.invalidate('users', 'all')
+
+    assert search(client, 'rossi') == ['Luca Rossi', 'Mario Rossi']
+    assert len(queries) == 2
+
+
+def test_members_are_excluded_before_the_row_limit(client, app, monkeypatch):
+    monkeypatch.setattr(user_search, 'SEARCH_CACHE_ROWS', 5)
+    group = Group(name='Grande')
+    group.users.extend(User(telegram_id=8100 + i, first_name=f'Bulk{i:02}') for i in range(10))
+    db.session.add(group)
+    db.session.add_all(User(telegram_id=8200 + i, first_name=f'Bulk{i + 10}') for i in range(3))
+    db.session.commit()
+
+    # I primi SEARCH_CACHE_ROWS risultati sono tutti membri del gruppo
+    assert search(client, 'bulk', exclude_group=group.id) == ['Bulk10', 'Bulk11', 'Bulk12']
+    assert len(search(client, 'bulk', limit=50)) == 5
+
+
+def test_exclusion_follows_group_changes(client, people):
+    group = Group(name='Gruppo')
+    db.session.add(group)
+    db.session.commit()
+    assert search(client, 'mari', exclude_group=group.id) == ['Anna Maria', 'Maria Bianchi', 'Mario Rossi']
+
+    maria = User.query.filter_by(telegram_id=8001).one()
+    assert client.post(f'/groups/{group.id}/add_user', data={'user_id': maria.id}).status_code == 302
+
+    assert search(client, 'mari', exclude_group=group.id) == ['Anna Maria', 'Mario Rossi']
+    assert search(client, 'maria', exclude_group=group.id) == ['Anna Maria']
+    assert search(client, 'mari') == ['Anna Maria', 'Maria Bianchi', 'Mario Rossi']
+
+
+class FakeMySQLEngine:
+    dialect = type('Dialect', (), {'name': 'mysql', 'is_mariadb': False})()
+
+
+def test_fulltext_index_is_checked_again_after_the_ttl(monkeypatch):
+    indexes = []
+    now = [1000.0]
+    monkeypatch.setattr(user_search, '_fulltext_engines', {})
+    monkeypatch.setattr(user_search, 'inspect', lambda engine: type('Inspector', (), {
+        'get_indexes': lambda self, table: list(indexes)
+    })())
+    monkeypatch.setattr(user_search.time, 'monotonic', lambda: now[0])
+    engine = FakeMySQLEngine()
+
+    assert user_search._has_fulltext_index(engine) is False
+    # Migrazione eseguita con l'app avviata
+    indexes.append({'name': user_search.FULLTEXT_INDEX, 'column_names': ['username']})
+    assert user_search._has_fulltext_index(engine) is False
+
+    now[0] += user_search.FULLTEXT_CHECK_TTL
+    assert user_search._has_fulltext_index(engine) is True
@@ -0,0 +1,95 @@
+"""
+Test di /telegram/users: GET condizionali, sincronizzazione con ?since= e
+paginazione a cursore
+"""
+
+from datetime import datetime
+
+from app import db
+from app.models import User
+
+BASE_TIME = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def add_users(count, updated_at=BASE_TIME, **fields):
+    users = [User(telegram_id=5000 + User.query.count() + i, first_name=f'User{i}', **fields) for i in range(count)]
+    db.session.add_all(users)
+    db.session.commit()
+    # updated_at esplicito (onupdate lo sovrascriverebbe con l'ora corrente)
+    User.query.filter(User.id.in_([user.id for user in users])).update(
+        {User.updated_at: updated_at}, synchronize_session=False
+    )
+    db.session.commit()
+    return [user.id for user in users]
+
+
+def fetch_all(client, **params):
+    """Tutte le pagine seguendo X-Next-Cursor: lista degli id ricevuti"""
+    ids = []
+    cursor = None
+    while True:
+        query = dict(params, **({'cursor': cursor} if cursor else {}))
+        response = client.get('/telegram/users', query_string=query)
+        assert response.status_code == 200
+        ids.extend(user['id'] for user in response.get_json())
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            return ids
+
+
+def test_etag_and_not_modified(client, app):
+    add_users(3)
+
+    response = client.get('/telegram/users')
+    assert response.status_code == 200
+    assert len(response.get_json()) == 3
+    etag = response.headers['ETag']
+
+    assert client.get('/telegram/users', headers={'If-None-Match': etag}).status_code == 304
+
+    add_users(1)
+    response = client.get('/telegram/users', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.get_json()) == 4
+
+
+def test_since_includes_users_updated_in_the_same_second(client, app):
+    add_users(2, updated_at=datetime(2026, 1, 1, 11, 59, 59))
+    same_second = add_users(2, updated_at=BASE_TIME)
+    deactivated = add_users(1, updated_at=datetime(2026, 1, 1, 12, 0, 5), is_active=False)
+
+    users = client.get('/telegram/users', query_string={'since': '2026-01-01T12:00:00Z'}).get_json()
+
+    assert [user['id'] for user in users] == same_second + deactivated
+    assert users[-1]['is_active'] is False
+
+
+def test_invalid_since_and_cursor(client, app):
+    assert client.get('/telegram/users', query_string={'since': 'ieri'}).status_code == 400
+    assert client.get('/telegram/users', query_string={'cursor': 'x'}).status_code == 400
+
+
+def test_cursor_pages_cover_every_user_once(client, app):
+    user_ids = add_users(25)
+
+    assert fetch_all(client, per_page=10) == user_ids
+    # Molti utenti con lo stesso updated_at: l'id fa da spareggio
+    assert fetch_all(client, since=BASE_TIME.isoformat(), per_page=10) == user_ids
+
+
+def test_user_updated_between_pages_is_not_skipped(client, app):
+    user_ids = add_users(6)
+
+    first = client.get('/telegram/users', query_string={'since': BASE_TIME.isoformat(), 'per_page': 3})
+    assert [user['id'] for user in first.get_json()] == user_ids[:3]
+    assert first.headers['Link'].startswith('</telegram/users?')
+
+    # Tra una pagina e l'altra: un utente già ricevuto e uno non ancora ricevuto cambiano
+    User.query.filter(User.id.in_([user_ids[0], user_ids[4]])).update(
+        {User.updated_at: datetime(2026, 1, 1, 12, 0, 1)}, synchronize_session=False
+    )
+    db.session.commit()
+
+    rest = fetch_all(client, since=BASE_TIME.isoformat(), per_page=3, cursor=first.headers['X-Next-Cursor'])
+    assert set(user_ids[:3]) | set(rest) == set(user_ids)
+    assert rest[-2:] == [user_ids[0], user_ids[4]]
@@ -0,0 +1,14 @@
+"""
+Entry point WSGI per la produzione
+
+Avvio consigliato (usa gunicorn.conf.py nella root del progetto):
+    gunicorn wsgi:app
+
+La configurazione è scelta da FLASK_ENV (default qui: production).
+"""
+
+import os
+
+from app import create_app
+
+app = create_app(os.environ.get('FLASK_ENV', 'production'))